@@ -2,14 +2,48 @@ import pandas as pd
 import requests
 import time
 import logging
-from flask import Flask, request, jsonify
-import re
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
+import threading
+import itertools
+import tempfile
+import json
+import functools
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from datafunctions.dataset_store import DatasetStore, json_records, namespace_pattern, view_page
+from datafunctions.transport import ARROW_STREAM_MIMETYPE, accepts_arrow, arrow_compressions, to_arrow_ipc
+from datafunctions.streaming import prefetch, run_with_progress
+from datafunctions.table_query import filter_query_mask, sort_key, sort_permutation
+from datafunctions.log_config import configure_logging
+from datafunctions.result_cache import ResultCache, hash_stream
+from datafunctions.pipeline import (
+    CLEANED_COLUMNS, CRM_REQUIRED_COLUMNS, TEXT_COLUMNS, PipelineError, audience_tag, crm_cleaning_pipeline,
+)
+from datafunctions.csv_engine import iter_read_csv
+from datafunctions.excel_engine import iter_read_excel
+from datafunctions.columnar import COLUMNAR_MIMETYPES, columnar_available, columnar_format, iter_columnar_chunks, write_columnar
+from datafunctions.metrics import (
+    CRM_INFLIGHT, CRM_REQUEST_DURATION, CRM_RESPONSES, CRM_RETRIES, DATASET_STORE_BYTES,
+    ROWS_PROCESSED, STREAM_QUEUE_DEPTH, render_metrics, time_stage,
+)
+from datafunctions.data_processing import add_tags, delete_tags, select_columns
+from datafunctions.exports import (
+    XLSX_MIMETYPE, export_compressions, export_filename, iter_csv_chunks, iter_file_chunks, write_xlsx, xlsx_available,
+)
+from datafunctions.filter_engine import FilterEngine
+from datafunctions.profiling import ProfileCache
+from datafunctions.partitions import partition_formats, plan_partitions, write_partitions, zip_directory
+from datafunctions.segments import SegmentEngine
+from datafunctions.tag_index import TagIndexCache
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Derived DataFrames share unchanged columns with their source, so dataset versions that
+# only rewrite a column (e.g. tag edits) do not copy the rest of the data
+pd.set_option('mode.copy_on_write', True)
+
 # Access the GoHighLevel API key
 gohighlevel_api_key = os.getenv("GOHIGHLEVEL_API_KEY")
 
@@ -20,15 +54,11 @@ app = Flask(__name__)
 # Ensure the log file is created in the root directory
 log_file_path = os.path.join(os.getcwd(), 'process_logs.log')
 
-# Configure logging to output to both the console and the file
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s]: %(message)s',
-    handlers=[
-        logging.FileHandler(log_file_path),
-        logging.StreamHandler()
-    ]
-)
+# Configure asynchronous logging to the console and a rotating JSON-lines file
+configure_logging(log_file_path)
+
+# Per-contact records go through their own logger, which is sampled
+contact_logger = logging.getLogger("crm.contacts")
 
 #set the based url 
 # Corrected base URL for creating contacts
@@ -40,110 +70,154 @@ headers = {
         "Content-Type": "application/json"
     }
 
-# In-memory storage for processed data
-processed_data_store = []
-
-# Data processing function
-def clean_and_tag_data(df, file_name):
-    if df is None or df.empty:
-        logging.error("No data to process.")
-        return None, "No data to process."
-
-    required_columns = [
-        'MOBILE_PHONE', 'PERSONAL_ADDRESS', 'BUSINESS_EMAIL',
-        'PERSONAL_EMAIL', 'DNC', 'FIRST_NAME', 'LAST_NAME',
-        'PERSONAL_CITY', 'PERSONAL_STATE', 'PERSONAL_ZIP'
-    ]
-    missing_columns = [col for col in required_columns if col not in df.columns]
-    if missing_columns:
-        error_msg = f"Missing required columns: {', '.join(missing_columns)}"
-        logging.error(error_msg)
-        return None, error_msg
-
-    try:
-        df = df[required_columns].copy()
-        df['MOBILE_PHONE'] = df['MOBILE_PHONE'].astype(str)
-        df['Tag'] = ''
-        po_box_pattern = re.compile(r'\b[Pp]\.? *[Oo]\.? *Box\b')
-        phone_pattern = re.compile(r'\+?\d[\d\s-]*\d')
-
-        def tag_row(row):
-            tags = []
-            if 'B2B' in file_name.upper():
-                tags.append('advertiser')
-            elif 'B2C' in file_name.upper():
-                tags.append('reader')
-
-            if pd.notna(row['PERSONAL_ADDRESS']):
-                if po_box_pattern.search(row['PERSONAL_ADDRESS']) or '-' in row['PERSONAL_ADDRESS']:
-                    row[['PERSONAL_ADDRESS', 'PERSONAL_STATE', 'PERSONAL_ZIP']] = pd.NA
-                else:
-                    tags.append('programmatic')
-
-            if pd.notna(row['BUSINESS_EMAIL']) and row['BUSINESS_EMAIL'] != '-':
-                tags.append('email')
-            if pd.notna(row['PERSONAL_EMAIL']) and row['PERSONAL_EMAIL'] != '-':
-                tags.append('social')
-
-            if row['DNC'] == 'Y':
-                row['MOBILE_PHONE'] = pd.NA
-            elif pd.notna(row['MOBILE_PHONE']) and row['MOBILE_PHONE'] != '-':
-                phone_match = phone_pattern.search(row['MOBILE_PHONE'])
-                if phone_match:
-                    digits_only = re.sub(r'[^\d]', '', phone_match.group())
-                    if len(digits_only) >= 10:
-                        if len(digits_only) == 11 and digits_only.startswith('1'):
-                            digits_only = digits_only[1:]
-                        row['MOBILE_PHONE'] = digits_only[:10]
-                        tags.append('sms')
-                    else:
-                        row['MOBILE_PHONE'] = pd.NA
-
-            row['Tag'] = ', '.join(tags)
-            return row
-
-        df = df.apply(tag_row, axis=1)
-        selected_columns = [
-            'FIRST_NAME', 'LAST_NAME', 'BUSINESS_EMAIL', 'MOBILE_PHONE',
-            'PERSONAL_ADDRESS', 'PERSONAL_CITY', 'PERSONAL_STATE', 'PERSONAL_ZIP',
-            'PERSONAL_EMAIL', 'Tag'
-        ]
-        df = df[[col for col in selected_columns if col in df.columns]].replace('-', '')
-        df['MOBILE_PHONE'] = df['MOBILE_PHONE'].fillna("")
-
-        logging.info("Data processing completed successfully.")
-        return df, None
+# In-memory storage for processed dataset versions
+# (set DATASET_STORE_DIR to a shared directory when running several server workers)
+dataset_store = DatasetStore(
+    max_versions=int(os.getenv("DATASET_STORE_MAX_VERSIONS", 50)),
+    directory=os.getenv("DATASET_STORE_DIR") or None,
+    max_bytes=int(os.getenv("DATASET_STORE_MAX_BYTES", 2 * 1024 ** 3)),
+)
 
-    except Exception as e:
-        logging.error(f"Error processing data: {str(e)}")
-        return None, str(e)
+# Number of rows returned in the preview page of every dataset response
+preview_page_size = int(os.getenv("PREVIEW_PAGE_SIZE", 10))
+
+# Number of sorted and filtered views (row orders and masks) cached per worker for table browsing
+view_cache_size = int(os.getenv("VIEW_CACHE_SIZE", 16))
+
+# Column indexes used by the filter endpoint, kept for the most recently filtered dataset versions
+filter_engine = FilterEngine(max_datasets=view_cache_size)
+
+# Segment queries evaluate tags through tag indexes and cache their subexpression masks per version
+tag_indexes = TagIndexCache(max_entries=view_cache_size)
+segment_engine = SegmentEngine(filter_engine, tag_indexes,
+                               max_bytes=int(os.getenv("SEGMENT_CACHE_MAX_BYTES", 64 * 1024 ** 2)))
+
+# Column statistics of recent dataset versions, updated from the parent version after each operation
+profiles = ProfileCache(max_entries=view_cache_size)
+
+# Streaming ingest-to-CRM settings: rows parsed per chunk and cleaned chunks allowed to wait for the loader
+stream_chunk_size = int(os.getenv("STREAM_CHUNK_SIZE", 5000))
+stream_queue_size = int(os.getenv("STREAM_QUEUE_SIZE", 4))
+
+# Columns read from uploaded Parquet and Feather files: the ones the cleaning pipeline uses
+upload_columns = list(dict.fromkeys(CRM_REQUIRED_COLUMNS + CLEANED_COLUMNS))
+
+# Rows rendered per chunk of a streamed export
+export_chunk_rows = int(os.getenv("EXPORT_CHUNK_ROWS", 50000))
+
+# Files written at the same time by a partitioned export
+export_workers = int(os.getenv("EXPORT_WORKERS", 4))
+
+# Version of the cleaning logic; bump it whenever the cleaning pipeline changes so cached uploads are recomputed
+pipeline_version = "5"
+
+# Disk cache of processed uploads, keyed by file content, operation and pipeline version
+upload_cache = ResultCache(
+    os.getenv("UPLOAD_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "data-process-app", "upload-cache"),
+    max_bytes=int(os.getenv("UPLOAD_CACHE_MAX_BYTES", 1024 ** 3)),
+)
+
+# CRM loads currently running in this worker, drained before the worker shuts down
+inflight_loads = 0
+inflight_loads_changed = threading.Condition()
+
+@contextmanager
+def track_load():
+    global inflight_loads
+    with inflight_loads_changed:
+        inflight_loads += 1
+    try:
+        yield
+    finally:
+        with inflight_loads_changed:
+            inflight_loads -= 1
+            inflight_loads_changed.notify_all()
+
+def wait_for_loads(timeout=None):
+    """
+    Block until no CRM load is running in this worker, or until the timeout expires.
+
+    Returns:
+        bool: True if all loads finished, False if some were still running at the timeout.
+    """
+    with inflight_loads_changed:
+        if inflight_loads:
+            logging.info(f"Waiting for {inflight_loads} in-flight CRM load(s) to finish.")
+        return inflight_loads_changed.wait_for(lambda: inflight_loads == 0, timeout=timeout)
+
+def clean_for_crm(df, file_name, memoize=True):
+    """
+    Clean and tag a raw audience file for the CRM with the shared cleaning pipeline.
+
+    Raises:
+        PipelineError: If the data is empty or required columns are missing.
+    """
+    processed_df = crm_cleaning_pipeline.run(df, overrides={'tag': {'file_tag': audience_tag(file_name)}}, memoize=memoize)
+    logging.info("Data processing completed successfully.")
+    return processed_df
+
+# Mapping of processed dataset columns to GoHighLevel contact fields
+gohighlevel_fields = {
+    "FIRST_NAME": "firstName",
+    "LAST_NAME": "lastName",
+    "BUSINESS_EMAIL": "email",
+    "MOBILE_PHONE": "phone",
+    "PERSONAL_ADDRESS": "address1",
+    "PERSONAL_CITY": "city",
+    "PERSONAL_STATE": "state",
+    "PERSONAL_ZIP": "postalCode",
+}
+
+def contact_field_values(column):
+    """
+    Convert a column to a list of stripped strings, with missing values as empty strings.
+    """
+    # Whole-number float columns (e.g. ZIP codes read with missing values) must not end in '.0'
+    if pd.api.types.is_float_dtype(column):
+        try:
+            column = column.astype("Int64")
+        except (TypeError, ValueError):
+            pass
+    return column.astype("string").str.strip().fillna("").tolist()
 
 # Function to structure data for GoHighLevel
-def structure_data_for_gohighlevel(df):
-    """
-    Converts a DataFrame to a list of contact dictionaries suitable for GoHighLevel API.
-    """
-    # Replace NaN and set defaults at the DataFrame level for performance
-    df.fillna({
-        "FIRST_NAME": "", "LAST_NAME": "", "BUSINESS_EMAIL": "", "MOBILE_PHONE": "",
-        "PERSONAL_ADDRESS": "", "PERSONAL_CITY": "", "PERSONAL_STATE": "", "PERSONAL_ZIP": "", "Tag": ""
-    }, inplace=True)
-    
-    # Convert DataFrame to list of dicts for GoHighLevel API
-    contacts_list = df.apply(lambda row: {
-        "firstName": row["FIRST_NAME"],
-        "lastName": row["LAST_NAME"],
-        "email": row["BUSINESS_EMAIL"],
-        "phone": row["MOBILE_PHONE"],
-        "address1": row["PERSONAL_ADDRESS"],
-        "city": row["PERSONAL_CITY"],
-        "state": row["PERSONAL_STATE"],
-        "postalCode": str(row["PERSONAL_ZIP"]),
-        "tags": row["Tag"].split(", ")
-    }, axis=1).tolist()
-
-    logging.info(f"Structured {len(contacts_list)} contacts for GoHighLevel.")
-    return contacts_list
+def structure_data_for_gohighlevel(df, batch_size=1000):
+    """
+    Lazily converts a DataFrame to contact dictionaries suitable for GoHighLevel API.
+
+    The DataFrame is processed column by column, one batch of rows at a time, so the first
+    contacts are available before the rest are built and memory stays flat for any list size.
+    Empty fields are left out of the contact payload.
+
+    Args:
+        df (pd.DataFrame): The processed dataset.
+        batch_size (int): Number of rows converted at a time.
+
+    Yields:
+        dict: One contact payload per row.
+    """
+    fields = [(column, field) for column, field in gohighlevel_fields.items() if column in df.columns]
+    total = 0
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        columns = [contact_field_values(batch[column]) for column, _ in fields]
+        names = [field for _, field in fields]
+
+        if "Tag" in batch.columns:
+            tags = batch["Tag"].astype("string").fillna("").str.split(", ").tolist()
+        else:
+            tags = [[]] * len(batch)
+
+        ROWS_PROCESSED.labels("structure").inc(len(batch))
+        for *values, row_tags in zip(*columns, tags):
+            contact = {name: value for name, value in zip(names, values) if value}
+            row_tags = [t for t in row_tags if t]
+            if row_tags:
+                contact["tags"] = row_tags
+            yield contact
+        total += len(batch)
+
+    logging.info(f"Structured {total} contacts for GoHighLevel.")
 
 # Function to create a contact with retry logic for rate limits
 def create_contact(contact_data, retries=3, backoff_factor=2):
@@ -151,14 +225,24 @@ def create_contact(contact_data, retries=3, backoff_factor=2):
     Attempts to create a contact in GoHighLevel, handling rate limits with exponential backoff.
     """
     try:
-        response = requests.post(gohighlevel_base_url, json=contact_data, headers=headers)
-        
+        CRM_INFLIGHT.inc()
+        try:
+            with CRM_REQUEST_DURATION.time():
+                response = requests.post(gohighlevel_base_url, json=contact_data, headers=headers)
+        except requests.exceptions.RequestException:
+            CRM_RESPONSES.labels("error").inc()
+            raise
+        finally:
+            CRM_INFLIGHT.dec()
+        CRM_RESPONSES.labels(str(response.status_code)).inc()
+
         # Handle rate limiting
         if response.status_code == 429:
             retry_after = int(response.headers.get('Retry-After', 10))  # Use 'Retry-After' header if available
             logging.warning(f"Rate limit exceeded. Retrying after {retry_after} seconds.")
             time.sleep(retry_after)
             if retries > 0:
+                CRM_RETRIES.labels("rate_limit").inc()
                 return create_contact(contact_data, retries - 1, backoff_factor)
             else:
                 logging.error("Max retries reached. Contact not created due to rate limits.")
@@ -166,7 +250,6 @@ def create_contact(contact_data, retries=3, backoff_factor=2):
 
         # Raise exception for other HTTP errors
         response.raise_for_status()
-        logging.info(f"Contact created successfully: {response.json()}")
         return response.json()
 
     except requests.exceptions.HTTPError as err:
@@ -175,30 +258,326 @@ def create_contact(contact_data, retries=3, backoff_factor=2):
         logging.error(f"Request error occurred: {err}")
 
 #Load contacts in batches with customizable batch size and pause duration
-def load_contacts_in_batches(contacts_list, batch_size=100, pause_duration=10):
+def load_contacts_in_batches(contacts, batch_size=100, pause_duration=10, on_progress=None, cancelled=None):
     """
     Loads contacts into GoHighLevel in batches, pausing to respect API rate limits.
+    Contacts can be any iterable, so sending starts as soon as the first contact is built.
+
+    Args:
+        on_progress (callable, optional): Called after every contact with the number of contacts
+                                          sent, loaded and failed so far.
+        cancelled (threading.Event, optional): Stops loading before the next contact once set.
+
+    Returns:
+        tuple: The number of contacts loaded and failed.
     """
-    for i, contact in enumerate(contacts_list):
+    loaded = failed = 0
+    i = -1
+    for i, contact in enumerate(contacts):
+        if cancelled is not None and cancelled.is_set():
+            logging.warning(f"Loading cancelled after {i} contacts ({loaded} loaded, {failed} failed).")
+            return loaded, failed
         try:
-            logging.info(f"Attempting to load contact {i + 1}: {contact}")  # Log contact data before sending
+            contact_logger.debug("Sending contact", extra={"contact_number": i + 1, "contact": contact})
             response = create_contact(contact)
             if response:
-                logging.info(f"Contact {i + 1} successfully loaded into CRM: {response}")
+                loaded += 1
+                ROWS_PROCESSED.labels("load").inc()
+                contact_logger.info("Contact loaded into CRM", extra={
+                    "contact_number": i + 1, "contact_id": (response.get("contact") or {}).get("id")
+                })
             else:
-                logging.warning(f"Contact {i + 1} failed to load due to an issue with the response.")
+                failed += 1
+                contact_logger.warning("Contact failed to load due to an issue with the response.", extra={"contact_number": i + 1})
         except Exception as e:
-            logging.error(f"Failed to create contact {i + 1}: {e}")
+            failed += 1
+            contact_logger.error(f"Failed to create contact: {e}", extra={"contact_number": i + 1})
+
+        if on_progress is not None:
+            on_progress(i + 1, loaded, failed)
 
         # Pause after each batch to respect API limits
         if (i + 1) % batch_size == 0:
-            logging.info(f"Processed {i + 1} contacts. Pausing for {pause_duration} seconds.")
-            time.sleep(pause_duration)
+            logging.info(f"Processed {i + 1} contacts ({loaded} loaded, {failed} failed). Pausing for {pause_duration} seconds.")
+            if cancelled is not None:
+                cancelled.wait(pause_duration)
+            else:
+                time.sleep(pause_duration)
+
+    logging.info(f"Finished loading {i + 1} contacts: {loaded} loaded, {failed} failed.")
+    return loaded, failed
+
+def stream_size(stream):
+    """Return the size in bytes of a seekable stream, leaving it at its start."""
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(0)
+    return size
+
+def read_upload_in_chunks(stream, file_name, chunk_size, on_progress=None):
+    """
+    Parse an uploaded file chunk by chunk, reporting the rows parsed and the fraction of the file read.
+
+    Args:
+        stream (file-like object): A seekable binary stream.
+        file_name (str): The file name, which tells CSV from Excel, Parquet and Feather files.
+        chunk_size (int): Number of rows parsed at a time.
+        on_progress (callable, optional): Called after every chunk with the rows parsed so far
+                                          and the fraction of the file read.
+    """
+    chunks = []
+    rows = 0
+    for chunk, fraction in iter_upload_chunks(stream, file_name, chunk_size):
+        chunks.append(chunk)
+        rows += len(chunk)
+        if on_progress is not None:
+            on_progress(rows, fraction)
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks, ignore_index=True)
+
+def text_columns(chunk):
+    """
+    Cast the phone and ZIP columns of a chunk to text, like the CSV parser reads them.
+
+    Columnar files may store them as floats; integral values lose their trailing '.0'
+    (22201.0 becomes '22201').
+    """
+    for col, dtype in TEXT_COLUMNS.items():
+        if col not in chunk.columns:
+            continue
+        values = chunk[col]
+        if pd.api.types.is_float_dtype(values):
+            integral = values.notna() & (values % 1 == 0)
+            text = values.astype(dtype)
+            text[integral] = values[integral].astype('int64').astype(dtype)
+            values = text
+        chunk[col] = values.astype(dtype)
+    return chunk
+
+def iter_upload_chunks(stream, file_name, chunk_size):
+    """
+    Parse an uploaded CSV, Excel, Parquet or Feather file in chunks of rows.
+
+    Parquet and Feather files only read the columns the cleaning pipeline uses.
+    Excel workbooks are read with the fast reader engine, all matching sheets in turn.
+
+    Yields:
+        tuple: The chunk and the fraction of the file read so far.
+    """
+    file_format = columnar_format(file_name)
+    if file_format:
+        for chunk, fraction in iter_columnar_chunks(stream, file_format, chunk_size, columns=upload_columns):
+            yield text_columns(chunk), fraction
+        return
+    if file_name.lower().endswith('.xlsx'):
+        yield from iter_read_excel(stream, chunk_size, sheets='all', dtype=TEXT_COLUMNS)
+        return
+    size = stream_size(stream) or 1
+    for chunk in iter_read_csv(stream, chunk_size, dtype=TEXT_COLUMNS):
+        yield chunk, min(stream.tell() / size, 1.0)
+
+def iter_cleaned_chunks(file, file_name, chunk_size, on_progress=None):
+    """
+    Parse an uploaded file in chunks and yield each chunk once it has been cleaned and tagged.
+
+    Args:
+        on_progress (callable, optional): Called after every chunk with the rows cleaned so far
+                                          and the fraction of the file read.
+
+    Raises:
+        PipelineError: If a chunk cannot be processed (e.g. required columns are missing).
+    """
+    rows = 0
+    reader = iter_upload_chunks(file, file_name, chunk_size)
+    for i in itertools.count():
+        with time_stage("parse") as run:
+            chunk, fraction = next(reader, (None, 1.0))
+            run.rows = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        with time_stage("clean") as run:
+            # Chunks are seen only once, so caching their stage outputs would only evict useful entries
+            processed_chunk = clean_for_crm(chunk, file_name, memoize=False)
+            run.rows = len(processed_chunk)
+        logging.info(f"Cleaned chunk {i + 1} of '{file_name}' ({len(processed_chunk)} records).")
+        rows += len(chunk)
+        if on_progress is not None:
+            on_progress(rows, fraction)
+        yield processed_chunk
+
+def session_namespace():
+    """Return the dataset namespace of the calling session (sent by the Dash app as X-Session-ID)."""
+    session_id = request.headers.get('X-Session-ID', '')
+    return session_id if namespace_pattern.match(session_id) else 'default'
+
+def requested_view():
+    """
+    Read the table view requested with the query parameters of a dataset request.
+
+    Query parameters:
+        page, page_size   The page of the view to return (page_size is capped at 1000 rows)
+        sort_by           JSON list of {"column_id", "direction"} as sent by a DataTable
+        filter_query      DataTable filter query, e.g. "{Tag} contains sms"
+        columns           Comma-separated columns to return; all columns when omitted
+
+    Raises:
+        ValueError: If sort_by is not a valid sort specification.
+    """
+    page = request.args.get('page', 0, type=int)
+    page_size = min(max(request.args.get('page_size', preview_page_size, type=int), 1), 1000)
+    try:
+        key = sort_key(json.loads(request.args.get('sort_by') or '[]'))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError("Invalid sort_by parameter")
+    filter_query = request.args.get('filter_query', '').strip()
+    columns = parse_list_param(request.args, 'columns') or None
+    return page, page_size, key, filter_query, columns
+
+def requested_page(dataset_id, df):
+    """
+    Slice the page of the (sorted and filtered) dataset view requested by the client, see `requested_view`.
+
+    Returns:
+        tuple: The page DataFrame, the number of rows in the view, the page number and the page size.
+
+    Raises:
+        ValueError: If the requested view is invalid.
+    """
+    page, page_size, key, filter_query, columns = requested_view()
+    # Only the requested slice of the (cached) sorted and filtered view is serialized
+    rows = view_rows(dataset_id, key, filter_query)
+    page_df, total_rows = view_page(df, page, page_size, rows=rows, columns=columns)
+    return page_df, total_rows, page, page_size
+
+def dataset_body(dataset_id, df, message):
+    """
+    Build the body returned by every dataset operation: the version ID and the requested page
+    of the dataset view.
+
+    Raises:
+        ValueError: If the requested view is invalid.
+    """
+    page_df, total_rows, page, page_size = requested_page(dataset_id, df)
+    return {
+        "message": message,
+        "dataset_id": dataset_id,
+        "preview": {
+            "page": page,
+            "page_size": page_size,
+            "total_rows": total_rows,
+            "columns": list(page_df.columns),
+            "data": json_records(page_df),
+        },
+    }
+
+def dataset_response(dataset_id, df, message, status=200):
+    """
+    Return the result of a dataset operation as JSON, or as an Arrow IPC stream when the client
+    accepts one (optionally compressed with the `compression` query parameter, 'lz4' or 'zstd').
+    The Arrow stream holds the page rows; the other fields travel in its schema metadata.
+    """
+    try:
+        if accepts_arrow(request.headers.get('Accept')):
+            compression = request.args.get('compression') or None
+            if compression not in (None,) + arrow_compressions:
+                raise ValueError(f"Unsupported compression '{compression}'")
+            page_df, total_rows, page, page_size = requested_page(dataset_id, df)
+            metadata = {"message": message, "dataset_id": dataset_id, "page": page,
+                        "page_size": page_size, "total_rows": total_rows}
+            return Response(to_arrow_ipc(page_df, metadata, compression=compression),
+                            status=status, mimetype=ARROW_STREAM_MIMETYPE)
+        return jsonify(dataset_body(dataset_id, df, message)), status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def wants_progress():
+    """Whether the client asked for progress events (Accept: application/x-ndjson)."""
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def progress_response(events):
+    """
+    Stream events as JSON lines: progress events while the job runs, then a final
+    {"result": ...} or {"error": ...} event. The request context stays available to the generator.
+    """
+    lines = (json.dumps(event, default=str) + "\n" for event in events)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+
+# Dataset versions never change, so row orders and filter masks can be cached by version ID
+@functools.lru_cache(maxsize=view_cache_size)
+def sorted_rows(dataset_id, key):
+    rows = sort_permutation(dataset_store.get(dataset_id), key)
+    rows.setflags(write=False)
+    return rows
+
+@functools.lru_cache(maxsize=view_cache_size)
+def filtered_mask(dataset_id, filter_query):
+    mask = filter_query_mask(dataset_store.get(dataset_id), filter_query)
+    mask.setflags(write=False)
+    return mask
+
+def view_rows(dataset_id, key, filter_query):
+    """
+    Return the row positions of a sorted and filtered view of a dataset version.
+
+    Returns:
+        np.ndarray: The row positions, or None for the unsorted, unfiltered dataset.
+    """
+    if not key and not filter_query:
+        return None
+    rows = sorted_rows(dataset_id, key) if key else None
+    if not filter_query:
+        return rows
+    mask = filtered_mask(dataset_id, filter_query)
+    return mask.nonzero()[0] if rows is None else rows[mask[rows]]
+
+
+def apply_dataset_operation(dataset_id, operation, func, changed_columns=None):
+    """
+    Run an operation on a stored dataset version and store the result as a new version.
+
+    Args:
+        dataset_id (str): The ID of the version to operate on.
+        operation (str): The operation name, recorded in the version lineage.
+        func (callable): Function taking the DataFrame and returning the new DataFrame.
+        changed_columns (list, optional): The only columns the operation rewrites (rows may also
+                                          be removed); the new version shares all other columns
+                                          with its parent and updates the parent's profile.
+    """
+    try:
+        df = dataset_store.get(dataset_id)
+        namespace = dataset_store.info(dataset_id)["namespace"]
+    except KeyError:
+        logging.error(f"Dataset '{dataset_id}' not found.")
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+
+    try:
+        result_df = func(df)
+    except ValueError as e:
+        logging.error(f"Invalid {operation} request on dataset '{dataset_id}': {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error running {operation} on dataset '{dataset_id}': {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    new_id = dataset_store.put(result_df, parent_id=dataset_id, operation=operation, namespace=namespace,
+                               changed_columns=changed_columns)
+    profiles.derive(new_id, result_df, dataset_id, df, changed_columns)
+    DATASET_STORE_BYTES.set(dataset_store.memory_usage())
+    logging.info(f"Applied {operation} to dataset '{dataset_id}', new version '{new_id}' has {len(result_df)} records.")
+    return dataset_response(new_id, result_df, f"{operation.capitalize()} applied to {len(result_df)} records.")
+
+
+def parse_list_param(payload, key):
+    """Read a list parameter that may be sent either as a JSON list or a comma-separated string."""
+    value = payload.get(key) or []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(v).strip() for v in value if str(v).strip()]
+
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global processed_data_store
-
     if 'file' not in request.files:
         logging.error("No file provided in request.")
         return jsonify({"error": "No file provided"}), 400
@@ -208,41 +587,341 @@ def upload_file():
         logging.error("No file selected by user.")
         return jsonify({"error": "No file selected"}), 400
 
-    try:
-        df_data = pd.read_csv(file)
-        processed_df, error_msg = clean_and_tag_data(df_data, file.filename)
+    operation = request.form.get('operation', 'clean')
+    if operation != 'clean':
+        return jsonify({"error": f"Unsupported operation '{operation}'"}), 400
+
+    def process_upload(report=None):
+        with time_stage("parse") as run:
+            on_progress = None
+            if report is not None:
+                on_progress = lambda rows, fraction: report({"stage": "parse", "rows": rows, "progress": fraction})
+            df_data = read_upload_in_chunks(file.stream, file.filename, stream_chunk_size, on_progress=on_progress)
+            run.rows = len(df_data)
+        with time_stage("clean") as run:
+            processed_df = clean_for_crm(df_data, file.filename)
+            run.rows = len(processed_df)
+        if report is not None:
+            report({"stage": "clean", "rows": len(processed_df), "progress": 1.0})
+        return processed_df
+
+    def store_upload(processed_df, cached):
+        logging.info(f"Processed file '{file.filename}' successfully{' (cached result)' if cached else ''}.")
+        dataset_id = dataset_store.put(processed_df, operation="upload", namespace=session_namespace())  # Store the cleaned data
+        DATASET_STORE_BYTES.set(dataset_store.memory_usage())
+
+        # Log the number of records stored
+        logging.info(f"Stored {len(processed_df)} records as dataset '{dataset_id}'.")
+        return dataset_id
+
+    # Identical content processed the same way is served from the cache (or waits for it)
+    cache_key = upload_cache.key(hash_stream(file.stream), operation, audience_tag(file.filename), pipeline_version)
+
+    if wants_progress():
+        def events():
+            try:
+                # A disconnected client does not stop processing: the result still goes to the cache
+                processed_df, cached = yield from run_with_progress(
+                    lambda report, cancelled: upload_cache.get_or_compute(cache_key, lambda: process_upload(report))
+                )
+                dataset_id = store_upload(processed_df, cached)
+                yield {"result": dataset_body(dataset_id, processed_df, "File processed successfully")}
+            except Exception as e:
+                logging.error(f"Error processing uploaded file '{file.filename}': {str(e)}")
+                yield {"error": str(e)}
+        return progress_response(events())
 
-        if processed_df is not None:
-            logging.info(f"Processed file '{file.filename}' successfully.")
-            processed_data_store = processed_df.to_dict(orient='records')  # Store the cleaned data
-            
-            # Log the number of records stored
-            logging.info(f"Stored {len(processed_data_store)} records in processed_data_store.")
-            
-            return jsonify({"message": "File processed successfully", "data": processed_data_store}), 200
-        else:
-            logging.error(f"Data processing failed for file '{file.filename}': {error_msg}")
-            return jsonify({"error": error_msg or "Data processing failed"}), 500
+    try:
+        processed_df, cached = upload_cache.get_or_compute(cache_key, process_upload)
+        dataset_id = store_upload(processed_df, cached)
+        return dataset_response(dataset_id, processed_df, "File processed successfully")
 
+    except PipelineError as e:
+        logging.error(f"Data processing failed for file '{file.filename}': {str(e)}")
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         logging.error(f"Error processing uploaded file '{file.filename}': {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/datasets', methods=['DELETE'])
+def clear_datasets():
+    dataset_store.clear(session_namespace())
+    DATASET_STORE_BYTES.set(dataset_store.memory_usage())
+    return jsonify({"message": "Datasets cleared"}), 200
+
+@app.route('/datasets/<dataset_id>', methods=['GET'])
+def get_dataset(dataset_id):
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+
+    return dataset_response(dataset_id, df, "Dataset retrieved")
+
+@app.route('/datasets/<dataset_id>/csv', methods=['GET'])
+def download_dataset(dataset_id):
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+    compression = request.args.get('compression') or None
+    if compression not in (None,) + export_compressions:
+        return jsonify({"error": f"Unsupported compression '{compression}'"}), 400
+
+    # Rendered and sent chunk by chunk, so large exports start at once and use constant memory
+    filename = export_filename("processed_data", "csv", compression)
+    return Response(stream_with_context(iter_csv_chunks(df, export_chunk_rows, compression)),
+                    mimetype='application/gzip' if compression else 'text/csv',
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route('/datasets/<dataset_id>/xlsx', methods=['GET'])
+def download_dataset_xlsx(dataset_id):
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+    if not xlsx_available():
+        return jsonify({"error": "Excel export is not available on this server."}), 501
+
+    # The workbook is written row by row to a temporary file, then streamed and removed
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        with time_stage("export_xlsx") as run:
+            write_xlsx(df, path)
+            run.rows = len(df)
+    except Exception as e:
+        os.remove(path)
+        logging.error(f"Error exporting dataset '{dataset_id}' to Excel: {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+    return Response(stream_with_context(iter_file_chunks(path, remove=True)), mimetype=XLSX_MIMETYPE,
+                    headers={"Content-Disposition": f"attachment; filename={export_filename('processed_data', 'xlsx')}",
+                             "Content-Length": str(os.path.getsize(path))})
+
+@app.route('/datasets/<dataset_id>/<any(parquet, feather):file_format>', methods=['GET'])
+def download_dataset_columnar(dataset_id, file_format):
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+    if not columnar_available():
+        return jsonify({"error": "Parquet and Feather export are not available on this server."}), 501
+
+    fd, path = tempfile.mkstemp(suffix=f'.{file_format}')
+    os.close(fd)
+    try:
+        with time_stage(f"export_{file_format}") as run:
+            write_columnar(df, path, file_format)  # zstd-compressed
+            run.rows = len(df)
+    except Exception as e:
+        os.remove(path)
+        logging.error(f"Error exporting dataset '{dataset_id}' to {file_format}: {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+    return Response(stream_with_context(iter_file_chunks(path, remove=True)), mimetype=COLUMNAR_MIMETYPES[file_format],
+                    headers={"Content-Disposition": f"attachment; filename={export_filename('processed_data', file_format)}",
+                             "Content-Length": str(os.path.getsize(path))})
+
+@app.route('/datasets/<dataset_id>/partitions', methods=['POST'])
+def export_partitions(dataset_id):
+    """
+    Export many partitioned files (per channel tag, column value, segment, ...) in one request,
+    selecting every partition's rows from the cached indexes and writing the files in parallel.
+    The files and a manifest with their row counts are returned as a zip archive.
+    """
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+    payload = request.get_json(silent=True) or {}
+    file_format = payload.get('format', 'csv')
+    if file_format not in partition_formats:
+        return jsonify({"error": f"Unsupported format '{file_format}', use one of: {', '.join(partition_formats)}"}), 400
+    if file_format == 'xlsx' and not xlsx_available():
+        return jsonify({"error": "Excel export is not available on this server."}), 501
+    if file_format in ('parquet', 'feather') and not columnar_available():
+        return jsonify({"error": "Parquet and Feather export are not available on this server."}), 501
+
+    try:
+        files = plan_partitions(dataset_id, df, payload.get('partitions'), segment_engine, max_rows=payload.get('max_rows'))
+    except ValueError as e:  # PartitionError, or an invalid segment or column condition
+        return jsonify({"error": str(e)}), 400
+
+    fd, zip_path = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
+    try:
+        with tempfile.TemporaryDirectory() as directory, time_stage("export_partitions") as run:
+            manifest = write_partitions(df, files, directory, file_format, max_workers=export_workers)
+            zip_directory(directory, zip_path)
+            run.rows = sum(file["rows"] for file in manifest["files"])
+    except Exception as e:
+        os.remove(zip_path)
+        logging.error(f"Error exporting partitions of dataset '{dataset_id}': {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    logging.info(f"Exported {len(manifest['files'])} partition files of dataset '{dataset_id}'.")
+    return Response(stream_with_context(iter_file_chunks(zip_path, remove=True)), mimetype='application/zip',
+                    headers={"Content-Disposition": "attachment; filename=partitions.zip",
+                             "Content-Length": str(os.path.getsize(zip_path))})
+
+@app.route('/datasets/<dataset_id>/profile', methods=['GET'])
+def profile_dataset(dataset_id):
+    try:
+        df = dataset_store.get(dataset_id)
+    except KeyError:
+        return jsonify({"error": f"Dataset '{dataset_id}' not found. Please upload data again."}), 404
+    try:
+        top_k = min(max(int(request.args.get('top_k', 10)), 1), 100)
+    except ValueError:
+        return jsonify({"error": "top_k must be an integer."}), 400
+    return jsonify({"dataset_id": dataset_id, **profiles.get(dataset_id, df).summary(top_k)}), 200
+
+@app.route('/datasets/<dataset_id>/filter', methods=['POST'])
+def filter_dataset(dataset_id):
+    payload = request.get_json(silent=True) or {}
+    conditions = payload.get('conditions')
+    if conditions is None:
+        # Single-column form: {"column": ..., "values": [...]}
+        column = payload.get('column')
+        values = parse_list_param(payload, 'values')
+        if not column or not values:
+            return jsonify({"error": "Please provide a column and filter values."}), 400
+        conditions = [{"column": column, "op": "in", "values": values}]
+    if not isinstance(conditions, list) or not conditions or not all(isinstance(c, dict) for c in conditions):
+        return jsonify({"error": "Please provide a list of filter conditions."}), 400
+    combine = payload.get('combine', 'and')
+    return apply_dataset_operation(dataset_id, "filter", lambda df: filter_engine.filter(dataset_id, df, conditions, combine),
+                                   changed_columns=[])
+
+@app.route('/datasets/<dataset_id>/segment', methods=['POST'])
+def segment_dataset(dataset_id):
+    payload = request.get_json(silent=True) or {}
+    query = (payload.get('query') or '').strip()
+    if not query:
+        return jsonify({"error": "Please provide a segment query."}), 400
+    return apply_dataset_operation(dataset_id, "segment", lambda df: segment_engine.filter(dataset_id, df, query),
+                                   changed_columns=[])
+
+@app.route('/datasets/<dataset_id>/tags', methods=['POST', 'DELETE'])
+def update_dataset_tags(dataset_id):
+    payload = request.get_json(silent=True) or {}
+    tags = parse_list_param(payload, 'tags')
+    if not tags:
+        return jsonify({"error": "Please provide at least one tag."}), 400
+    if request.method == 'POST':
+        return apply_dataset_operation(dataset_id, "add tags", lambda df: add_tags(df, tags), changed_columns=['Tag'])
+    return apply_dataset_operation(dataset_id, "delete tags", lambda df: delete_tags(df, tags), changed_columns=['Tag'])
+
+@app.route('/datasets/<dataset_id>/select', methods=['POST'])
+def select_dataset_columns(dataset_id):
+    payload = request.get_json(silent=True) or {}
+    columns = parse_list_param(payload, 'columns')
+    if not columns:
+        return jsonify({"error": "Please provide at least one column."}), 400
+    return apply_dataset_operation(dataset_id, "select columns", lambda df: select_columns(df, columns), changed_columns=[])
+
 @app.route('/load-leads', methods=['POST'])
 def load_leads():
-    global processed_data_store
-    if not processed_data_store:
+    payload = request.get_json(silent=True) or {}
+    dataset_id = payload.get('dataset_id') or dataset_store.latest(session_namespace())
+    if dataset_id is None or dataset_id not in dataset_store:
         logging.error("No processed data available to load.")
         return jsonify({"error": "No processed data available to load. Please upload data first."}), 400
 
+    if wants_progress():
+        def load(report, cancelled):
+            df = dataset_store.get(dataset_id)
+            total = len(df)
+            def on_progress(sent, loaded, failed):
+                report({"stage": "load", "sent": sent, "loaded": loaded, "failed": failed,
+                        "total": total, "progress": sent / total if total else 1.0})
+            with track_load():
+                return load_contacts_in_batches(structure_data_for_gohighlevel(df), on_progress=on_progress, cancelled=cancelled)
+
+        def events():
+            try:
+                # Closing the connection (e.g. a cancelled Dash job) stops the load before the next contact
+                loaded, failed = yield from run_with_progress(load)
+                yield {"result": {"message": "Leads loaded", "loaded": loaded, "failed": failed}}
+            except Exception as e:
+                logging.error(f"Error in load-leads route: {str(e)}")
+                yield {"error": f"An error occurred: {str(e)}"}
+        return progress_response(events())
+
     try:
-        contacts_list = structure_data_for_gohighlevel(pd.DataFrame(processed_data_store))
-        load_contacts_in_batches(contacts_list)
+        contacts = structure_data_for_gohighlevel(dataset_store.get(dataset_id))
+        with track_load():
+            load_contacts_in_batches(contacts)
         return jsonify({"message": "Leads processing initiated"}), 200
 
     except Exception as e:
         logging.error(f"Error in load-leads route: {str(e)}")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route('/upload-and-load', methods=['POST'])
+def upload_and_load():
+    """
+    Streaming mode: parse, clean and send an uploaded file to the CRM in one pass.
+
+    Cleaned chunks are handed from a background parsing thread to the loader through a
+    bounded queue, so the first contacts are sent while the rest of the file is still being
+    parsed, and a slow CRM holds back parsing instead of letting chunks pile up in memory.
+    """
+    if 'file' not in request.files:
+        logging.error("No file provided in request.")
+        return jsonify({"error": "No file provided"}), 400
+
+    file = request.files['file']
+    if file.filename == '':
+        logging.error("No file selected by user.")
+        return jsonify({"error": "No file selected"}), 400
+
+    if wants_progress():
+        def stream_file(report, cancelled):
+            cleaned = {"rows": 0, "progress": 0.0}
+            def on_chunk(rows, fraction):
+                cleaned.update(rows=rows, progress=fraction)
+                report({"stage": "clean", "rows": rows, "progress": fraction})
+            def on_progress(sent, loaded, failed):
+                report({"stage": "load", "sent": sent, "loaded": loaded, "failed": failed, **cleaned})
+
+            chunks = prefetch(iter_cleaned_chunks(file.stream, file.filename, stream_chunk_size, on_progress=on_chunk),
+                              max_queued=stream_queue_size, on_depth_change=STREAM_QUEUE_DEPTH.inc)
+            contacts = (contact for chunk in chunks for contact in structure_data_for_gohighlevel(chunk))
+            with track_load():
+                return load_contacts_in_batches(contacts, on_progress=on_progress, cancelled=cancelled)
+
+        def events():
+            try:
+                loaded, failed = yield from run_with_progress(stream_file)
+                logging.info(f"Streamed file '{file.filename}' to the CRM.")
+                yield {"result": {"message": "File processed and leads loaded", "loaded": loaded, "failed": failed}}
+            except Exception as e:
+                logging.error(f"Error streaming file '{file.filename}' to the CRM: {str(e)}")
+                yield {"error": str(e)}
+        return progress_response(events())
+
+    try:
+        chunks = prefetch(iter_cleaned_chunks(file.stream, file.filename, stream_chunk_size),
+                          max_queued=stream_queue_size, on_depth_change=STREAM_QUEUE_DEPTH.inc)
+        contacts = (contact for chunk in chunks for contact in structure_data_for_gohighlevel(chunk))
+        with track_load():
+            load_contacts_in_batches(contacts)
+        logging.info(f"Streamed file '{file.filename}' to the CRM.")
+        return jsonify({"message": "File processed and leads loaded"}), 200
+
+    except ValueError as e:
+        logging.error(f"Data processing failed for file '{file.filename}': {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error streaming file '{file.filename}' to the CRM: {str(e)}")
+        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
 if __name__ == '__main__':
-    app.run(port=3000, debug=True)
+    # Development server only; use serve.py for production serving
+    debug = os.getenv("FLASK_DEBUG") == "1"
+    app.run(port=int(os.getenv("API_PORT", 3000)), debug=debug, use_reloader=debug, threaded=True)
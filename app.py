@@ -1,23 +1,49 @@
 import dash
-from dash import dcc, html, Input, Output, State, dash_table
+from dash import dcc, html, Input, Output, State, Patch, DiskcacheManager, dash_table
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
-import pandas as pd
 import base64
-from io import StringIO
 from datetime import datetime
 import requests
+import os
+import uuid
 import json
+import math
+import tempfile
+import diskcache
+from urllib.parse import urlencode
+from flask import Response, request, stream_with_context
+from datafunctions.dataset_store import json_records
+from datafunctions.exports import xlsx_available
+from datafunctions.transport import ARROW_STREAM_MIMETYPE, arrow_available, from_arrow_ipc
 
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, 'assets/styles.css'], suppress_callback_exceptions=True)
+# Long-running jobs (upload processing, CRM loads) run as background callbacks in separate processes,
+# coordinated through a disk cache, so they do not hold up the Dash workers
+background_callback_manager = DiskcacheManager(diskcache.Cache(
+    os.getenv("DASH_JOB_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "data-process-app", "dash-jobs")
+))
+
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, 'assets/styles.css'], suppress_callback_exceptions=True,
+                background_callback_manager=background_callback_manager)
 app.title = "CRM Audience Data Processing App"
 
 # Define API URLs
-UPLOAD_API_URL = "http://127.0.0.1:3000/upload"
-LOAD_LEADS_API_URL = "http://127.0.0.1:3000/load-leads"
+API_BASE_URL = os.getenv("API_BASE_URL", "http://127.0.0.1:3000")
+UPLOAD_API_URL = f"{API_BASE_URL}/upload"
+LOAD_LEADS_API_URL = f"{API_BASE_URL}/load-leads"
+UPLOAD_AND_LOAD_API_URL = f"{API_BASE_URL}/upload-and-load"
+DATASETS_API_URL = f"{API_BASE_URL}/datasets"
+
+# Dataset pages come from the API as Arrow IPC streams when pyarrow is installed (API_TRANSPORT=json to disable),
+# optionally compressed with API_ARROW_COMPRESSION ('lz4' or 'zstd') when the API runs on another host
+USE_ARROW = arrow_available() and os.getenv("API_TRANSPORT", "arrow") == "arrow"
+ARROW_COMPRESSION = os.getenv("API_ARROW_COMPRESSION") or None
+
+# Rows fetched from the API per table page; only the visible page is ever sent to the browser
+TABLE_PAGE_SIZE = int(os.getenv("TABLE_PAGE_SIZE", 100))
 
 # Define the layout
-app.layout = html.Div([
+main_layout = html.Div([
     dbc.Container([
         dbc.Row([
             dbc.Col(html.Img(src="assets/images/TrafficConvert-500.png", height="50px"), width="auto"),
@@ -53,6 +79,14 @@ app.layout = html.Div([
                     },
                     multiple=False
                 ),
+                dcc.Checklist(
+                    id='stream-to-crm',
+                    options=[{'label': ' Send directly to CRM while processing', 'value': 'stream'}],
+                    value=[],
+                    style={"marginTop": "10px"}
+                ),
+                dbc.Progress(id='upload-progress', value=0, striped=True, style={"marginTop": "10px", "height": "20px"}),
+                dbc.Button("Cancel Upload", id='cancel-upload-button', color="warning", disabled=True, size="sm", className="mt-2"),
                 html.Div([
                     html.H5("Manage Tags"),
                     dcc.Input(
@@ -72,34 +106,88 @@ app.layout = html.Div([
                         placeholder="Select column to filter",
                         className="mb-4"
                     ),
+                    dcc.RadioItems(
+                        id='filter-match',
+                        options=[
+                            {'label': ' Equals any of', 'value': 'in'},
+                            {'label': ' Starts with', 'value': 'prefix'},
+                            {'label': ' Between (min, max)', 'value': 'range'},
+                        ],
+                        value='in',
+                    ),
                     dcc.Input(
                         id='filter-value-input',
                         type='text',
+                        list='filter-value-options',  # Suggests the most frequent values of the column
                         placeholder='Enter filter values (comma-separated)',
                         style={'width': '100%', 'padding': '10px', 'margin': '10px 0'}
                     ),
-                    dbc.Button("Apply Filter", id='filter-button', n_clicks=0, className="btn btn-custom mt-2")
+                    html.Datalist(id='filter-value-options'),
+                    dbc.Button("Add Condition", id='add-condition-button', n_clicks=0, className="btn btn-custom mt-2"),
+                    html.Ul(id='filter-conditions-list', style={"marginTop": "10px"}),
+                    dcc.RadioItems(
+                        id='filter-combine',
+                        options=[{'label': ' Match all conditions', 'value': 'and'}, {'label': ' Match any condition', 'value': 'or'}],
+                        value='and',
+                    ),
+                    dbc.Button("Apply Filter", id='filter-button', n_clicks=0, className="btn btn-custom mt-2"),
+                    dcc.Store(id='filter-conditions', data=[]),
                 ], style={"marginTop": "20px"}),
 
+                html.Div([
+                    html.H5("Segment"),
+                    dcc.Input(
+                        id='segment-input',
+                        type='text',
+                        placeholder='e.g. sms AND NOT email AND state IN (VA, PA)',
+                        debounce=True,
+                        style={'width': '100%', 'padding': '10px', 'margin': '10px 0'}
+                    ),
+                    dbc.Button("Apply Segment", id='segment-button', n_clicks=0, className="btn btn-custom mt-2")
+                ], style={"marginTop": "20px"}),
+
+                html.Div([
+                    dbc.Button("Undo", id='undo-button', n_clicks=0, disabled=True, color="secondary", className="btn btn-custom mt-2"),
+                    dbc.Button("Redo", id='redo-button', n_clicks=0, disabled=True, color="secondary", className="btn btn-custom mt-2"),
+                ], style={"marginTop": "20px"}),
                 dbc.Button("Reset All", id='reset-button', color="secondary", className="btn btn-custom mt-2"),
                 dbc.Button("Load Data to CRM", id="load-leads-button", color="success", style={"width": "100%", "margin-top": "10px"}),
+                dbc.Progress(id='load-progress', value=0, striped=True, color="success", style={"marginTop": "10px", "height": "20px"}),
+                dbc.Button("Cancel Load", id='cancel-load-button', color="warning", disabled=True, size="sm", className="mt-2"),
 
                 dbc.Alert(id='feedback-message', is_open=False, duration=4000, style={"marginTop": "20px"}),
 
-                # Download button
+                # Download link; the file is streamed from the API instead of going through a callback
                 html.Div([
-                    dbc.Button('Download Processed Data', id='download-button', className="btn btn-custom mt-2"),
-                    dcc.Download(id="download-dataframe-csv"),
+                    dcc.RadioItems(
+                        id='download-format',
+                        # Excel is only offered when XlsxWriter is installed
+                        options=[
+                            {'label': ' CSV', 'value': 'csv'},
+                            {'label': ' CSV (gzip)', 'value': 'csv-gzip'},
+                        ] + ([{'label': ' Excel', 'value': 'xlsx'}] if xlsx_available() else []) + [
+                            {'label': ' Parquet', 'value': 'parquet'},
+                            {'label': ' Feather', 'value': 'feather'},
+                        ],
+                        value='csv',
+                        style={"marginTop": "10px"}
+                    ),
+                    html.A(dbc.Button('Download Processed Data', id='download-button', className="btn btn-custom mt-2"),
+                           id='download-link'),
                 ]),
             ], className="sidebar", width=3),
 
             dbc.Col([
                 html.Div(id='data-table-div'),
+                html.Div(id='profile-div', style={"marginTop": "20px"}),
                 dcc.Loading([html.Div(id="loading-demo")]),
             ], width=9),
         ], className="flex-container"),
         
-        dcc.Store(id='processed-data'),  # Store component for processed data
+        dcc.Store(id='processed-data'),  # Store component for the ID of the processed dataset version
+        dcc.Store(id='profile-data'),  # Column statistics of the current version, for the profile and autocomplete
+        # IDs of earlier and undone versions; versions are immutable on the server, so a step is just an ID
+        dcc.Store(id='history', data={'undo': [], 'redo': [], 'current': None}),
 
         # Footer
         dbc.Row([
@@ -108,138 +196,596 @@ app.layout = html.Div([
     ], fluid=True)
 ])
 
-def create_data_table(df):
+def serve_layout():
+    # Every page load gets its own session ID, which namespaces its datasets on the API server
+    return html.Div([main_layout, dcc.Store(id='session-id', data=uuid.uuid4().hex)])
+
+app.layout = serve_layout
+
+def create_data_table(preview):
+    # Paging, sorting and filtering happen on the API server, which keeps the full dataset
     return dash_table.DataTable(
         id='data-table',
-        columns=[{"name": i, "id": i} for i in df.columns],
-        data=df.head(50).to_dict('records'),
-        page_size=10,
-        style_table={'overflowX': 'auto', 'width': '100%'},
+        columns=[{"name": i, "id": i} for i in preview["columns"]],
+        data=preview["data"],
+        page_current=0,
+        page_size=preview["page_size"],
+        page_count=page_count(preview),
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='multi',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
+        virtualization=True,
+        fixed_rows={'headers': True},
+        style_table={'overflowX': 'auto', 'width': '100%', 'height': '600px', 'overflowY': 'auto'},
     )
 
+def create_profile_view(profile):
+    """Render the column statistics of a dataset version as a table, with validity rates and tag counts."""
+    rows = [
+        html.Tr([html.Td(col["name"]), html.Td(f"{col['nulls']:,}"), html.Td(f"{col['distinct']:,}"),
+                 html.Td(", ".join(f"{top['value']} ({top['count']:,})" for top in col["top"][:5]))])
+        for col in profile["columns"]
+    ]
+    validity = [f"{name}: {v['valid_rate']:.1%} valid {v['kind']}" for name, v in profile["validity"].items()
+                if v["valid_rate"] is not None]
+    tags = [f"{tag}: {count:,}" for tag, count in profile["tags"].items()]
+    return html.Div([
+        html.H5(f"Profile: {profile['rows']:,} rows and {len(profile['columns'])} columns"),
+        dbc.Table([html.Thead(html.Tr([html.Th("Column"), html.Th("Missing"), html.Th("Distinct"), html.Th("Most frequent")])),
+                   html.Tbody(rows)], bordered=True, size="sm", striped=True),
+        html.P(" | ".join(validity)) if validity else None,
+        html.P("Tags: " + ", ".join(tags)) if tags else None,
+    ])
+
+def dataset_url(dataset_id, action=None):
+    url = f"{DATASETS_API_URL}/{dataset_id}"
+    return f"{url}/{action}" if action else url
+
+def api_error(response):
+    """
+    Return the error message of a failed API response. Errors raised before the API answers
+    (e.g. a gunicorn timeout or a proxy's 502 page) have a plain text or HTML body, not JSON.
+    """
+    try:
+        return response.json().get("error", "Unknown error from the data processing API.")
+    except ValueError:
+        return response.text.strip() or f"The data processing API answered with status {response.status_code}."
+
+def call_api(method, url, session_id, **kwargs):
+    """
+    Call the data processing API and return the decoded JSON body, or the error message on failure.
+    """
+    response = requests.request(method, url, headers={"X-Session-ID": session_id or ""}, **kwargs)
+    if response.status_code != 200:
+        return None, api_error(response)
+    return response.json(), None
+
+def call_dataset_api(method, url, session_id, params=None, **kwargs):
+    """
+    Call a dataset endpoint of the API, receiving the page as an Arrow IPC stream when enabled.
+
+    Returns:
+        tuple: The body ({"message", "dataset_id", "preview"}) and the error message, one of them None.
+    """
+    if not USE_ARROW:
+        return call_api(method, url, session_id, params=params, **kwargs)
+    params = dict(params or {})
+    if ARROW_COMPRESSION:
+        params["compression"] = ARROW_COMPRESSION
+    request_headers = {"X-Session-ID": session_id or "", "Accept": ARROW_STREAM_MIMETYPE}
+    response = requests.request(method, url, headers=request_headers, params=params, **kwargs)
+    if response.status_code != 200:
+        return None, api_error(response)
+    if not response.headers.get("Content-Type", "").startswith(ARROW_STREAM_MIMETYPE):
+        return response.json(), None  # The API has no pyarrow and answered with JSON
+    df, metadata = from_arrow_ipc(response.content)
+    preview = {
+        "page": metadata["page"],
+        "page_size": metadata["page_size"],
+        "total_rows": metadata["total_rows"],
+        "columns": list(df.columns),
+        "data": json_records(df),
+    }
+    return {"message": metadata["message"], "dataset_id": metadata["dataset_id"], "preview": preview}, None
+
+def stream_api(method, url, session_id, on_progress, **kwargs):
+    """
+    Call an API endpoint in progress mode: progress events are streamed back as JSON lines
+    and passed to on_progress until the final result or error event arrives.
+
+    Returns:
+        tuple: The decoded result and the error message, one of them None.
+    """
+    request_headers = {"X-Session-ID": session_id or "", "Accept": "application/x-ndjson"}
+    with requests.request(method, url, headers=request_headers, stream=True, **kwargs) as response:
+        if response.status_code != 200:
+            return None, api_error(response)
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if "error" in event:
+                return None, event["error"]
+            if "result" in event:
+                return event["result"], None
+            on_progress(event)
+    return None, "The data processing API closed the connection before finishing."
+
+def progress_label(event):
+    parts = []
+    if "rows" in event:
+        parts.append(f"{event['rows']:,} rows processed")
+    if "sent" in event:
+        parts.append(f"{event['sent']:,} contacts sent")
+    return ", ".join(parts)
+
+def filter_condition(column, match, text):
+    """Build a filter condition for the API from the filter panel inputs, or None if incomplete."""
+    if not column or not text:
+        return None
+    if match == 'range':
+        bounds = [b.strip() for b in text.split(',')] + ['']
+        return {"column": column, "op": "range", "min": bounds[0] or None, "max": bounds[1] or None}
+    values = [v.strip() for v in text.split(',') if v.strip()]
+    return {"column": column, "op": match or "in", "values": values} if values else None
+
+def describe_condition(condition):
+    if condition["op"] == "range":
+        return f"{condition['column']} between {condition['min'] or '…'} and {condition['max'] or '…'}"
+    verb = "starts with" if condition["op"] == "prefix" else "is"
+    return f"{condition['column']} {verb} {' or '.join(condition['values'])}"
+
+def table_view_params(page_current, page_size, sort_by, filter_query, columns=None):
+    """Query parameters that make the API return the page of the dataset view shown in the table."""
+    params = {
+        "page": page_current or 0,
+        "page_size": page_size or TABLE_PAGE_SIZE,
+        "sort_by": json.dumps(sort_by or []),
+        "filter_query": filter_query or "",
+    }
+    if columns:
+        params["columns"] = ",".join(columns)
+    return params
+
+def page_count(preview):
+    return max(math.ceil(preview["total_rows"] / preview["page_size"]), 1)
+
+def feedback(message, color):
+    return message, True, color
+
+
+# Upload a file to the API, which keeps the processed dataset and returns its ID
 @app.callback(
-    [
-        Output('data-table-div', 'children'),
-        Output('processed-data', 'data'),
-        Output('feedback-message', 'children'),
-        Output('feedback-message', 'is_open'),
-        Output('feedback-message', 'color'),
-        Output('column-filter-select', 'options'),
+    Output('data-table-div', 'children'),
+    Output('processed-data', 'data'),
+    Output('feedback-message', 'children'),
+    Output('feedback-message', 'is_open'),
+    Output('feedback-message', 'color'),
+    Output('column-filter-select', 'options'),
+    Input('upload-data', 'contents'),
+    State('upload-data', 'filename'),
+    State('stream-to-crm', 'value'),
+    State('session-id', 'data'),
+    background=True,
+    progress=[Output('upload-progress', 'value'), Output('upload-progress', 'label')],
+    running=[
+        (Output('cancel-upload-button', 'disabled'), False, True),
+        (Output('upload-progress', 'animated'), True, False),
     ],
-    [
-        Input('upload-data', 'contents'),
-        Input('filter-button', 'n_clicks'),
-        Input('add-tag-button', 'n_clicks'),
-        Input('delete-tag-button', 'n_clicks'),
-        Input('reset-button', 'n_clicks'),
-        Input('load-leads-button', 'n_clicks')
-    ],
-    [
-        State('upload-data', 'filename'),
-        State('operation-select', 'value'),
-        State('processed-data', 'data'),
-        State('column-filter-select', 'value'),
-        State('filter-value-input', 'value'),
-        State('tag-input', 'value')
-    ]
+    cancel=[Input('cancel-upload-button', 'n_clicks')],
+    prevent_initial_call=True
 )
-def update_data(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, reset_clicks, load_leads_click, filename, operation, json_data, selected_column, filter_values, tag_input):
-    ctx = dash.callback_context
-    if not ctx.triggered:
+def upload_data(set_progress, contents, filename, stream_to_crm, session_id):
+    if not contents:
         raise PreventUpdate
+    set_progress((0, ""))
+    on_progress = lambda event: set_progress((100 * event.get("progress", 0), progress_label(event)))
+    try:
+        # The raw bytes go to the API as they are; the API does the only parse
+        decoded = base64.b64decode(contents[contents.index(',') + 1:])
 
-    triggered_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    feedback = ""
-    color = "info"
+        # Streaming mode sends the file straight to the CRM without keeping a dataset
+        if 'stream' in (stream_to_crm or []):
+            body, error_message = stream_api("POST", UPLOAD_AND_LOAD_API_URL, session_id, on_progress,
+                                             files={"file": (filename, decoded)})
+            if error_message:
+                return dash.no_update, dash.no_update, *feedback(error_message, "danger"), dash.no_update
+            set_progress((100, f"{body['loaded']:,} contacts loaded, {body['failed']:,} failed"))
+            return None, None, *feedback("File processed and leads loaded to the CRM.", "success"), []
 
-    # Initialize DataFrame based on stored data or uploaded content
-    if triggered_id == 'upload-data' and contents:
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        df = pd.read_csv(StringIO(decoded.decode('utf-8')))
-        try:
-            response = requests.post(UPLOAD_API_URL, files={"file": (filename, StringIO(decoded.decode('utf-8')))})
-            if response.status_code == 200:
-                data = response.json().get("data")
-                df = pd.DataFrame(data)
-                feedback = "File processed successfully and data loaded."
-                color = "success"
-            else:
-                error_message = response.json().get("error", "Unknown error during file processing.")
-                return None, None, error_message, True, "danger", []
-
-        except Exception as e:
-            error_message = f"An unexpected error occurred: {str(e)}"
-            return None, None, error_message, True, "danger", []
-    
-    elif json_data:
-        df = pd.DataFrame(json_data)
-    else:
-        return None, None, "No data to process", True, "warning", []
+        body, error_message = stream_api("POST", UPLOAD_API_URL, session_id, on_progress,
+                                         files={"file": (filename, decoded)}, params={"page_size": TABLE_PAGE_SIZE})
+        if error_message:
+            return dash.no_update, dash.no_update, *feedback(error_message, "danger"), dash.no_update
+    except Exception as e:
+        return dash.no_update, dash.no_update, *feedback(f"An unexpected error occurred: {str(e)}", "danger"), dash.no_update
 
+    # Only the ID of the latest dataset version is kept in the browser
+    preview = body["preview"]
+    column_options = [{'label': col, 'value': col} for col in preview["columns"]]
+    return create_data_table(preview), body["dataset_id"], *feedback("File processed successfully and data loaded.", "success"), column_options
+
+
+# Filtering changes the rows, so the visible page is replaced; the columns stay the same
+@app.callback(
+    Output('data-table', 'data', allow_duplicate=True),
+    Output('data-table', 'page_count', allow_duplicate=True),
+    Output('data-table', 'page_current'),
+    Output('processed-data', 'data', allow_duplicate=True),
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Output('filter-conditions', 'data', allow_duplicate=True),
+    Output('filter-conditions-list', 'children', allow_duplicate=True),
+    Input('filter-button', 'n_clicks'),
+    State('processed-data', 'data'),
+    State('filter-conditions', 'data'),
+    State('column-filter-select', 'value'),
+    State('filter-match', 'value'),
+    State('filter-value-input', 'value'),
+    State('filter-combine', 'value'),
+    State('data-table', 'page_current'),
+    State('data-table', 'page_size'),
+    State('data-table', 'sort_by'),
+    State('data-table', 'filter_query'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def filter_data(n_clicks, dataset_id, conditions, selected_column, match, filter_values, combine, page_current, page_size, sort_by, filter_query, session_id):
+    if not dataset_id:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, *feedback("No data to process", "warning"), dash.no_update, dash.no_update
+    # The conditions added so far, plus the one currently entered in the panel
+    current = filter_condition(selected_column, match, filter_values)
+    conditions = list(conditions or []) + ([current] if current else [])
+    if not conditions:
+        raise PreventUpdate
     try:
-        # Reset all inputs
-        if triggered_id == 'reset-button':
-            return None, None, "All inputs have been reset.", True, "info", []
-
-        # Apply filtering
-        elif triggered_id == 'filter-button' and selected_column and filter_values:
-            values = [v.strip() for v in filter_values.split(',')]
-            filtered_df = df[df[selected_column].isin(values)]
-            feedback = f"Filtered {len(filtered_df)} records based on '{selected_column}'"
-            color = "success"
-            data_table = create_data_table(filtered_df)
-            return data_table, filtered_df.to_dict(orient='records'), feedback, True, color, [{'label': col, 'value': col} for col in df.columns]
-
-        # Add tags
-        elif triggered_id == 'add-tag-button' and tag_input:
-            tags = [t.strip() for t in tag_input.split(',')]
-            df['Tag'] = df['Tag'].apply(lambda x: ', '.join(set((x.split(', ') if x else []) + tags)))
-            feedback = "Tags added successfully."
-            color = "success"
-
-        # Delete tags
-        elif triggered_id == 'delete-tag-button' and tag_input:
-            tags = [t.strip() for t in tag_input.split(',')]
-            df['Tag'] = df['Tag'].apply(lambda x: ', '.join([t for t in (x.split(', ') if x else []) if t not in tags]))
-            feedback = "Tags deleted successfully."
-            color = "warning"
-
-        # Load leads to CRM
-        elif triggered_id == 'load-leads-button':
-            response = requests.post(LOAD_LEADS_API_URL, json=df.to_dict(orient='records'))
-            if response.status_code == 200:
-                feedback = "Leads processing initiated successfully."
-                color = "success"
-            else:
-                error_message = response.json().get("error", "Unknown error during leads processing.")
-                feedback = error_message
-                color = "danger"
-
-        # Update processed-data store with the latest DataFrame
-        data_table = create_data_table(df)
-        column_options = [{'label': col, 'value': col} for col in df.columns]
-        return data_table, df.to_dict(orient='records'), feedback, True, color, column_options
+        body, error_message = call_dataset_api("POST", dataset_url(dataset_id, "filter"), session_id,
+                                               json={"conditions": conditions, "combine": combine or "and"},
+                                               params=table_view_params(0, page_size, sort_by, filter_query))
+    except Exception as e:
+        error_message = f"An unexpected error occurred: {str(e)}"
+    if error_message:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, *feedback(error_message, "danger"), dash.no_update, dash.no_update
 
+    preview = body["preview"]
+    columns = sorted({condition["column"] for condition in conditions})
+    message = f"Filtered {preview['total_rows']} records based on {', '.join(repr(c) for c in columns)}"
+    # Going back to the first page would trigger update_table_page and fetch the same page again
+    first_page = 0 if page_current else dash.no_update
+    return preview["data"], page_count(preview), first_page, body["dataset_id"], *feedback(message, "success"), [], []
+
+
+# Segments are evaluated on the API in one pass, like a filter with several conditions
+@app.callback(
+    Output('data-table', 'data', allow_duplicate=True),
+    Output('data-table', 'page_count', allow_duplicate=True),
+    Output('data-table', 'page_current', allow_duplicate=True),
+    Output('processed-data', 'data', allow_duplicate=True),
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Input('segment-button', 'n_clicks'),
+    State('processed-data', 'data'),
+    State('segment-input', 'value'),
+    State('data-table', 'page_current'),
+    State('data-table', 'page_size'),
+    State('data-table', 'sort_by'),
+    State('data-table', 'filter_query'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def apply_segment(n_clicks, dataset_id, query, page_current, page_size, sort_by, filter_query, session_id):
+    if not dataset_id:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, *feedback("No data to process", "warning")
+    if not query or not query.strip():
+        raise PreventUpdate
+    try:
+        body, error_message = call_dataset_api("POST", dataset_url(dataset_id, "segment"), session_id,
+                                               json={"query": query},
+                                               params=table_view_params(0, page_size, sort_by, filter_query))
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}"
-        return None, json_data, error_message, True, "danger", []
+    if error_message:
+        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, *feedback(error_message, "danger")
+
+    preview = body["preview"]
+    first_page = 0 if page_current else dash.no_update
+    return preview["data"], page_count(preview), first_page, body["dataset_id"], *feedback(f"Segment contains {preview['total_rows']} records.", "success")
 
 
+# Collect several conditions before applying them together
+@app.callback(
+    Output('filter-conditions', 'data'),
+    Output('filter-conditions-list', 'children'),
+    Output('filter-value-input', 'value'),
+    Input('add-condition-button', 'n_clicks'),
+    State('filter-conditions', 'data'),
+    State('column-filter-select', 'value'),
+    State('filter-match', 'value'),
+    State('filter-value-input', 'value'),
+    prevent_initial_call=True
+)
+def add_filter_condition(n_clicks, conditions, selected_column, match, filter_values):
+    condition = filter_condition(selected_column, match, filter_values)
+    if condition is None:
+        raise PreventUpdate
+    conditions = list(conditions or []) + [condition]
+    return conditions, [html.Li(describe_condition(c)) for c in conditions], ""
 
-# Callback to handle CSV download
+
+# Tag operations only change the Tag column, so only that column of the visible rows is patched
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("download-button", "n_clicks"),
-    State("processed-data", "data"),
+    Output('data-table', 'data', allow_duplicate=True),
+    Output('data-table', 'page_count', allow_duplicate=True),
+    Output('processed-data', 'data', allow_duplicate=True),
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Input('add-tag-button', 'n_clicks'),
+    Input('delete-tag-button', 'n_clicks'),
+    State('processed-data', 'data'),
+    State('tag-input', 'value'),
+    State('data-table', 'page_current'),
+    State('data-table', 'page_size'),
+    State('data-table', 'sort_by'),
+    State('data-table', 'filter_query'),
+    State('session-id', 'data'),
     prevent_initial_call=True
 )
-def download_csv(n_clicks, data):
-    if not data:
+def update_tags(add_clicks, delete_clicks, dataset_id, tag_input, page_current, page_size, sort_by, filter_query, session_id):
+    if not dataset_id:
+        return dash.no_update, dash.no_update, dash.no_update, *feedback("No data to process", "warning")
+    if not tag_input:
         raise PreventUpdate
-    df = pd.DataFrame(data)
-    return dcc.send_data_frame(df.to_csv, "processed_data.csv", index=False)
+
+    method = "POST" if dash.callback_context.triggered_id == 'add-tag-button' else "DELETE"
+    # When the view is sorted or filtered on Tag the visible rows themselves can change
+    view_depends_on_tag = any(s.get('column_id') == 'Tag' for s in (sort_by or [])) or '{Tag}' in (filter_query or '')
+    try:
+        tags = [t.strip() for t in tag_input.split(',')]
+        params = table_view_params(page_current, page_size, sort_by, filter_query,
+                                   columns=None if view_depends_on_tag else ['Tag'])
+        body, error_message = call_dataset_api(method, dataset_url(dataset_id, "tags"), session_id, json={"tags": tags}, params=params)
+    except Exception as e:
+        error_message = f"An unexpected error occurred: {str(e)}"
+    if error_message:
+        return dash.no_update, dash.no_update, dash.no_update, *feedback(error_message, "danger")
+
+    message, color = ("Tags added successfully.", "success") if method == "POST" else ("Tags deleted successfully.", "warning")
+    preview = body["preview"]
+    if view_depends_on_tag:
+        return preview["data"], page_count(preview), body["dataset_id"], *feedback(message, color)
+
+    patched_data = Patch()
+    for i, record in enumerate(preview["data"]):
+        patched_data[i]["Tag"] = record.get("Tag")
+    return patched_data, dash.no_update, body["dataset_id"], *feedback(message, color)
+
+
+# Reset all inputs
+@app.callback(
+    Output('data-table-div', 'children', allow_duplicate=True),
+    Output('processed-data', 'data', allow_duplicate=True),
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Output('column-filter-select', 'options', allow_duplicate=True),
+    Output('filter-conditions', 'data', allow_duplicate=True),
+    Output('filter-conditions-list', 'children', allow_duplicate=True),
+    Input('reset-button', 'n_clicks'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def reset_data(n_clicks, session_id):
+    try:
+        call_api("DELETE", DATASETS_API_URL, session_id)  # Free the session's datasets on the server
+    except Exception:
+        pass
+    return None, None, *feedback("All inputs have been reset.", "info"), [], [], []
+
+
+# Every new version pushes the previous one on the undo stack; a new edit discards the redo stack
+@app.callback(
+    Output('history', 'data'),
+    Input('processed-data', 'data'),
+    State('history', 'data'),
+    prevent_initial_call=True
+)
+def track_history(dataset_id, history):
+    history = history or {'undo': [], 'redo': [], 'current': None}
+    if dataset_id == history['current']:
+        raise PreventUpdate  # Set by undo/redo, which already updated the stacks
+    if dataset_id is None:
+        return {'undo': [], 'redo': [], 'current': None}
+    undo = history['undo'] + [history['current']] if history['current'] else history['undo']
+    return {'undo': undo, 'redo': [], 'current': dataset_id}
+
+
+@app.callback(
+    Output('undo-button', 'disabled'),
+    Output('redo-button', 'disabled'),
+    Input('history', 'data')
+)
+def update_history_buttons(history):
+    return not (history or {}).get('undo'), not (history or {}).get('redo')
+
+
+# Undo and redo switch back to a stored version; the columns may differ, so the table is rebuilt
+@app.callback(
+    Output('data-table-div', 'children', allow_duplicate=True),
+    Output('processed-data', 'data', allow_duplicate=True),
+    Output('history', 'data', allow_duplicate=True),
+    Output('column-filter-select', 'options', allow_duplicate=True),
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Input('undo-button', 'n_clicks'),
+    Input('redo-button', 'n_clicks'),
+    State('history', 'data'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def undo_redo(undo_clicks, redo_clicks, history, session_id):
+    undo = dash.callback_context.triggered_id == 'undo-button'
+    source, target = ('undo', 'redo') if undo else ('redo', 'undo')
+    if not history or not history[source]:
+        raise PreventUpdate
+
+    dataset_id = history[source][-1]
+    history = dict(history, **{source: history[source][:-1]})
+    try:
+        body, error_message = call_dataset_api("GET", dataset_url(dataset_id), session_id, params={"page_size": TABLE_PAGE_SIZE})
+    except Exception as e:
+        error_message = f"An unexpected error occurred: {str(e)}"
+    if error_message:
+        # The version was evicted on the server; drop it so the next step goes further back
+        return dash.no_update, dash.no_update, history, dash.no_update, *feedback(error_message, "warning")
+
+    history[target] = history[target] + [history['current']]
+    history['current'] = dataset_id
+    preview = body["preview"]
+    column_options = [{'label': col, 'value': col} for col in preview["columns"]]
+    message = "Undid the last change." if undo else "Redid the change."
+    return create_data_table(preview), dataset_id, history, column_options, *feedback(message, "info")
+
+
+# Column statistics are computed once per version on the API and updated incrementally after operations
+@app.callback(
+    Output('profile-div', 'children'),
+    Output('profile-data', 'data'),
+    Input('processed-data', 'data'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def update_profile(dataset_id, session_id):
+    if not dataset_id:
+        return None, None
+    try:
+        profile, error_message = call_api("GET", dataset_url(dataset_id, "profile"), session_id, params={"top_k": 20})
+    except Exception:
+        raise PreventUpdate
+    if error_message:
+        return None, None
+    return create_profile_view(profile), profile
+
+
+# Autocomplete filter values from the most frequent values of the selected column
+@app.callback(
+    Output('filter-value-options', 'children'),
+    Input('column-filter-select', 'value'),
+    Input('profile-data', 'data')
+)
+def update_filter_value_options(selected_column, profile):
+    if not selected_column or not profile:
+        return []
+    for col in profile["columns"]:
+        if col["name"] == selected_column:
+            return [html.Option(value=top["value"]) for top in col["top"]]
+    return []
+
+
+# Load leads to CRM; nothing but the feedback message changes
+@app.callback(
+    Output('feedback-message', 'children', allow_duplicate=True),
+    Output('feedback-message', 'is_open', allow_duplicate=True),
+    Output('feedback-message', 'color', allow_duplicate=True),
+    Input('load-leads-button', 'n_clicks'),
+    State('processed-data', 'data'),
+    State('session-id', 'data'),
+    background=True,
+    progress=[Output('load-progress', 'value'), Output('load-progress', 'label')],
+    running=[
+        (Output('load-leads-button', 'disabled'), True, False),
+        (Output('cancel-load-button', 'disabled'), False, True),
+        (Output('load-progress', 'animated'), True, False),
+    ],
+    cancel=[Input('cancel-load-button', 'n_clicks')],
+    prevent_initial_call=True
+)
+def load_leads(set_progress, n_clicks, dataset_id, session_id):
+    if not dataset_id:
+        return feedback("No data to process", "warning")
+    set_progress((0, ""))
+    # Cancelling kills this job, which closes the connection and stops the API from sending more contacts
+    on_progress = lambda event: set_progress((100 * event.get("progress", 0), progress_label(event)))
+    try:
+        body, error_message = stream_api("POST", LOAD_LEADS_API_URL, session_id, on_progress, json={"dataset_id": dataset_id})
+    except Exception as e:
+        error_message = f"An unexpected error occurred: {str(e)}"
+    if error_message:
+        return feedback(error_message, "danger")
+    return feedback(f"Leads loaded to the CRM: {body['loaded']:,} loaded, {body['failed']:,} failed.", "success")
+
+
+# Fetch only the visible page of the sorted and filtered dataset from the API
+@app.callback(
+    Output('data-table', 'data'),
+    Output('data-table', 'page_count'),
+    Input('data-table', 'page_current'),
+    Input('data-table', 'page_size'),
+    Input('data-table', 'sort_by'),
+    Input('data-table', 'filter_query'),
+    State('processed-data', 'data'),
+    State('session-id', 'data'),
+    prevent_initial_call=True
+)
+def update_table_page(page_current, page_size, sort_by, filter_query, dataset_id, session_id):
+    if not dataset_id:
+        raise PreventUpdate
+    params = table_view_params(page_current, page_size, sort_by, filter_query)
+    body, error_message = call_dataset_api("GET", dataset_url(dataset_id), session_id, params=params)
+    if error_message:
+        raise PreventUpdate
+    preview = body["preview"]
+    return preview["data"], page_count(preview)
+
+
+# Downloads are streamed from the API through the Dash server in chunks, with constant memory
+@app.server.route('/download/<dataset_id>')
+def download_dataset(dataset_id):
+    export_format = request.args.get("format") if request.args.get("format") in ("xlsx", "parquet", "feather") else "csv"
+    params = {"compression": request.args["compression"]} if request.args.get("compression") else None
+    upstream = requests.get(dataset_url(dataset_id, export_format), headers={"X-Session-ID": request.args.get("session", "")},
+                            params=params, stream=True)
+    if upstream.status_code == 404:
+        upstream.close()
+        return Response("The data is no longer available. Please upload the file again.", status=404, mimetype="text/plain")
+    if upstream.status_code != 200:
+        # Other errors (e.g. an export format the API cannot write) are passed on as the API reported them
+        body = upstream.content
+        upstream.close()
+        return Response(body, status=upstream.status_code, mimetype=upstream.headers.get("Content-Type", "text/plain"))
+
+    def chunks():
+        try:
+            yield from upstream.iter_content(chunk_size=64 * 1024)
+        finally:
+            upstream.close()
+    return Response(stream_with_context(chunks()), mimetype=upstream.headers.get("Content-Type"),
+                    headers={"Content-Disposition": upstream.headers.get("Content-Disposition", "attachment")})
+
+
+@app.callback(
+    Output('download-link', 'href'),
+    Input('processed-data', 'data'),
+    Input('download-format', 'value'),
+    State('session-id', 'data')
+)
+def update_download_link(dataset_id, download_format, session_id):
+    if not dataset_id:
+        return None
+    query = {"session": session_id or ""}
+    if download_format in ('xlsx', 'parquet', 'feather'):
+        query["format"] = download_format
+    elif download_format == 'csv-gzip':
+        query["compression"] = "gzip"
+    return app.get_relative_path(f"/download/{dataset_id}") + "?" + urlencode(query)
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    # Development server only; use serve.py for production serving
+    app.run_server(port=int(os.getenv("DASH_PORT", 8050)), debug=os.getenv("DASH_DEBUG") == "1")
 
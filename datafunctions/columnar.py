@@ -0,0 +1,141 @@
+import os
+
+from datafunctions.transport import to_arrow_table
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet and Feather support is optional; CSV and Excel work without pyarrow
+    pa = None
+
+
+# File extensions of the columnar formats
+columnar_extensions = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+COLUMNAR_MIMETYPES = {'parquet': 'application/vnd.apache.parquet', 'feather': 'application/vnd.apache.arrow.file'}
+
+
+##========= Parquet and Feather (Arrow IPC file) input/output ==================
+def columnar_available():
+    """Whether pyarrow is installed, so Parquet and Feather files can be read and written."""
+    return pa is not None
+
+
+def columnar_format(filename):
+    """'parquet' or 'feather' for file names with a columnar extension, else None."""
+    return columnar_extensions.get(os.path.splitext(str(filename).lower())[1])
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ValueError("Reading and writing Parquet or Feather files requires the pyarrow package")
+
+
+def _schema(source, file_format):
+    if file_format == 'parquet':
+        return pq.read_schema(source)
+    return feather.read_table(source, columns=[], memory_map=False).schema
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def _present_columns(source, file_format, columns):
+    """The requested columns the file has, in file order; missing ones are left to the caller to report."""
+    names = _schema(source, file_format).names
+    _rewind(source)
+    wanted = set(columns)
+    return [name for name in names if name in wanted]
+
+
+def read_columnar(source, file_format, columns=None, filters=None):
+    """
+    Read a Parquet or Feather file into a DataFrame.
+
+    Only the requested columns are read from the file. Parquet row filters are pushed down to
+    the reader, which skips the row groups their statistics rule out; Feather files are
+    filtered after reading.
+
+    Args:
+        source (str or file-like object): The file path or a seekable binary stream.
+        file_format (str): 'parquet' or 'feather'.
+        columns (list, optional): Columns to read; columns the file does not have are ignored.
+        filters (list, optional): Row filters in pyarrow's form, e.g.
+                                  [('PERSONAL_STATE', 'in', ['VA', 'PA']), ('DNC', '=', 'N')].
+
+    Returns:
+        pd.DataFrame: The data.
+
+    Raises:
+        ValueError: If pyarrow is not installed or the format is unknown.
+    """
+    _require_pyarrow()
+    if file_format not in ('parquet', 'feather'):
+        raise ValueError(f"Unsupported columnar format '{file_format}'")
+    if columns is not None:
+        columns = _present_columns(source, file_format, columns)
+
+    if file_format == 'parquet':
+        table = pq.read_table(source, columns=columns, filters=filters or None)
+    else:
+        table = feather.read_table(source, columns=columns, memory_map=False)
+        if filters:
+            table = table.filter(pq.filters_to_expression(filters))
+    return table.to_pandas()
+
+
+def iter_columnar_chunks(source, file_format, chunk_size, columns=None):
+    """
+    Read a Parquet or Feather file in chunks of about `chunk_size` rows.
+
+    Parquet files are read row group by row group and Feather files record batch by record
+    batch, so only one batch of the file is held in memory at a time.
+
+    Yields:
+        tuple: The chunk DataFrame and the fraction of the file read so far.
+    """
+    _require_pyarrow()
+    if columns is not None:
+        columns = _present_columns(source, file_format, columns)
+    if file_format == 'parquet':
+        parquet_file = pq.ParquetFile(source)
+        total = parquet_file.metadata.num_rows or 1
+        rows = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            rows += batch.num_rows
+            yield batch.to_pandas(), min(rows / total, 1.0)
+        return
+
+    reader = ipc.open_file(source)
+    n_batches = reader.num_record_batches
+    for i in range(n_batches):
+        batch = reader.get_batch(i)
+        if columns is not None:
+            batch = batch.select(columns)
+        # Writers choose the batch size, so large batches are split into chunks
+        for chunk in pa.Table.from_batches([batch]).to_batches(max_chunksize=chunk_size):
+            yield chunk.to_pandas(), (i + 1) / n_batches
+
+
+def write_columnar(df, destination, file_format='parquet', compression='zstd'):
+    """
+    Write a DataFrame as a compressed Parquet or Feather file.
+
+    Args:
+        df (pd.DataFrame): The data to write.
+        destination (str or file-like object): The file path or a binary stream.
+        file_format (str): 'parquet' or 'feather'.
+        compression (str): 'zstd', 'lz4' or None (Parquet also accepts 'snappy' and 'gzip').
+    """
+    _require_pyarrow()
+    if file_format not in ('parquet', 'feather'):
+        raise ValueError(f"Unsupported columnar format '{file_format}'")
+    table = to_arrow_table(df)
+    if file_format == 'parquet':
+        pq.write_table(table, destination, compression=compression or 'none')
+    else:
+        feather.write_feather(table, destination, compression=compression or 'uncompressed')
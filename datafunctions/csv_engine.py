@@ -0,0 +1,134 @@
+import logging
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # The multithreaded engine is optional; pandas' C parser is used without pyarrow
+    pa = None
+
+
+csv_engines = ('pyarrow', 'c')
+
+# Parser used for CSV input: 'pyarrow' parses blocks of the file on all cores, 'c' is pandas' parser
+default_engine = os.getenv("CSV_ENGINE", "pyarrow")
+
+# Bytes of CSV parsed per block by the pyarrow engine; larger blocks mean fewer, bigger parallel tasks
+default_block_size = int(os.getenv("CSV_BLOCK_SIZE", 8 * 1024 * 1024))
+
+
+##========= Selectable CSV parser engine ========================================
+def _engine(engine):
+    engine = engine or default_engine
+    if engine not in csv_engines:
+        raise ValueError(f"Unsupported CSV engine '{engine}', use one of: {', '.join(csv_engines)}")
+    return engine if pa is not None else 'c'
+
+
+def _arrow_options(block_size, dtype, usecols):
+    read_options = pa_csv.ReadOptions(use_threads=True, block_size=block_size or default_block_size)
+    # Empty fields become missing values, as with pandas' parser
+    convert_options = pa_csv.ConvertOptions(
+        column_types={col: pa.string() for col in (dtype or {})},
+        strings_can_be_null=True,
+        include_columns=list(usecols) if usecols is not None else None,
+        include_missing_columns=False,
+    )
+    return read_options, convert_options
+
+
+def _to_pandas(table, dtype):
+    df = table.to_pandas()
+    return df.astype({col: kind for col, kind in (dtype or {}).items() if col in df.columns})
+
+
+def _rewind(source):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def _header(source):
+    """Column names of a CSV file, read from its first block only."""
+    with pa_csv.open_csv(source, read_options=pa_csv.ReadOptions(block_size=64 * 1024)) as reader:
+        names = reader.schema.names
+    _rewind(source)
+    return names
+
+
+def read_csv(source, engine=None, block_size=None, dtype=None, usecols=None):
+    """
+    Parse a CSV file with the selected engine.
+
+    The pyarrow engine splits the file into blocks of `block_size` bytes and parses them on
+    all cores. Input it cannot parse (e.g. ragged rows or line breaks inside quoted values)
+    is parsed again with pandas' C parser, which is also used when pyarrow is not installed.
+
+    Args:
+        source (str or file-like object): The file path or a seekable binary stream.
+        engine (str, optional): 'pyarrow' or 'c'; defaults to the CSV_ENGINE setting.
+        block_size (int, optional): Bytes per parsed block; defaults to CSV_BLOCK_SIZE.
+        dtype (dict, optional): Text columns, e.g. {'MOBILE_PHONE': 'string'}; only text
+                                types are supported, other columns are inferred.
+        usecols (list, optional): Columns to read; columns the file does not have are ignored.
+
+    Returns:
+        pd.DataFrame: The parsed data.
+    """
+    if _engine(engine) == 'pyarrow':
+        try:
+            if usecols is not None:
+                usecols = [col for col in _header(source) if col in set(usecols)]
+            read_options, convert_options = _arrow_options(block_size, dtype, usecols)
+            return _to_pandas(pa_csv.read_csv(source, read_options=read_options, convert_options=convert_options), dtype)
+        except pa.ArrowInvalid as e:
+            logging.warning(f"Multithreaded CSV parsing failed ({e}), falling back to the C parser.")
+            _rewind(source)
+    return pd.read_csv(source, dtype=dtype, usecols=(lambda col: col in usecols) if usecols is not None else None)
+
+
+def iter_read_csv(source, chunk_size, engine=None, block_size=None, dtype=None):
+    """
+    Parse a CSV file in chunks with the selected engine.
+
+    With the pyarrow engine every chunk is one parsed block, so chunks hold roughly
+    `block_size` bytes of rows rather than exactly `chunk_size` rows. If the file turns out
+    to be malformed, parsing continues with pandas' C parser after the rows already yielded.
+
+    Args:
+        source (file-like object): A seekable binary stream.
+        chunk_size (int): Rows per chunk with the C parser.
+        engine (str, optional): 'pyarrow' or 'c'; defaults to the CSV_ENGINE setting.
+        block_size (int, optional): Bytes per parsed block; defaults to CSV_BLOCK_SIZE.
+        dtype (dict, optional): Text columns, as for `read_csv`.
+
+    Yields:
+        pd.DataFrame: The parsed chunks.
+    """
+    rows = 0
+    if _engine(engine) == 'pyarrow':
+        read_options, convert_options = _arrow_options(block_size, dtype, None)
+        try:
+            with pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options) as reader:
+                for batch in reader:
+                    chunk = _to_pandas(pa.Table.from_batches([batch]), dtype)
+                    chunk.index += rows
+                    rows += len(chunk)
+                    yield chunk
+            return
+        except pa.ArrowInvalid as e:
+            logging.warning(f"Multithreaded CSV parsing failed after {rows} rows ({e}), falling back to the C parser.")
+            _rewind(source)
+
+    # Parse again from the start and drop the records the pyarrow engine already produced: values
+    # spanning several lines make line numbers differ from record numbers, so lines cannot be skipped
+    skip = rows
+    for chunk in pd.read_csv(source, chunksize=chunk_size, dtype=dtype):
+        if skip:
+            dropped = min(skip, len(chunk))
+            chunk = chunk.iloc[dropped:]
+            skip -= dropped
+            if chunk.empty:
+                continue
+        yield chunk
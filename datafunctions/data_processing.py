@@ -4,14 +4,24 @@ import base64
 import io
 import logging
 
+from datafunctions.columnar import columnar_format, read_columnar
+from datafunctions.csv_engine import read_csv
+from datafunctions.excel_engine import read_excel
 
-##=========Load data from a CSV or Excel file ==================================
-def load_data(file):
+
+##=========Load data from a CSV, Excel, Parquet or Feather file ==================
+def load_data(file, columns=None, filters=None):
     """
-    Load data from a CSV or Excel file.
+    Load data from a CSV, Excel, Parquet or Feather file. Only the first sheet of an Excel
+    workbook is read.
 
     Args:
         file (str or file-like object): The file path or file-like object to be loaded.
+        columns (list, optional): Columns to load. Parquet and Feather files only read these
+                                  columns; columns a file does not have are ignored.
+        filters (list, optional): Row filters for Parquet and Feather files, in pyarrow's form,
+                                  e.g. [('PERSONAL_STATE', 'in', ['VA', 'PA'])]; pushed down
+                                  to the Parquet reader.
 
     Returns:
         pd.DataFrame: The loaded data as a DataFrame.
@@ -19,11 +29,17 @@ def load_data(file):
     Raises:
         ValueError: If the file type is unsupported or an error occurs during loading.
     """
+    name = file if isinstance(file, str) else file.name
     try:
-        if file.name.endswith('.csv'):
-            return pd.read_csv(file)
-        elif file.name.endswith('.xlsx'):
-            return pd.read_excel(file)
+        file_format = columnar_format(name)
+        if file_format:
+            return read_columnar(file, file_format, columns=columns, filters=filters)
+        if filters:
+            raise ValueError("Row filters are only supported for Parquet and Feather files")
+        if name.endswith('.csv'):
+            return read_csv(file, usecols=columns)
+        elif name.endswith('.xlsx'):
+            return read_excel(file, usecols=columns)
         else:
             raise ValueError("Unsupported file type")
     except Exception as e:
@@ -31,26 +47,17 @@ def load_data(file):
 
 
 ## Format column names to title case  ===
-def format_and_apply_title_case(df, columns=None):
+def format_and_apply_title_case(df):
     """
-    Format column names to title case and replace underscores or hyphens with spaces.
-    Apply title case to specified columns. If no columns are specified, apply title case to all columns.
+    Format column names to title case and replace underscores with spaces.
 
     Args:
         df (pd.DataFrame): The DataFrame to be processed.
-        columns (list, optional): List of column names to apply title case to. If None, all columns are processed.
 
     Returns:
-        pd.DataFrame: The DataFrame with formatted column names and title-cased columns.
+        pd.DataFrame: The DataFrame with formatted column names.
     """
-    # Format column names to title case and replace underscores or hyphens with spaces
-    df.columns = [re.sub(r'[_-]', ' ', col).title() for col in df.columns]
-
-    # Apply title case to specified columns or all columns if none are specified
-    if columns is None:
-        columns = df.columns
-    df[columns] = df[columns].applymap(lambda x: x.title() if isinstance(x, str) else x)
-
+    df.columns = [col.replace('_', ' ').title() for col in df.columns]
     return df
 
 
@@ -66,50 +73,52 @@ def to_csv_bytes(data):
     return data.to_csv(index=False).encode('utf-8')
 
 
+#======= Decode uploaded content to a binary stream ========
+def decode_upload(contents):
+    """
+    Decode the base64 data URL sent by a dcc.Upload component into the raw file bytes.
+
+    The bytes are handed to parsers through a BytesIO, which shares the decoded buffer,
+    so the file is never copied into a Python str.
+
+    Args:
+        contents (str): The upload contents ('data:<type>;base64,<data>').
+
+    Returns:
+        bytes: The raw file content.
+    """
+    return base64.b64decode(contents[contents.index(',') + 1:])
+
+
 #======= Parse content to csv or strong for download========
 def parse_contents(contents, filename):
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
+    decoded = decode_upload(contents)
     try:
         if 'csv' in filename:
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
+            df = read_csv(io.BytesIO(decoded))
             return df, None
         elif 'xlsx' in filename:
-            df = pd.read_excel(io.BytesIO(decoded))
+            df = read_excel(io.BytesIO(decoded))
+            return df, None
+        elif columnar_format(filename):
+            df = read_columnar(io.BytesIO(decoded), columnar_format(filename))
             return df, None
         else:
-            return None, "Unsupported file format. Please upload a CSV or Excel file."
+            return None, "Unsupported file format. Please upload a CSV, Excel, Parquet or Feather file."
     except Exception as e:
         return None, str(e)
 
 
 # clean and tag data
-
-def format_and_apply_title_case(df):
-    df.columns = [col.replace('_', ' ').title() for col in df.columns]
-    return df
-
-def format_and_apply_title_case(df):
-    df.columns = [col.replace('_', ' ').title() for col in df.columns]
-    return df
-
-import pandas as pd
-import re
-import logging
-
-import re
-import logging
-import pandas as pd
-from typing import Optional, Dict, List
-
-
-
 def clean_and_tag_data(df, file_name):
     """
     Processes a DataFrame by tagging rows based on conditions and updating 'Mobile Phone' values.
-    Adds a 'Contact ID' column and checks the file name for specific tags.
+    Checks the file name for specific tags.
     Ensures only valid phone numbers (10 digits or more) are retained.
 
+    Runs the export cleaning pipeline (ingest, address check, phone normalize, tag, title-case,
+    phone format), whose stage outputs are memoized.
+
     Args:
         df (pd.DataFrame): The DataFrame to be processed.
         file_name (str): The name of the uploaded file used for tagging.
@@ -118,104 +127,14 @@ def clean_and_tag_data(df, file_name):
         pd.DataFrame: Processed and tagged DataFrame.
         None: If the DataFrame is empty or required columns are missing.
     """
-    if df is None or df.empty:
-        logging.error("No data to process.")
-        return None
+    # Imported here because the pipeline stages are built on the helpers of this module
+    from datafunctions.pipeline import PipelineError, audience_tag, export_cleaning_pipeline
 
     try:
-        # Create a copy to avoid SettingWithCopyWarning
-        df = df.copy()
-
-        # Verify required columns are present
-        required_columns = ['MOBILE_PHONE', 'PERSONAL_ADDRESS', 'BUSINESS_EMAIL', 'PERSONAL_EMAIL', 'DNC']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            logging.error(f"Missing required columns: {', '.join(missing_columns)}")
-            return None
-
-        # Convert 'MOBILE_PHONE' to string type
-        df['MOBILE_PHONE'] = df['MOBILE_PHONE'].astype(str)
-
-        # Initialize the 'Tag' column
-        df['Tag'] = ''
-
-        # Patterns for identifying P.O. Box and formatting phone numbers
-        po_box_pattern = re.compile(r'\b[Pp]\.? *[Oo]\.? *Box\b')
-        phone_pattern = re.compile(r'\+?\d[\d\s-]*\d')
-
-        # Tagging and processing logic
-        for index, row in df.iterrows():
-            tags = []
-
-            # File-based tagging
-            if 'B2B' in file_name.upper():
-                tags.append('advertiser')
-            elif 'B2C' in file_name.upper():
-                tags.append('reader')
-
-            # Address checks and tagging
-            personal_address = str(row['PERSONAL_ADDRESS']) if pd.notna(row['PERSONAL_ADDRESS']) else ''
-            if po_box_pattern.search(personal_address) or '-' in personal_address:
-                df.loc[index, ['PERSONAL_ADDRESS', 'PERSONAL_STATE', 'PERSONAL_ZIP']] = pd.NA
-            else:
-                tags.append('programmatic')
-
-            # Email and social tagging
-            if pd.notna(row['BUSINESS_EMAIL']) and row['BUSINESS_EMAIL'] != '-':
-                tags.append('email')
-            if pd.notna(row['PERSONAL_EMAIL']) and row['PERSONAL_EMAIL'] != '-':
-                tags.append('social')
-
-            # SMS tagging and handling DNC
-            if row['DNC'] == 'Y':
-                df.loc[index, 'MOBILE_PHONE'] = pd.NA
-            elif pd.notna(row['MOBILE_PHONE']) and row['MOBILE_PHONE'] != '-':
-                phone_match = phone_pattern.search(str(row['MOBILE_PHONE']))
-                if phone_match:
-                    # Extract only digits from the phone number
-                    digits_only = re.sub(r'[^\d]', '', phone_match.group())
-                    
-                    # Check if the number has at least 10 digits
-                    if len(digits_only) >= 10:
-                        # If the number starts with '1' and has 11 digits, remove the '1'
-                        if len(digits_only) == 11 and digits_only.startswith('1'):
-                            digits_only = digits_only[1:]
-                        # Keep only the first 10 digits if there are more
-                        standard_phone = digits_only[:10]
-                        df.loc[index, 'MOBILE_PHONE'] = standard_phone
-                        tags.append('sms')
-                    else:
-                        # Set phone numbers with fewer than 10 digits to NA
-                        df.loc[index, 'MOBILE_PHONE'] = pd.NA
-                else:
-                    df.loc[index, 'MOBILE_PHONE'] = pd.NA
-
-            # Update the 'Tag' column
-            df.loc[index, 'Tag'] = ', '.join(tags)
-
-        # Add 'Contact ID' as an auto-incrementing serial number
-        df['Contact ID'] = range(1, len(df) + 1)
-
-        # Define columns to be included in the final output
-        selected_columns = [
-            'FIRST_NAME', 'LAST_NAME', 'BUSINESS_EMAIL', 'MOBILE_PHONE',
-            'PERSONAL_ADDRESS', 'PERSONAL_CITY', 'PERSONAL_STATE', 'PERSONAL_ZIP',
-            'PERSONAL_EMAIL', 'Tag'
-        ]
-        # Ensure only existing columns are selected
-        selected_columns = [col for col in selected_columns if col in df.columns]
-
-        # Select and format columns
-        df = df[selected_columns].replace('-', '', inplace=False)
-        df_formatted = format_and_apply_title_case(df)
-        df_formatted['Mobile Phone'] = df_formatted['Mobile Phone'].fillna("")  # Fill missing phone numbers with empty string
-
-        # Preserve phone format only if the value is not blank, NaN, or empty
-        df_formatted = preserve_phone_format(df_formatted, column_name='Mobile Phone')
-
-        return df_formatted
-
-
+        return export_cleaning_pipeline.run(df, overrides={'tag': {'file_tag': audience_tag(file_name)}})
+    except PipelineError as e:
+        logging.error(str(e))
+        return None
     except Exception as e:
         logging.error(f"Error processing data: {str(e)}")
         return None
@@ -320,40 +239,6 @@ def combine_multiple_files(files):
     return appended_data
 
 # Helper function to preserve phone number format
-
-
-import pandas as pd
-import re
-
-# def preserve_phone_format(df, column_name='Mobile Phone'):
-#     """
-#     Ensure phone numbers retain the +1 prefix format only if the value is not blank, NaN, or empty.
-
-#     Args:
-#         df (pd.DataFrame): The DataFrame to process.
-#         column_name (str): The name of the column containing phone numbers.
-
-#     Returns:
-#         pd.DataFrame: The DataFrame with formatted phone numbers.
-#     """
-#     if column_name in df.columns:
-#         def format_phone_number(x):
-#             # Check if the value is not NaN and is not an empty string
-#             if pd.notna(x) and x != '':
-#                 x = str(x).strip()  # Convert to string and strip whitespace
-#                 if x.isdigit() or re.match(r'^\+?\d+', x):  # Check if it contains only numbers or starts with a +
-#                     if '.' in x:
-#                         x = x.split('.')[0]  # Remove the decimal part if present
-#                     if not x.startswith('+'):
-#                         x = f"'+{x}"  # Add + if it's not already present
-#             return x
-        
-#         # Use .loc to ensure no SettingWithCopyWarning occurs
-#         df.loc[:, column_name] = df[column_name].apply(format_phone_number)
-    
-#     return df
-
-
 def preserve_phone_format(df, column_name='Mobile Phone'):
     """
     Format phone numbers for Excel display, removing nan values and ensuring consistent formatting.
@@ -392,4 +277,59 @@ def preserve_phone_format(df, column_name='Mobile Phone'):
         # Apply the formatting function
         df.loc[:, column_name] = df[column_name].apply(format_phone_number)
     
-    return df
\ No newline at end of file
+    return df
+
+#======= Dataset operations used by the API dataset endpoints ========
+def add_tags(df, tags, column='Tag'):
+    """
+    Add tags to every row of the tag column, skipping tags a row already has.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to tag.
+        tags (list): The tags to add.
+        column (str): The name of the tag column.
+
+    Returns:
+        pd.DataFrame: A new DataFrame with the updated tag column; with copy-on-write enabled
+                      it shares the other columns with the input.
+    """
+    existing = df[column] if column in df.columns else pd.Series('', index=df.index)
+
+    def merge_tags(x):
+        current = x.split(', ') if isinstance(x, str) and x else []
+        return ', '.join(current + [t for t in tags if t not in current])
+
+    return df.assign(**{column: existing.apply(merge_tags)})
+
+
+def delete_tags(df, tags, column='Tag'):
+    """
+    Remove tags from every row of the tag column.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to update.
+        tags (list): The tags to remove.
+        column (str): The name of the tag column.
+
+    Returns:
+        pd.DataFrame: A new DataFrame with the updated tag column; with copy-on-write enabled
+                      it shares the other columns with the input.
+    """
+    if column not in df.columns:
+        return df.copy()
+    return df.assign(**{column: df[column].apply(
+        lambda x: ', '.join([t for t in (x.split(', ') if isinstance(x, str) and x else []) if t not in tags])
+    )})
+
+
+def select_columns(df, columns):
+    """
+    Keep only the given columns, in the given order.
+
+    Raises:
+        ValueError: If any of the columns does not exist.
+    """
+    missing_columns = [col for col in columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Columns not found: {', '.join(missing_columns)}")
+    return df[columns]
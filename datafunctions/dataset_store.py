@@ -0,0 +1,372 @@
+import glob
+import os
+import pickle
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+
+dataset_id_pattern = re.compile(r'^[0-9a-f]{32}$')
+namespace_pattern = re.compile(r'^[\w-]{1,64}$')
+
+# Directory of the column files shared by all versions; the dot keeps it apart from namespaces
+_columns_directory = '.columns'
+
+
+##========= Server-side store of processed dataset versions ====================
+class DatasetStore:
+    """
+    Thread-safe store of processed datasets.
+
+    Every operation on a dataset (filter, tag, column selection) stores its result
+    as a new version with its own ID, so clients only hold on to the ID of the
+    version they are looking at instead of the data itself. Versions are immutable,
+    so going back to an earlier version (undo) or forward again (redo) is only a
+    matter of switching IDs.
+
+    Versions share unchanged columns with the version they were derived from: an
+    operation that only rewrites some columns (e.g. a tag edit rewriting `Tag`) passes
+    them as `changed_columns`, and the new version references every other column of its
+    parent instead of copying it, in memory and on disk. Memory is accounted per column,
+    so a shared column only counts once.
+
+    Versions are grouped in namespaces (e.g. one per browser session), each keeping at
+    most `max_versions` versions, so one busy session cannot evict the data of the others.
+
+    Without a directory, versions only live in the memory of the current process.
+    With a directory, every version is also written to disk there, so several server
+    worker processes pointed at the same directory share their datasets; the memory
+    copy then only acts as a cache in front of the disk. On disk, a version is a small
+    manifest (`<namespace>/<id>.pkl`) listing the column files it uses, which live in
+    a `.columns` directory shared by all versions; column files no longer referenced by
+    any manifest are removed after `column_grace` seconds.
+
+    Args:
+        max_versions (int): Maximum number of versions kept per namespace.
+                            The least recently used versions are evicted first.
+        directory (str, optional): Shared directory in which versions are persisted.
+        max_bytes (int, optional): Memory limit for the datasets held in memory by this process.
+        namespace_ttl (float): Seconds after which an unused namespace is removed from disk.
+        column_grace (float): Seconds an unreferenced column file is kept on disk, so a version
+                              being written by another worker does not lose its columns.
+    """
+
+    def __init__(self, max_versions=50, directory=None, max_bytes=None, namespace_ttl=24 * 3600,
+                 column_grace=600):
+        self.max_versions = max_versions
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.namespace_ttl = namespace_ttl
+        self.column_grace = column_grace
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(os.path.join(directory, _columns_directory), exist_ok=True)
+
+    @staticmethod
+    def _check_namespace(namespace):
+        if not namespace_pattern.match(namespace):
+            raise ValueError(f"Invalid dataset namespace '{namespace}'")
+
+    def _path(self, dataset_id, namespace):
+        return os.path.join(self.directory, namespace, f"{dataset_id}.pkl")
+
+    def _column_path(self, key):
+        return os.path.join(self.directory, _columns_directory, f"{key}.pkl")
+
+    def _find_path(self, dataset_id):
+        paths = glob.glob(os.path.join(self.directory, '*', f"{dataset_id}.pkl"))
+        if not paths:
+            raise KeyError(dataset_id)
+        return paths[0]
+
+    @staticmethod
+    def _dump(obj, path):
+        # Write to a temporary file first so other workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _write(self, dataset_id, entry, new_keys):
+        df = entry["df"]
+        for key, values in [(entry["index_key"], df.index)] + [
+                (key, df.iloc[:, position].array) for position, (_, key) in enumerate(entry["columns"])]:
+            path = self._column_path(key)
+            if key in new_keys:
+                self._dump(values, path)
+                continue
+            try:
+                os.utime(path)  # Shared with the parent: mark as in use so it is not collected
+            except FileNotFoundError:
+                self._dump(values, path)  # Collected in the meantime, write it again
+
+        manifest = {k: entry[k] for k in ("parent_id", "operation", "namespace", "index_key", "columns")}
+        path = self._path(dataset_id, entry["namespace"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._dump(manifest, path)
+        self._evict_disk(entry["namespace"])
+
+    def _read(self, dataset_id):
+        path = self._find_path(dataset_id)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            raise KeyError(dataset_id)
+
+        # Columns already held in memory by other versions are reused instead of loaded again
+        with self._lock:
+            loaded = {}
+            for other in self._versions.values():
+                loaded[other["index_key"]] = other["df"].index
+                loaded.update((key, other["df"].iloc[:, position].array)
+                              for position, (_, key) in enumerate(other["columns"]))
+
+        def load(key):
+            if key not in loaded:
+                try:
+                    with open(self._column_path(key), 'rb') as f:
+                        loaded[key] = pickle.load(f)
+                except FileNotFoundError:
+                    raise KeyError(dataset_id)
+            return loaded[key]
+
+        index = load(entry["index_key"])
+        entry["df"] = pd.DataFrame({position: pd.Series(load(key), index=index, copy=False)
+                                    for position, (_, key) in enumerate(entry["columns"])}, index=index, copy=False)
+        entry["df"].columns = pd.Index([name for name, _ in entry["columns"]])
+
+        # Mark the version and its namespace as recently used for eviction
+        os.utime(path)
+        os.utime(os.path.dirname(path))
+        return entry
+
+    def _disk_versions(self, namespace):
+        """List (last used time, path) of the versions of a namespace on disk, least recently used first."""
+        versions = []
+        for path in glob.glob(os.path.join(self.directory, namespace, '*.pkl')):
+            try:
+                versions.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                continue  # Evicted by another worker in the meantime
+        return sorted(versions)
+
+    def _evict_disk(self, namespace):
+        evicted = False
+        versions = self._disk_versions(namespace)
+        for _, path in versions[:max(len(versions) - self.max_versions, 0)]:
+            try:
+                os.remove(path)
+                evicted = True
+            except FileNotFoundError:
+                pass  # Already evicted by another worker
+
+        # Drop the namespaces of sessions that have not been used for a while
+        expiry = time.time() - self.namespace_ttl
+        for other in os.listdir(self.directory):
+            other_path = os.path.join(self.directory, other)
+            try:
+                if (other != namespace and other != _columns_directory and os.path.isdir(other_path)
+                        and os.stat(other_path).st_mtime < expiry):
+                    shutil.rmtree(other_path, ignore_errors=True)
+                    evicted = True
+            except FileNotFoundError:
+                continue
+
+        if evicted:
+            self._collect_columns()
+
+    def _collect_columns(self):
+        """Remove column files that no version on disk references anymore."""
+        referenced = set()
+        for path in glob.glob(os.path.join(self.directory, '*', '*.pkl')):
+            try:
+                with open(path, 'rb') as f:
+                    manifest = pickle.load(f)
+            except (FileNotFoundError, EOFError):
+                continue  # Evicted, or being replaced, by another worker
+            referenced.add(manifest["index_key"])
+            referenced.update(key for _, key in manifest["columns"])
+
+        expiry = time.time() - self.column_grace
+        for path in glob.glob(os.path.join(self.directory, _columns_directory, '*.pkl')):
+            try:
+                if os.path.basename(path)[:-len('.pkl')] not in referenced and os.stat(path).st_mtime < expiry:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+
+    def _entry(self, dataset_id):
+        if not isinstance(dataset_id, str) or not dataset_id_pattern.match(dataset_id):
+            raise KeyError(dataset_id)
+        with self._lock:
+            entry = self._versions.get(dataset_id)
+            if entry is not None:
+                self._versions.move_to_end(dataset_id)
+                return entry
+        if not self.directory:
+            raise KeyError(dataset_id)
+        entry = self._read(dataset_id)
+        return self._cache(dataset_id, entry)
+
+    def _cache(self, dataset_id, entry):
+        if "nbytes" not in entry:
+            df = entry["df"]
+            entry["nbytes"] = {entry["index_key"]: int(df.index.memory_usage(deep=True))}
+            entry["nbytes"].update((key, int(df.iloc[:, position].memory_usage(deep=True, index=False)))
+                                   for position, (_, key) in enumerate(entry["columns"]))
+        with self._lock:
+            self._versions[dataset_id] = entry
+            self._evict_memory(entry["namespace"])
+        return entry
+
+    def _memory_usage(self):
+        """Bytes held by the cached versions, counting shared columns once (lock held)."""
+        nbytes = {}
+        for entry in self._versions.values():
+            nbytes.update(entry["nbytes"])
+        return sum(nbytes.values())
+
+    def _evict_memory(self, namespace):
+        """Evict least recently used versions over the namespace and memory limits (lock held)."""
+        in_namespace = [key for key, entry in self._versions.items() if entry["namespace"] == namespace]
+        for key in in_namespace[:max(len(in_namespace) - self.max_versions, 0)]:
+            del self._versions[key]
+        if self.max_bytes is not None:
+            # Always keep the most recent version, even if it alone exceeds the limit
+            while len(self._versions) > 1 and self._memory_usage() > self.max_bytes:
+                self._versions.popitem(last=False)
+
+    def _shared_keys(self, df, parent_id, changed_columns):
+        """Column keys of the parent version that the new version can reuse."""
+        if parent_id is None or changed_columns is None:
+            return None, {}
+        try:
+            parent = self._entry(parent_id)
+        except KeyError:
+            return None, {}
+        if not parent["df"].index.equals(df.index):
+            return None, {}
+        changed = set(changed_columns)
+        parent_keys = dict(parent["columns"])
+        return parent["index_key"], {name: parent_keys[name] for name in df.columns
+                                     if name in parent_keys and name not in changed}
+
+    def put(self, df, parent_id=None, operation=None, namespace='default', changed_columns=None):
+        """
+        Store a DataFrame as a new dataset version.
+
+        Args:
+            df (pd.DataFrame): The dataset to store.
+            parent_id (str, optional): ID of the version this one was derived from.
+            operation (str, optional): Name of the operation that produced it.
+            namespace (str): The namespace (e.g. session ID) the version belongs to.
+            changed_columns (list, optional): The only columns the operation changed; if the rows
+                                              are the same, all other columns are shared with the parent.
+
+        Returns:
+            str: The ID of the new version.
+
+        Raises:
+            ValueError: If the namespace contains characters other than letters, digits, '_' and '-'.
+        """
+        self._check_namespace(namespace)
+        dataset_id = uuid.uuid4().hex
+        index_key, shared = self._shared_keys(df, parent_id, changed_columns)
+        columns = [(name, shared.get(name) or uuid.uuid4().hex) for name in df.columns]
+        new_keys = {key for _, key in columns} - set(shared.values())
+        if index_key is None:
+            index_key = uuid.uuid4().hex
+            new_keys.add(index_key)
+        entry = {"df": df, "parent_id": parent_id, "operation": operation, "namespace": namespace,
+                 "index_key": index_key, "columns": columns}
+        if self.directory:
+            self._write(dataset_id, entry, new_keys)
+        self._cache(dataset_id, entry)
+        return dataset_id
+
+    def get(self, dataset_id):
+        """
+        Retrieve a stored dataset version.
+
+        Raises:
+            KeyError: If the version does not exist or has been evicted.
+        """
+        return self._entry(dataset_id)["df"]
+
+    def info(self, dataset_id):
+        """Return the lineage metadata (parent ID, operation and namespace) of a version."""
+        entry = self._entry(dataset_id)
+        return {"parent_id": entry["parent_id"], "operation": entry["operation"], "namespace": entry["namespace"]}
+
+    def latest(self, namespace='default'):
+        """Return the ID of the most recently used version of a namespace, or None if it is empty."""
+        self._check_namespace(namespace)
+        if self.directory:
+            versions = self._disk_versions(namespace)
+            if versions:
+                return os.path.basename(versions[-1][1])[:-len('.pkl')]
+        with self._lock:
+            ids = [key for key, entry in self._versions.items() if entry["namespace"] == namespace]
+        return ids[-1] if ids else None
+
+    def clear(self, namespace):
+        """Remove all versions of a namespace, e.g. when a session resets its data."""
+        self._check_namespace(namespace)
+        with self._lock:
+            for key in [key for key, entry in self._versions.items() if entry["namespace"] == namespace]:
+                del self._versions[key]
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, namespace), ignore_errors=True)
+            self._collect_columns()
+
+    def memory_usage(self):
+        """Return the number of bytes used by the datasets held in memory by this process."""
+        with self._lock:
+            return self._memory_usage()
+
+    def __contains__(self, dataset_id):
+        try:
+            self._entry(dataset_id)
+        except KeyError:
+            return False
+        return True
+
+
+def view_page(df, page=0, page_size=10, rows=None, columns=None):
+    """
+    Slice one page of a DataFrame.
+
+    Args:
+        df (pd.DataFrame): The dataset to page through.
+        page (int): Zero-based page number.
+        page_size (int): Number of rows per page.
+        rows (np.ndarray, optional): Row positions of a sorted and/or filtered view of the
+                                     dataset; the page is taken from this view.
+        columns (list, optional): Columns to include; unknown columns are ignored.
+
+    Returns:
+        tuple: The page DataFrame and the number of rows in the (filtered) view.
+    """
+    start = max(page, 0) * page_size
+    if rows is None:
+        page_df = df.iloc[start:start + page_size]
+        total_rows = len(df)
+    else:
+        page_df = df.iloc[rows[start:start + page_size]]
+        total_rows = len(rows)
+    if columns is not None:
+        page_df = page_df[[col for col in columns if col in df.columns]]
+    return page_df, total_rows
+
+
+def json_records(df):
+    """Convert a DataFrame to records, with missing values as None since NaN is not valid JSON."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
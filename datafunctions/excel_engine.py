@@ -0,0 +1,213 @@
+import io
+import itertools
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # The Rust-backed reader is optional; openpyxl streams workbooks in read-only mode without it
+    CalamineWorkbook = None
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+
+excel_engines = ('calamine', 'openpyxl')
+
+# Reader used for .xlsx input: 'calamine' parses sheets in Rust, 'openpyxl' streams them in read-only mode
+default_engine = os.getenv("EXCEL_ENGINE", "calamine")
+
+# Sheets the calamine engine loads in the background while the rows of the current sheet are read
+default_read_ahead = int(os.getenv("EXCEL_SHEET_READ_AHEAD", 1))
+
+
+##========= Selectable Excel reader engine ======================================
+def _engine(engine):
+    engine = engine or default_engine
+    if engine not in excel_engines:
+        raise ValueError(f"Unsupported Excel engine '{engine}', use one of: {', '.join(excel_engines)}")
+    if engine == 'calamine' and CalamineWorkbook is None:
+        engine = 'openpyxl'
+    if engine == 'openpyxl' and load_workbook is None:
+        raise ValueError("Reading Excel files requires the python-calamine or openpyxl package")
+    return engine
+
+
+def _read_bytes(source):
+    # Workbooks are zip archives: every sheet is read from its own in-memory copy of the (compressed) file
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            return f.read()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source.read()
+
+
+def _sheet_names(data, engine):
+    if engine == 'calamine':
+        return CalamineWorkbook.from_filelike(io.BytesIO(data)).sheet_names
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+
+def _load_sheet(data, engine, name):
+    """
+    Open one sheet: its rows as an iterator of tuples (header first), its number of rows if
+    known, and a function releasing the sheet once it is no longer needed.
+
+    calamine parses the whole sheet into a compact native range here, then converts rows to
+    Python values only as they are iterated; openpyxl parses the sheet's XML as rows are iterated.
+    """
+    if engine == 'calamine':
+        # One workbook per sheet: a workbook object must not be used from several threads
+        sheet = CalamineWorkbook.from_filelike(io.BytesIO(data)).get_sheet_by_name(name)
+        if sheet.height == 0:
+            # iter_rows() of an empty sheet panics in Rust, which is not an Exception
+            return iter(()), 0, lambda: None
+        return sheet.iter_rows(), sheet.height, lambda: None
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        worksheet = workbook[name]
+        return worksheet.iter_rows(values_only=True), worksheet.max_row, workbook.close
+    except Exception:
+        workbook.close()
+        raise
+
+
+def _column_names(header):
+    return [f"Unnamed: {i}" if name in (None, '') else str(name) for i, name in enumerate(header)]
+
+
+def _text(value):
+    # Numbers in a text column (e.g. ZIP codes typed as numbers) lose their trailing '.0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _frame(rows, columns, start, dtype):
+    df = pd.DataFrame(rows, columns=columns, index=pd.RangeIndex(start, start + len(rows)))
+    for col, kind in (dtype or {}).items():
+        if col in df.columns:
+            df[col] = df[col].map(lambda value: None if value is None else _text(value)).astype(kind)
+    return df
+
+
+def _iter_sheet_frames(rows, columns, chunk_size, dtype, usecols, start):
+    """Group the data rows of a sheet into DataFrames of `chunk_size` rows; yields (chunk, rows read)."""
+    width = len(columns)
+    keep = [col for col in columns if col in set(usecols)] if usecols is not None else None
+    batch, read = [], 0
+    for row in rows:
+        read += 1
+        # calamine reports empty cells as '', openpyxl as None; rows with no values are skipped
+        row = tuple(None if value == '' else value for value in row[:width])
+        if all(value is None for value in row):
+            continue
+        batch.append(row + (None,) * (width - len(row)))
+        if len(batch) == chunk_size:
+            chunk = _frame(batch, columns, start, dtype)
+            start += len(batch)
+            batch = []
+            yield (chunk[keep] if keep is not None else chunk), read
+    if batch:
+        chunk = _frame(batch, columns, start, dtype)
+        yield (chunk[keep] if keep is not None else chunk), read
+
+
+def iter_read_excel(source, chunk_size, engine=None, sheets=None, dtype=None, usecols=None, read_ahead=None):
+    """
+    Read an .xlsx workbook in chunks of rows.
+
+    Only the first sheet is read by default, like pandas does. With sheets='all', workbooks
+    split across sheets (e.g. vendor exports past Excel's row limit) are read as one table:
+    every sheet with the same columns as the first one is appended, empty sheets and sheets
+    with other columns are skipped. With the calamine engine the next `read_ahead` sheets are loaded in the background
+    while the rows of the current one are handed out, so at most that many sheets besides the
+    current one are held in memory; with openpyxl the sheets are streamed in turn.
+
+    Args:
+        source (str or file-like object): The file path or a binary stream.
+        chunk_size (int): Rows per chunk.
+        engine (str, optional): 'calamine' or 'openpyxl'; defaults to the EXCEL_ENGINE setting.
+        sheets (list or str, optional): Names of the sheets to read, or 'all' for every sheet;
+                                        defaults to the first sheet.
+        dtype (dict, optional): Text columns, e.g. {'MOBILE_PHONE': 'string'}; numbers in them
+                                are read as text, without a trailing '.0'.
+        usecols (list, optional): Columns to keep; columns the workbook does not have are ignored.
+        read_ahead (int, optional): Sheets loaded ahead of the current one; defaults to EXCEL_SHEET_READ_AHEAD.
+
+    Yields:
+        tuple: The chunk DataFrame and the fraction of the workbook read so far.
+
+    Raises:
+        ValueError: If no Excel reader is installed or the engine is unknown.
+    """
+    engine = _engine(engine)
+    data = _read_bytes(source)
+    if sheets is None or sheets == 'all':
+        names = _sheet_names(data, engine)[:None if sheets == 'all' else 1]
+    else:
+        names = list(sheets)
+    if not names:
+        return
+
+    read_ahead = (default_read_ahead if read_ahead is None else max(read_ahead, 0)) if engine == 'calamine' else 0
+    upcoming = iter(enumerate(names))
+    pending = deque()
+    columns, start = None, 0
+    with ThreadPoolExecutor(max_workers=read_ahead + 1) as executor:
+        def submit(count):
+            for number, name in itertools.islice(upcoming, count):
+                pending.append((number, name, executor.submit(_load_sheet, data, engine, name)))
+
+        try:
+            submit(read_ahead + 1)
+            while pending:
+                number, name, future = pending.popleft()
+                rows, height, close = future.result()
+                try:
+                    header = next(rows, None)
+                    if header is not None and columns is None:
+                        columns = _column_names(header)
+                    # Empty and mismatched sheets are skipped without leaving the loop, so the next
+                    # sheet is still queued below
+                    if header is not None and _column_names(header) != columns:
+                        logging.warning(f"Skipping sheet '{name}': its columns differ from the first sheet's.")
+                    elif header is not None:
+                        for chunk, read in _iter_sheet_frames(rows, columns, chunk_size, dtype, usecols, start):
+                            start += len(chunk)
+                            progress = min(read / height, 1.0) if height else 0.0
+                            yield chunk, (number + progress) / len(names)
+                finally:
+                    close()
+                # The next sheet starts loading once this one is released, so the window stays bounded
+                submit(1)
+        finally:
+            # Sheets loaded ahead but never read (reading stopped or failed) are released too
+            for _, _, future in pending:
+                if not future.cancel() and future.exception() is None:
+                    future.result()[2]()
+
+
+def read_excel(source, engine=None, sheets=None, dtype=None, usecols=None, chunk_size=100000):
+    """
+    Read an .xlsx workbook into a DataFrame; the sheets and arguments are as for `iter_read_excel`.
+
+    Returns:
+        pd.DataFrame: The data.
+    """
+    chunks = [chunk for chunk, _ in iter_read_excel(source, chunk_size, engine=engine, sheets=sheets,
+                                                     dtype=dtype, usecols=usecols)]
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks)
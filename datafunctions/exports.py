@@ -0,0 +1,143 @@
+import os
+import re
+import zlib
+
+try:
+    import xlsxwriter
+except ImportError:  # Excel export is optional; CSV is always available
+    xlsxwriter = None
+
+
+export_compressions = ('gzip',)
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Excel sheets hold 1,048,576 rows, one of which is the header
+xlsx_max_rows = 1048575
+
+# Columns written as text cells, so Excel keeps phone formatting and the leading zeros of ZIP codes
+text_column_pattern = re.compile(r'phone|zip|postal', re.IGNORECASE)
+
+
+##========= Streaming CSV export ================================================
+def iter_csv_chunks(df, chunk_rows=50000, compression=None):
+    """
+    Render a DataFrame as CSV in chunks of rows, so a response can start sending the
+    first rows right away and only one chunk is ever held in memory as text.
+
+    Args:
+        df (pd.DataFrame): The dataset to export.
+        chunk_rows (int): Number of rows rendered per chunk.
+        compression (str, optional): 'gzip' to compress the stream on the fly.
+
+    Yields:
+        bytes: Consecutive parts of the (compressed) CSV file.
+
+    Raises:
+        ValueError: If the compression is not supported.
+    """
+    if compression not in (None,) + export_compressions:
+        raise ValueError(f"Unsupported compression '{compression}'")
+
+    def chunks():
+        # The header is written with the first chunk, or alone for an empty dataset
+        yield df.iloc[:0].to_csv(index=False).encode('utf-8')
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=False).encode('utf-8')
+
+    if compression is None:
+        yield from chunks()
+        return
+
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip container
+    for chunk in chunks():
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_filename(name, extension, compression=None):
+    """File name of an export, e.g. 'processed_data.csv.gz'."""
+    return f"{name}.{extension}" + ('.gz' if compression == 'gzip' else '')
+
+
+def iter_file_chunks(path, chunk_size=1024 * 1024, remove=False):
+    """Read a file in chunks, optionally removing it once it has been read (or reading stopped)."""
+    try:
+        with open(path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+    finally:
+        if remove:
+            os.remove(path)
+
+
+##========= Constant-memory Excel export ========================================
+def xlsx_available():
+    """Whether xlsxwriter is installed, so datasets can be exported as Excel workbooks."""
+    return xlsxwriter is not None
+
+
+def _text(value):
+    # Numbers read into a text column (e.g. ZIP codes parsed as floats) lose their trailing '.0'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def write_xlsx(df, path, sheet_name='Data', max_rows_per_sheet=xlsx_max_rows, chunk_rows=50000):
+    """
+    Write a DataFrame to an .xlsx file in xlsxwriter's constant-memory mode.
+
+    Rows are flushed to disk as they are written, so memory use does not grow with the
+    number of rows. Phone and ZIP columns are written as text cells. Datasets with more
+    rows than a sheet can hold continue on further sheets ('Data', 'Data (2)', ...).
+
+    Args:
+        df (pd.DataFrame): The dataset to export.
+        path (str): The file to write.
+        sheet_name (str): Name of the first sheet.
+        max_rows_per_sheet (int): Data rows per sheet, below the header.
+        chunk_rows (int): Number of rows converted to Python values at a time.
+
+    Raises:
+        RuntimeError: If xlsxwriter is not installed.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("Excel export requires the xlsxwriter package")
+
+    columns = [str(col) for col in df.columns]
+    text_columns = [bool(text_column_pattern.search(col)) for col in columns]
+    # Cell text is data: never turn it into formulas or hyperlinks
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True,
+                                          'strings_to_formulas': False, 'strings_to_urls': False})
+    try:
+        header_format = workbook.add_format({'bold': True})
+        text_format = workbook.add_format({'num_format': '@'})
+
+        def add_sheet(number):
+            sheet = workbook.add_worksheet(sheet_name if number == 1 else f"{sheet_name} ({number})")
+            for col, is_text in enumerate(text_columns):
+                if is_text:
+                    sheet.set_column(col, col, 16, text_format)
+            sheet.write_row(0, 0, columns, header_format)
+            return sheet
+
+        sheet, sheet_number, row = add_sheet(1), 1, 0
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            for values in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                if row == max_rows_per_sheet:
+                    sheet_number += 1
+                    sheet, row = add_sheet(sheet_number), 0
+                row += 1
+                for col, value in enumerate(values):
+                    if value is None:
+                        continue  # Missing values stay empty cells
+                    if text_columns[col]:
+                        sheet.write_string(row, col, _text(value), text_format)
+                    else:
+                        sheet.write(row, col, value)
+    finally:
+        workbook.close()
@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+filter_operators = ('in', 'prefix', 'range')
+
+# Above this many matching values, a vectorized membership test beats slicing the row lists
+_max_sliced_values = 64
+
+
+##========= Lazily built per-column indexes ====================================
+class ColumnIndex:
+    """
+    Hash index of one column: the distinct values (as text, sorted) and, for every value,
+    the positions of the rows holding it.
+
+    Values are compared as text, like the single-column filter. Because the distinct values
+    are sorted, prefix and text range predicates match a contiguous block of them; numeric
+    ranges use a second ordering of the values that parse as numbers.
+
+    Args:
+        column (pd.Series): The column to index.
+    """
+
+    def __init__(self, column):
+        codes, uniques = pd.factorize(column.astype('string'), sort=True)
+        self.n_rows = len(codes)
+        self.codes = codes
+        self.uniques = np.asarray(uniques, dtype=object)
+        self.lookup = {value: code for code, value in enumerate(self.uniques)}
+
+        # Row positions grouped by value: rows[offsets[c]:offsets[c + 1]] hold value c
+        valid = np.flatnonzero(codes >= 0)
+        self.rows = valid[np.argsort(codes[valid], kind='stable')]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[valid], minlength=len(self.uniques)))])
+
+        numbers = pd.to_numeric(pd.Series(self.uniques, dtype=object), errors='coerce').to_numpy(dtype=float)
+        numeric = np.flatnonzero(~np.isnan(numbers))
+        order = np.argsort(numbers[numeric], kind='stable')
+        self.numeric_codes = numeric[order]
+        self.sorted_numbers = numbers[numeric][order]
+
+    def mask_for_codes(self, codes):
+        """Row bitmap of the rows holding any of the given value codes."""
+        if len(codes) > _max_sliced_values:
+            return np.isin(self.codes, codes)
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for code in codes:
+            mask[self.rows[self.offsets[code]:self.offsets[code + 1]]] = True
+        return mask
+
+    def mask_for_code_range(self, start, stop):
+        """Row bitmap of the rows holding the value codes start to stop - 1."""
+        mask = np.zeros(self.n_rows, dtype=bool)
+        mask[self.rows[self.offsets[start]:self.offsets[stop]]] = True
+        return mask
+
+    def match_values(self, values):
+        codes = [self.lookup[str(v)] for v in values if str(v) in self.lookup]
+        return self.mask_for_codes(codes)
+
+    def match_prefix(self, prefixes):
+        mask = np.zeros(self.n_rows, dtype=bool)
+        for prefix in prefixes:
+            prefix = str(prefix)
+            start = np.searchsorted(self.uniques, prefix, side='left')
+            stop = np.searchsorted(self.uniques, prefix + '\U0010ffff', side='left')
+            mask |= self.mask_for_code_range(start, stop)
+        return mask
+
+    def match_range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """
+        Rows with low <= value <= high (or strict bounds), numerically if the bounds are numbers,
+        else as text. A missing bound leaves that side open.
+        """
+        low = None if low in (None, '') else low
+        high = None if high in (None, '') else high
+        try:
+            low_number = None if low is None else float(low)
+            high_number = None if high is None else float(high)
+        except (TypeError, ValueError):
+            values, codes = self.uniques, None
+            low, high = (None if low is None else str(low)), (None if high is None else str(high))
+        else:
+            values, codes = self.sorted_numbers, self.numeric_codes
+            low, high = low_number, high_number
+        start = 0 if low is None else np.searchsorted(values, low, side='left' if low_inclusive else 'right')
+        stop = len(values) if high is None else np.searchsorted(values, high, side='right' if high_inclusive else 'left')
+        stop = max(start, stop)
+        if codes is None:
+            return self.mask_for_code_range(start, stop)
+        return self.mask_for_codes(codes[start:stop])
+
+
+##========= Filter engine reusing indexes per dataset version =================
+class FilterEngine:
+    """
+    Evaluate filter conditions on dataset versions through lazily built column indexes.
+
+    The index of a column is built the first time a condition uses it and kept for that
+    dataset version, so repeated filters on the same version only look up values in the
+    indexes. Versions never change, so the indexes never need updating.
+
+    A condition is a dict:
+        {"column": "Tag", "op": "in", "values": ["reader", "advertiser"]}
+        {"column": "Personal City", "op": "prefix", "values": ["San"]}
+        {"column": "Personal Zip", "op": "range", "min": 10000, "max": 19999}
+
+    Args:
+        max_datasets (int): Number of dataset versions whose indexes are kept.
+    """
+
+    def __init__(self, max_datasets=16):
+        self.max_datasets = max_datasets
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self, dataset_id, df, column):
+        """Return the index of a column of a dataset version, building it if needed."""
+        with self._lock:
+            indexes = self._indexes.setdefault(dataset_id, {})
+            self._indexes.move_to_end(dataset_id)
+            while len(self._indexes) > self.max_datasets:
+                self._indexes.popitem(last=False)
+            index = indexes.get(column)
+        if index is None:
+            index = ColumnIndex(df[column])
+            with self._lock:
+                indexes[column] = index
+        return index
+
+    def condition_mask(self, dataset_id, df, condition):
+        column = condition.get('column')
+        if column not in df.columns:
+            raise ValueError(f"Column '{column}' does not exist in the data.")
+        op = condition.get('op', 'in')
+        if op not in filter_operators:
+            raise ValueError(f"Unsupported filter operator '{op}'")
+        index = self.index(dataset_id, df, column)
+        if op == 'range':
+            return index.match_range(condition.get('min'), condition.get('max'))
+        values = condition.get('values') or []
+        if isinstance(values, str):
+            values = [values]
+        return index.match_values(values) if op == 'in' else index.match_prefix(values)
+
+    def mask(self, dataset_id, df, conditions, combine='and'):
+        """
+        Combine the row bitmaps of several conditions with AND or OR.
+
+        Returns:
+            np.ndarray: Boolean array with one entry per row.
+
+        Raises:
+            ValueError: If a condition uses an unknown column or operator.
+        """
+        if combine not in ('and', 'or'):
+            raise ValueError(f"Unsupported combination '{combine}', use 'and' or 'or'")
+        if not conditions:
+            raise ValueError("Please provide at least one filter condition.")
+        masks = [self.condition_mask(dataset_id, df, condition) for condition in conditions]
+        return np.logical_and.reduce(masks) if combine == 'and' else np.logical_or.reduce(masks)
+
+    def filter(self, dataset_id, df, conditions, combine='and'):
+        """Return the rows of a dataset version matching the conditions."""
+        return df[self.mask(dataset_id, df, conditions, combine)]
@@ -0,0 +1,198 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is logged as a field
+_standard_attributes = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Contact fields and text patterns that must never reach the log files
+default_redacted_fields = {
+    'email', 'phone', 'firstName', 'lastName', 'address1', 'postalCode',
+    'BUSINESS_EMAIL', 'PERSONAL_EMAIL', 'MOBILE_PHONE', 'FIRST_NAME', 'LAST_NAME', 'PERSONAL_ADDRESS',
+    'Authorization',
+}
+email_pattern = re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+')
+long_number_pattern = re.compile(r'\+?\d[\d\s-]{8,}\d')
+
+
+##========= Structured JSON-lines formatting with redaction ====================
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line.
+
+    Fields passed with `extra=` are included as top-level keys. Values of sensitive fields
+    (contact names, emails, phones, addresses, credentials) are replaced with "[REDACTED]",
+    and email addresses and phone numbers are masked in the message text.
+
+    Args:
+        redacted_fields (set, optional): Field names whose values are redacted.
+    """
+
+    def __init__(self, redacted_fields=None):
+        super().__init__()
+        self.redacted_fields = default_redacted_fields if redacted_fields is None else set(redacted_fields)
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {k: '[REDACTED]' if k in self.redacted_fields else self.redact(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.redact(v) for v in value]
+        if isinstance(value, str):
+            return long_number_pattern.sub('[PHONE]', email_pattern.sub('[EMAIL]', value))
+        return value
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': self.redact(record.getMessage()),
+        }
+        for key, value in vars(record).items():
+            if key not in _standard_attributes and not key.startswith('_'):
+                entry[key] = '[REDACTED]' if key in self.redacted_fields else self.redact(value)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+##========= Sampling of high-volume per-contact records ========================
+class SamplingFilter(logging.Filter):
+    """
+    Let through only every n-th record below WARNING; warnings and errors always pass.
+
+    Args:
+        sample_rate (float): Fraction of records kept, between 0 and 1.
+    """
+
+    def __init__(self, sample_rate):
+        super().__init__()
+        self.every = max(int(round(1 / sample_rate)), 1) if sample_rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        return self.every > 0 and next(self._counter) % self.every == 0
+
+
+##========= Non-blocking queue handler ==========================================
+class AsyncQueueHandler(QueueHandler):
+    """
+    Hand log records to a background thread that writes them to the target handlers.
+
+    Logging calls only put the record on a bounded in-memory queue, so they never wait for
+    disk or console I/O. When the queue is full the record is dropped and counted in
+    `dropped` rather than blocking the caller. The writer thread is started lazily in each
+    process, so the handler keeps working in forked server workers.
+
+    Args:
+        handlers (list or callable): The handlers that actually write the records, or a function
+                                     returning them, called once in every process that logs.
+        queue_size (int): Maximum number of records waiting to be written.
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.targets = handlers
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # A forked child inherits the queue but not the writer thread, so start over
+                self.queue = queue.Queue(self.queue.maxsize)
+                targets = self.targets() if callable(self.targets) else self.targets
+                self._listener = QueueListener(self.queue, *targets, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Flush the queued records and stop the writer thread."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+def _file_handler(log_file_path):
+    backup_count = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    rotate_when = os.getenv('LOG_ROTATE_WHEN')
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(log_file_path, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = RotatingFileHandler(
+            log_file_path, maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            backupCount=backup_count, encoding='utf-8',
+        )
+    file_handler.setFormatter(JsonLinesFormatter())
+    return file_handler
+
+
+def configure_logging(log_file_path, level=logging.INFO):
+    """
+    Configure asynchronous logging to the console and a rotating JSON-lines log file.
+
+    Rotating handlers rename the file they write to, which is only safe with a single writer.
+    With several worker processes, each one therefore writes its own file, named after its
+    process ID (e.g. process_logs.12345.log).
+
+    Settings are read from the environment:
+        LOG_MAX_BYTES            Rotate the log file when it reaches this size (default: 10 MB)
+        LOG_BACKUP_COUNT         Number of rotated files kept (default: 5)
+        LOG_ROTATE_WHEN          Rotate on time instead of size, e.g. 'midnight' or 'H'
+        LOG_FILE_PER_PROCESS     Write one log file per process (set by serve.py for several workers)
+        LOG_CONTACT_SAMPLE_RATE  Fraction of per-contact records kept (default: 0.01)
+        LOG_QUEUE_SIZE           Maximum number of records waiting to be written (default: 10000)
+
+    Args:
+        log_file_path (str): Path of the log file.
+        level (int): The root logging level.
+
+    Returns:
+        AsyncQueueHandler: The handler installed on the root logger.
+    """
+    per_process = os.getenv('LOG_FILE_PER_PROCESS', '').lower() in ('1', 'true', 'yes')
+
+    def make_handlers():
+        # Called in every process that logs, so forked workers open their own file
+        path = log_file_path
+        if per_process:
+            base, extension = os.path.splitext(log_file_path)
+            path = f"{base}.{os.getpid()}{extension}"
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s'))
+        return [_file_handler(path), console_handler]
+
+    queue_handler = AsyncQueueHandler(make_handlers, queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [queue_handler]
+
+    # Per-contact records are sampled before they are even queued
+    contact_logger = logging.getLogger('crm.contacts')
+    contact_logger.filters = [SamplingFilter(float(os.getenv('LOG_CONTACT_SAMPLE_RATE', 0.01)))]
+
+    atexit.register(queue_handler.close)
+    return queue_handler
@@ -0,0 +1,179 @@
+import itertools
+import json
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from datafunctions.columnar import write_columnar
+from datafunctions.exports import iter_csv_chunks, write_xlsx
+
+
+partition_formats = ('csv', 'csv.gz', 'xlsx', 'parquet', 'feather')
+
+
+class PartitionError(ValueError):
+    """Raised when a partition definition is invalid."""
+
+
+##========= Partition planning =================================================
+# A partition selects rows and optionally fans them out into several files:
+#   {"name": "sms", "tag": "sms", "columns": ["Contact ID", "Mobile Phone"]}
+#   {"name": "marketers", "column": "Personal City", "values": ["Austin", "Denver"]}
+#   {"name": "simplifi", "segment": "NOT email", "split_by": "Personal State", "max_rows": 50000}
+# Without "tag", "column" or "segment" a partition holds every row.
+
+def _file_part(value):
+    text = re.sub(r'[^\w-]+', '_', str(value)).strip('_')
+    return text or 'blank'
+
+
+def partition_mask(dataset_id, df, partition, segment_engine):
+    """
+    Row bitmap of a partition, read from the tag index, the column indexes or a segment query,
+    so selecting the rows of many partitions never scans the data once per partition.
+
+    Returns:
+        np.ndarray: Boolean array with one entry per row, or None for all rows.
+    """
+    if partition.get('segment'):
+        return segment_engine.mask(dataset_id, df, partition['segment'])
+    if partition.get('tag'):
+        tag_index = segment_engine.tag_indexes.get(dataset_id, df, segment_engine.tag_column)
+        bitmap = tag_index.bitmaps.get(partition['tag'])
+        return bitmap if bitmap is not None else np.zeros(len(df), dtype=bool)
+    if partition.get('column'):
+        condition = {"column": partition['column'], "op": "in", "values": partition.get('values') or []}
+        return segment_engine.filter_engine.condition_mask(dataset_id, df, condition)
+    return None
+
+
+def _split_by_value(df, rows, column):
+    """Group row positions by the value of a column with one factorize pass: [(value, rows)]."""
+    codes, uniques = pd.factorize(df[column].iloc[rows])
+    order = np.argsort(codes, kind='stable')
+    groups = np.split(rows[order], np.cumsum(np.bincount(codes[order] + 1, minlength=len(uniques) + 1))[:-1])
+    # Group 0 holds the missing values (code -1)
+    return [(value, group) for value, group in zip([None] + list(uniques), groups) if len(group)]
+
+
+def plan_partitions(dataset_id, df, partitions, segment_engine, max_rows=None):
+    """
+    Work out the files of a partitioned export: the row positions and columns of every file.
+
+    Args:
+        dataset_id (str): ID of the dataset version, for the index caches.
+        df (pd.DataFrame): The dataset to export.
+        partitions (list): Partition definitions (see above).
+        segment_engine (SegmentEngine): Provides tag, column and segment bitmaps.
+        max_rows (int, optional): Default maximum number of rows per file.
+
+    Returns:
+        list: One dict per file with "file", "partition", "value", "part", "rows" and "columns".
+
+    Raises:
+        PartitionError: If a partition is invalid.
+    """
+    if not partitions:
+        raise PartitionError("Please provide at least one partition.")
+    names = [partition.get('name') for partition in partitions if isinstance(partition, dict)]
+    if len(names) != len(partitions) or not all(names):
+        raise PartitionError("Every partition needs a name.")
+    if len(set(names)) != len(names):
+        raise PartitionError("Partition names must be unique.")
+
+    files = []
+    used_stems = set()
+    for partition in partitions:
+        name = _file_part(partition['name'])
+        columns = partition.get('columns') or list(df.columns)
+        missing_columns = [col for col in columns if col not in df.columns]
+        split_by = partition.get('split_by')
+        if split_by and split_by not in df.columns:
+            missing_columns.append(split_by)
+        if missing_columns:
+            raise PartitionError(f"Partition '{partition['name']}': columns not found: {', '.join(map(str, missing_columns))}")
+        part_rows = partition.get('max_rows') or max_rows
+        if part_rows is not None and (not isinstance(part_rows, int) or part_rows < 1):
+            raise PartitionError(f"Partition '{partition['name']}': max_rows must be a positive integer.")
+
+        mask = partition_mask(dataset_id, df, partition, segment_engine)
+        rows = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
+        groups = _split_by_value(df, rows, split_by) if split_by else [(None, rows)]
+        for value, group in groups:
+            stem = name if not split_by else f"{name}_{_file_part(value)}"
+            if stem in used_stems:
+                # Values that only differ in punctuation ('St. Louis', 'St Louis') get numbered files
+                stem = next(f"{stem}_{n}" for n in itertools.count(2) if f"{stem}_{n}" not in used_stems)
+            used_stems.add(stem)
+            chunks = [group] if not part_rows else [group[i:i + part_rows] for i in range(0, max(len(group), 1), part_rows)]
+            for part, chunk in enumerate(chunks, start=1):
+                files.append({
+                    "file": stem if len(chunks) == 1 else f"{stem}_part{part}",
+                    "partition": partition['name'],
+                    "value": None if value is None else str(value),
+                    "part": part,
+                    "rows": chunk,
+                    "columns": columns,
+                })
+    return files
+
+
+##========= Parallel writing ====================================================
+def _write_file(df, file, path, file_format):
+    part_df = df.iloc[file["rows"]][file["columns"]]
+    if file_format == 'xlsx':
+        write_xlsx(part_df, path)
+        return
+    if file_format in ('parquet', 'feather'):
+        write_columnar(part_df, path, file_format)
+        return
+    with open(path, 'wb') as f:
+        for chunk in iter_csv_chunks(part_df, compression='gzip' if file_format == 'csv.gz' else None):
+            f.write(chunk)
+
+
+def write_partitions(df, files, directory, file_format='csv', max_workers=4):
+    """
+    Write the planned files of a partitioned export in parallel, plus a manifest.json with
+    the row count of every file.
+
+    Args:
+        df (pd.DataFrame): The dataset to export.
+        files (list): The files returned by `plan_partitions`.
+        directory (str): The directory to write to.
+        file_format (str): 'csv', 'csv.gz', 'xlsx', 'parquet' or 'feather'.
+        max_workers (int): Number of files written at the same time.
+
+    Returns:
+        dict: The manifest.
+    """
+    if file_format not in partition_formats:
+        raise PartitionError(f"Unsupported format '{file_format}', use one of: {', '.join(partition_formats)}")
+
+    paths = [os.path.join(directory, f"{file['file']}.{file_format}") for file in files]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises the first error of any file
+        list(executor.map(lambda args: _write_file(df, *args, file_format), zip(files, paths)))
+
+    manifest = {
+        "total_rows": len(df),
+        "format": file_format,
+        "files": [{"file": os.path.basename(path), "partition": file["partition"], "value": file["value"],
+                   "part": file["part"], "rows": len(file["rows"])} for file, path in zip(files, paths)],
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def zip_directory(directory, path):
+    """Bundle the files of a directory into a zip archive."""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name in sorted(os.listdir(directory)):
+            # Already compressed files are stored as they are
+            compress_type = zipfile.ZIP_STORED if name.endswith(('.gz', '.xlsx', '.parquet', '.feather')) else zipfile.ZIP_DEFLATED
+            archive.write(os.path.join(directory, name), name, compress_type=compress_type)
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from datafunctions.data_processing import format_and_apply_title_case, preserve_phone_format
+
+
+# Columns the cleaning stages read, and the columns of the cleaned output
+CLEANING_REQUIRED_COLUMNS = ['MOBILE_PHONE', 'PERSONAL_ADDRESS', 'BUSINESS_EMAIL', 'PERSONAL_EMAIL', 'DNC']
+CRM_REQUIRED_COLUMNS = CLEANING_REQUIRED_COLUMNS + [
+    'FIRST_NAME', 'LAST_NAME', 'PERSONAL_CITY', 'PERSONAL_STATE', 'PERSONAL_ZIP'
+]
+CLEANED_COLUMNS = [
+    'FIRST_NAME', 'LAST_NAME', 'BUSINESS_EMAIL', 'MOBILE_PHONE',
+    'PERSONAL_ADDRESS', 'PERSONAL_CITY', 'PERSONAL_STATE', 'PERSONAL_ZIP',
+    'PERSONAL_EMAIL', 'Tag'
+]
+
+# Columns parsed as text, so ZIP codes keep their leading zeros and phones never become floats
+TEXT_COLUMNS = {'MOBILE_PHONE': 'string', 'PERSONAL_ZIP': 'string'}
+
+# Patterns compiled once at import, so preforked server workers share them
+po_box_pattern = re.compile(r'\b[Pp]\.? *[Oo]\.? *Box\b')
+phone_pattern = re.compile(r'\+?\d[\d\s-]*\d')
+
+
+class PipelineError(ValueError):
+    """Raised when a dataset cannot be processed by a pipeline stage."""
+
+
+def audience_tag(file_name):
+    """Return the audience tag implied by the file name ('advertiser' for B2B, 'reader' for B2C)."""
+    if 'B2B' in file_name.upper():
+        return 'advertiser'
+    elif 'B2C' in file_name.upper():
+        return 'reader'
+    return ''
+
+
+##========= Cleaning stages =====================================================
+# Every stage takes a DataFrame and returns a new one; stage inputs are never modified,
+# because they may be shared with the stage cache.
+
+def ingest(df, required_columns):
+    """
+    Check that the required columns are present and keep only the columns used downstream.
+    """
+    if df is None or df.empty:
+        raise PipelineError("No data to process.")
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise PipelineError(f"Missing required columns: {', '.join(missing_columns)}")
+    keep = list(dict.fromkeys(required_columns + [col for col in CLEANED_COLUMNS if col in df.columns]))
+    return df[keep].copy()
+
+
+def check_addresses(df):
+    """
+    Blank out P.O. Box and placeholder ('-') addresses along with their state and ZIP.
+    """
+    df = df.copy()
+    address = df['PERSONAL_ADDRESS'].astype('string')
+    invalid = (address.str.contains(po_box_pattern, na=False)
+               | address.str.contains('-', regex=False, na=False))
+    for col in ['PERSONAL_ADDRESS', 'PERSONAL_STATE', 'PERSONAL_ZIP']:
+        if col in df.columns:
+            df[col] = df[col].mask(invalid.to_numpy())
+    return df
+
+
+def normalize_phones(df):
+    """
+    Reduce mobile phones to 10 digits, dropping a leading US country code.
+
+    Numbers on the do-not-call list and numbers with fewer than 10 digits are removed.
+    Placeholder values ('-') are left for the tag stage to blank out.
+    """
+    df = df.copy()
+    phone = df['MOBILE_PHONE'].astype('string')
+    dnc = (df['DNC'] == 'Y').to_numpy(dtype=bool)
+    candidate = (phone.notna() & (phone != '-')).fillna(False).to_numpy(dtype=bool) & ~dnc
+
+    digits = phone.str.extract(f'({phone_pattern.pattern})', expand=False).str.replace(r'[^\d]', '', regex=True)
+    lengths = digits.str.len()
+    valid = (lengths >= 10).fillna(False).to_numpy(dtype=bool)
+    has_country_code = ((lengths == 11) & digits.str.startswith('1')).fillna(False)
+    digits = digits.mask(has_country_code, digits.str[1:]).str[:10]
+
+    result = phone.astype(object).to_numpy(copy=True)
+    result[dnc | (candidate & ~valid)] = np.nan
+    result[candidate & valid] = digits.to_numpy(dtype=object)[candidate & valid]
+    df['MOBILE_PHONE'] = result
+    return df
+
+
+def tag_contacts(df, file_tag=''):
+    """
+    Build the 'Tag' column and keep the cleaned output columns.
+
+    Tags, in order: the audience tag from the file name, 'programmatic' for a usable address,
+    'email' and 'social' for business and personal emails, and 'sms' for a valid mobile phone.
+    """
+    def present(column):
+        if column not in df.columns:
+            return np.zeros(len(df), dtype=bool)
+        return (df[column].notna() & (df[column] != '-')).to_numpy(dtype=bool)
+
+    phone = df['MOBILE_PHONE'].astype('string')
+    flags = [
+        ('programmatic', df['PERSONAL_ADDRESS'].notna().to_numpy(dtype=bool)),
+        ('email', present('BUSINESS_EMAIL')),
+        ('social', present('PERSONAL_EMAIL')),
+        ('sms', phone.str.fullmatch(r'\d{10}').fillna(False).to_numpy(dtype=bool)),
+    ]
+    tags = np.full(len(df), file_tag, dtype=object)
+    for tag, mask in flags:
+        tags[mask] = np.where(tags[mask] == '', tag, tags[mask] + ', ' + tag)
+
+    df = df.assign(Tag=tags)
+    df = df[[col for col in CLEANED_COLUMNS if col in df.columns]].replace('-', '')
+    df['MOBILE_PHONE'] = df['MOBILE_PHONE'].fillna("")
+    return df
+
+
+def title_case_columns(df):
+    """Format column names to title case ('MOBILE_PHONE' becomes 'Mobile Phone')."""
+    return format_and_apply_title_case(df.copy())
+
+
+def format_phones(df, column_name='Mobile Phone'):
+    """Format phone numbers as +1########## for Excel display."""
+    return preserve_phone_format(df.copy(), column_name=column_name)
+
+
+##========= Pipeline of named stages with memoized outputs ======================
+def fingerprint(df):
+    """
+    Compute a content fingerprint of a DataFrame (values, index, column names and dtypes).
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    A named pipeline step: a function of a DataFrame plus keyword parameters.
+
+    Args:
+        name (str): The stage name, used for parameter overrides and cache keys.
+        func (callable): Function taking the DataFrame and the parameters, returning a new DataFrame.
+        **params: Default parameters passed to the function.
+    """
+
+    def __init__(self, name, func, **params):
+        self.name = name
+        self.func = func
+        self.params = params
+
+
+class StageCache:
+    """
+    Thread-safe LRU cache of stage outputs, bounded by entry count and by memory.
+
+    Args:
+        max_entries (int): Maximum number of stage outputs kept.
+        max_bytes (int): Maximum memory used by the kept outputs; larger outputs are not cached.
+    """
+
+    def __init__(self, max_entries=24, max_bytes=256 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            df = self._entries.get(key)
+            if df is not None:
+                self._entries.move_to_end(key)
+            return df
+
+    def put(self, key, df):
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._sizes[key]
+            self._entries[key] = df
+            self._entries.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                evicted, _ = self._entries.popitem(last=False)
+                self._bytes -= self._sizes.pop(evicted)
+
+    def memory_usage(self):
+        """Memory used by the cached stage outputs, in bytes."""
+        with self._lock:
+            return self._bytes
+
+
+class Pipeline:
+    """
+    Run a sequence of named stages, memoizing every stage output.
+
+    The cache key of a stage is derived from the key of the stage before it, the stage name
+    and its parameters, starting from the fingerprint of the input. Re-running with a changed
+    parameter therefore reuses the cached outputs of all stages before the changed one and
+    only recomputes that stage and the ones after it.
+
+    Args:
+        stages (list): The Stage objects, in order.
+        cache (StageCache, optional): Cache for stage outputs; pass the same cache to several
+                                      pipelines to share their common stages.
+    """
+
+    def __init__(self, stages, cache=None):
+        self.stages = stages
+        self.cache = cache if cache is not None else StageCache()
+
+    def run(self, df, overrides=None, memoize=True):
+        """
+        Run the pipeline.
+
+        Args:
+            df (pd.DataFrame): The input dataset.
+            overrides (dict, optional): Parameter overrides per stage name,
+                                        e.g. {'tag': {'file_tag': 'reader'}}.
+            memoize (bool): Whether to use the stage cache. Disable it for one-off inputs
+                            such as the chunks of a streamed file.
+
+        Returns:
+            pd.DataFrame: The output of the last stage (a copy the caller may modify).
+
+        Raises:
+            PipelineError: If a stage rejects the data.
+        """
+        overrides = overrides or {}
+        unknown = set(overrides) - {stage.name for stage in self.stages}
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages: {', '.join(sorted(unknown))}")
+
+        if not memoize:
+            for stage in self.stages:
+                df = stage.func(df, **{**stage.params, **overrides.get(stage.name, {})})
+            return df
+
+        key = fingerprint(df) if df is not None else 'none'
+        for stage in self.stages:
+            params = {**stage.params, **overrides.get(stage.name, {})}
+            key = hashlib.sha256(json.dumps([key, stage.name, params], sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            cached = self.cache.get(key)
+            if cached is None:
+                df = stage.func(df, **params)
+                self.cache.put(key, df)
+            else:
+                df = cached
+        return df.copy()
+
+
+# One memory budget for the stage outputs of both pipelines. Their ingest stages keep different
+# columns, so the pipelines do not share entries; a re-run with changed parameters reuses its own
+stage_cache = StageCache(max_bytes=int(os.getenv("STAGE_CACHE_MAX_BYTES", 256 * 1024 ** 2)))
+
+crm_cleaning_pipeline = Pipeline([
+    Stage('ingest', ingest, required_columns=CRM_REQUIRED_COLUMNS),
+    Stage('address_check', check_addresses),
+    Stage('phone_normalize', normalize_phones),
+    Stage('tag', tag_contacts, file_tag=''),
+], cache=stage_cache)
+
+export_cleaning_pipeline = Pipeline([
+    Stage('ingest', ingest, required_columns=CLEANING_REQUIRED_COLUMNS),
+    Stage('address_check', check_addresses),
+    Stage('phone_normalize', normalize_phones),
+    Stage('tag', tag_contacts, file_tag=''),
+    Stage('title_case', title_case_columns),
+    Stage('phone_format', format_phones, column_name='Mobile Phone'),
+], cache=stage_cache)
@@ -0,0 +1,206 @@
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import pandas as pd
+
+from datafunctions.tag_index import TAG_SEPARATOR
+
+
+email_pattern = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+
+
+##========= Per-column statistics kept as value counts =========================
+class ColumnProfile:
+    """
+    Statistics of one column, kept as the count of every distinct value.
+
+    Null, distinct and top-k counts, validity rates and the tag distribution are all read
+    from the value counts, so a profile never has to go back to the rows once built, and
+    removing rows only means subtracting their value counts.
+
+    Args:
+        counts (pd.Series): Number of rows per non-missing value.
+        nulls (int): Number of missing values.
+    """
+
+    def __init__(self, counts, nulls):
+        self.counts = counts
+        self.nulls = nulls
+
+    @classmethod
+    def from_series(cls, values):
+        return cls(values.value_counts(dropna=True, sort=False), int(values.isna().sum()))
+
+    def without(self, removed):
+        """Profile of the column after the given values (a row subset) were removed."""
+        counts = self.counts.sub(removed.value_counts(dropna=True, sort=False), fill_value=0)
+        return ColumnProfile(counts[counts > 0].astype('int64'), self.nulls - int(removed.isna().sum()))
+
+    def _text_counts(self):
+        """Counts keyed by the values as stripped text, blanks excluded."""
+        text = pd.Series(self.counts.index, dtype=object).astype(str).str.strip()
+        counts = pd.Series(self.counts.to_numpy(), index=text.to_numpy())
+        return counts[counts.index != '']
+
+    def summary(self, n_rows, top_k=10):
+        text_counts = self._text_counts()
+        top = text_counts.groupby(level=0, sort=False).sum().nlargest(top_k)
+        return {
+            "nulls": n_rows - int(text_counts.sum()),  # Missing and blank values
+            "distinct": int(text_counts.index.nunique()),
+            "top": [{"value": value, "count": int(count)} for value, count in top.items()],
+        }
+
+    def valid_rate(self, kind):
+        """Share of the non-blank values that are valid phone numbers or email addresses."""
+        text_counts = self._text_counts()
+        total = int(text_counts.sum())
+        if not total:
+            return None
+        values = pd.Series(text_counts.index, dtype='string')
+        if kind == 'phone':
+            digits = values.str.replace(r'\D', '', regex=True)
+            valid = (digits.str.len() == 10) | ((digits.str.len() == 11) & digits.str.startswith('1'))
+        else:
+            valid = values.str.fullmatch(email_pattern.pattern)
+        return float(text_counts.to_numpy()[valid.fillna(False).to_numpy(dtype=bool)].sum() / total)
+
+    def tag_counts(self):
+        """Number of rows per tag of a tag column ('tag1, tag2' values)."""
+        tags = Counter()
+        for value, count in self._text_counts().items():
+            for tag in value.split(TAG_SEPARATOR):
+                if tag:
+                    tags[tag] += int(count)
+        return dict(tags.most_common())
+
+
+def validity_kind(column):
+    """'phone' or 'email' for columns whose name says they hold phone numbers or email addresses."""
+    name = str(column).lower()
+    if 'phone' in name:
+        return 'phone'
+    if 'email' in name:
+        return 'email'
+    return None
+
+
+class DatasetProfile:
+    """
+    Profile of a dataset version: one ColumnProfile per column.
+
+    Args:
+        columns (dict): ColumnProfile per column name.
+        n_rows (int): Number of rows of the dataset.
+    """
+
+    def __init__(self, columns, n_rows):
+        self.columns = columns
+        self.n_rows = n_rows
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls({name: ColumnProfile.from_series(df[name]) for name in df.columns}, len(df))
+
+    def derive(self, df, changed_columns, removed=None):
+        """
+        Profile of a dataset derived from the profiled one, reusing the statistics of every
+        column whose values did not change.
+
+        Args:
+            df (pd.DataFrame): The derived dataset.
+            changed_columns (list): Columns whose values changed; they are profiled again.
+            removed (pd.DataFrame, optional): The rows the derived dataset no longer has.
+        """
+        changed = set(changed_columns)
+        columns = {}
+        for name in df.columns:
+            if name in changed or name not in self.columns:
+                columns[name] = ColumnProfile.from_series(df[name])
+            elif removed is not None:
+                columns[name] = self.columns[name].without(removed[name])
+            else:
+                columns[name] = self.columns[name]
+        return DatasetProfile(columns, len(df))
+
+    def summary(self, top_k=10, tag_column='Tag'):
+        """
+        JSON-serializable statistics: per column the null (missing or blank), distinct and
+        top-k value counts; the valid share of phone and email columns; the rows per tag.
+        """
+        validity = {}
+        for name, profile in self.columns.items():
+            kind = validity_kind(name)
+            if kind:
+                validity[str(name)] = {"kind": kind, "valid_rate": profile.valid_rate(kind)}
+        return {
+            "rows": self.n_rows,
+            "columns": [dict(name=str(name), **profile.summary(self.n_rows, top_k)) for name, profile in self.columns.items()],
+            "validity": validity,
+            "tags": self.columns[tag_column].tag_counts() if tag_column in self.columns else {},
+        }
+
+
+##========= Cache of profiles per dataset version ==============================
+class ProfileCache:
+    """
+    Thread-safe LRU cache of dataset profiles per version, built lazily on first use.
+
+    When a version is derived from a profiled one, `derive` updates the parent's profile
+    instead of profiling the new version from scratch: columns an operation did not change
+    are reused, and when rows were filtered out only the removed rows are counted.
+
+    Args:
+        max_entries (int): Maximum number of profiles kept.
+    """
+
+    def __init__(self, max_entries=20):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, dataset_id):
+        with self._lock:
+            profile = self._entries.get(dataset_id)
+            if profile is not None:
+                self._entries.move_to_end(dataset_id)
+            return profile
+
+    def get(self, dataset_id, df):
+        """Return the profile of a dataset version, building it if needed."""
+        profile = self._cached(dataset_id)
+        if profile is None:
+            profile = DatasetProfile.from_frame(df)
+            self.put(dataset_id, profile)
+        return profile
+
+    def put(self, dataset_id, profile):
+        with self._lock:
+            self._entries[dataset_id] = profile
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def derive(self, dataset_id, df, parent_id, parent_df, changed_columns):
+        """
+        Profile a version derived from another one, if the parent's profile is cached;
+        otherwise the version is profiled when it is first asked for.
+
+        Args:
+            dataset_id (str): ID of the derived version.
+            df (pd.DataFrame): The derived version.
+            parent_id (str): ID of the version it was derived from.
+            parent_df (pd.DataFrame): That version.
+            changed_columns (list): Columns whose values changed. Rows of the parent may have
+                                    been removed, but the others must be unchanged.
+        """
+        parent = self._cached(parent_id)
+        if parent is None or changed_columns is None:
+            return
+        removed = None
+        if len(df) != len(parent_df):
+            # Counting the removed rows only pays off when fewer rows were removed than kept
+            if not parent_df.index.is_unique or len(parent_df) - len(df) > len(df):
+                return
+            removed = parent_df[~parent_df.index.isin(df.index)]
+        self.put(dataset_id, parent.derive(df, changed_columns, removed))
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+
+from datafunctions.columnar import columnar_available, read_columnar, write_columnar
+
+
+cached_extensions = ('.parquet', '.pkl')
+
+
+def hash_stream(stream, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hash of a binary stream, then rewind it so it can still be parsed.
+
+    Args:
+        stream (file-like object): A seekable binary stream.
+        chunk_size (int): Number of bytes hashed at a time.
+
+    Returns:
+        str: The hex digest of the stream content.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+##========= Disk-backed, single-flight cache of processing results =============
+class ResultCache:
+    """
+    Cache processed datasets on disk, keyed by input content and processing settings.
+
+    Concurrent requests for the same key are single-flight: the first one computes the
+    result while the others, in the same process or in other server workers sharing the
+    directory, wait for it instead of repeating the work. The total size of the cached
+    results is kept under `max_bytes` by evicting the least recently used ones.
+
+    DataFrames are stored as zstd-compressed Parquet when pyarrow is installed, which is
+    smaller and faster to read back than a pickle; other results are pickled.
+
+    Args:
+        directory (str): Directory holding the cached results and lock files.
+        max_bytes (int): Maximum total size of the cached results.
+        lock_timeout (float): Seconds after which a lock left by a crashed worker is ignored.
+    """
+
+    def __init__(self, directory, max_bytes=1024 ** 3, lock_timeout=600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """Build a cache key from e.g. the content hash, the operation and the pipeline version."""
+        return hashlib.sha256('\x00'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key, extension='.pkl'):
+        return os.path.join(self.directory, f"{key}{extension}")
+
+    def _load(self, key):
+        # DataFrames are cached as zstd-compressed Parquet, other results as pickles
+        for extension in cached_extensions:
+            path = self._path(key, extension)
+            try:
+                if extension == '.parquet':
+                    result = read_columnar(path, 'parquet')
+                else:
+                    with open(path, 'rb') as f:
+                        result = pickle.load(f)
+            except FileNotFoundError:
+                continue
+            os.utime(path)  # Mark as recently used for eviction
+            return result
+        return None
+
+    def _store(self, key, result):
+        columnar = isinstance(result, pd.DataFrame) and columnar_available()
+        path = self._path(key, '.parquet' if columnar else '.pkl')
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if columnar:
+            write_columnar(result, tmp_path, 'parquet')
+        else:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(cached_extensions):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _acquire_file_lock(self, key):
+        """Try to take the cross-process lock for a key. Returns False if another worker holds it."""
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > self.lock_timeout:
+                    os.remove(lock_path)  # Stale lock left by a crashed worker
+            except FileNotFoundError:
+                pass
+            return False
+
+    def _release_file_lock(self, key):
+        try:
+            os.remove(os.path.join(self.directory, f"{key}.lock"))
+        except FileNotFoundError:
+            pass
+
+    def get_or_compute(self, key, compute, poll_interval=0.2):
+        """
+        Return the cached result for a key, computing and caching it if needed.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Function without arguments returning the result. Exceptions are
+                                propagated and nothing is cached.
+            poll_interval (float): Seconds between checks while another worker computes the result.
+
+        Returns:
+            tuple: The result and whether it came from the cache.
+        """
+        result = self._load(key)
+        if result is not None:
+            return result, True
+
+        with self._key_locks_guard:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Only one thread per process computes or waits on the file lock for a given key
+        with key_lock:
+            try:
+                while True:
+                    result = self._load(key)
+                    if result is not None:
+                        return result, True
+                    if self._acquire_file_lock(key):
+                        break
+                    time.sleep(poll_interval)
+
+                try:
+                    result = compute()
+                    self._store(key, result)
+                finally:
+                    self._release_file_lock(key)
+                return result, False
+            finally:
+                with self._key_locks_guard:
+                    self._key_locks.pop(key, None)
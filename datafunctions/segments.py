@@ -0,0 +1,326 @@
+import functools
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SegmentError(ValueError):
+    """Raised when a segment query cannot be parsed or refers to unknown columns."""
+
+
+##========= Tokenizer and parser ================================================
+# Segment queries combine tags and column predicates, e.g.
+#   sms AND NOT email AND state IN (VA, PA)
+#   (reader OR advertiser) AND city STARTS WITH 'San' AND zip >= 20000
+# A bare word is a tag; quote tags or values containing spaces, and use backticks
+# for column names containing spaces (`Personal City`).
+
+token_pattern = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<ident>`[^`]+`)
+      | (?P<op>>=|<=|!=|=|>|<|\(|\)|,)
+      | (?P<word>[^\s()',"=<>!`]+)
+    )""", re.VERBOSE)
+
+keywords = {'AND', 'OR', 'NOT', 'IN', 'STARTS', 'WITH'}
+comparison_operators = {'=', '!=', '>', '>=', '<', '<='}
+
+
+def tokenize(query):
+    """Split a segment query into (kind, text) tokens; keywords are recognized case-insensitively."""
+    return _tokenize(query)[0]
+
+
+def _tokenize(query):
+    """Tokens of a segment query and the position in the query where each one starts."""
+    tokens = []
+    positions = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = token_pattern.match(query, position)
+        if not match or match.end() == position:
+            position += len(query[position:]) - len(query[position:].lstrip())
+            raise SegmentError(f"Unexpected character at position {position}: {query[position:position + 10]!r}")
+        position = match.end()
+        positions.append(match.start(match.lastgroup))
+        if match.group('string'):
+            text = match.group('string')
+            tokens.append(('value', re.sub(r'\\(.)', r'\1', text[1:-1])))
+        elif match.group('ident'):
+            tokens.append(('ident', match.group('ident')[1:-1]))
+        elif match.group('op'):
+            tokens.append(('op', match.group('op')))
+        elif match.group('word').upper() in keywords:
+            tokens.append(('keyword', match.group('word').upper()))
+        else:
+            tokens.append(('word', match.group('word')))
+    return tokens, positions
+
+
+class _Parser:
+    """
+    Recursive descent parser producing a tuple-based expression tree.
+
+    Args:
+        tokens (list): The (kind, text) tokens of the query.
+        positions (list): Position in the query of every token, for error messages.
+        end (int): Length of the query, the position reported for an unexpected end.
+    """
+
+    def __init__(self, tokens, positions, end):
+        self.tokens = tokens
+        self.positions = positions
+        self.end = end
+        self.position = 0
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def where(self, offset=0):
+        """Query position of a token relative to the current one (the last consumed: -1)."""
+        index = self.position + offset
+        return self.positions[index] if index < len(self.positions) else self.end
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise SegmentError(f"Unexpected end of query at position {self.end}")
+        self.position += 1
+        return token
+
+    def expect(self, kind, text=None):
+        token = self.next()
+        if token[0] != kind or (text is not None and token[1] != text):
+            raise SegmentError(f"Expected {text or kind} but found {token[1]!r} at position {self.where(-1)}")
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise SegmentError("The query is empty")
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise SegmentError(f"Unexpected {self.peek()[1]!r} at position {self.where()}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == ('keyword', 'OR'):
+            self.next()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', tuple(nodes))
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() == ('keyword', 'AND'):
+            self.next()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ('and', tuple(nodes))
+
+    def parse_not(self):
+        if self.peek() == ('keyword', 'NOT'):
+            self.next()
+            return ('not', self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, text = self.next()
+        if (kind, text) == ('op', '('):
+            node = self.parse_or()
+            self.expect('op', ')')
+            return node
+        if kind not in ('word', 'ident', 'value'):
+            raise SegmentError(f"Unexpected {text!r} at position {self.where(-1)}")
+
+        following = self.peek()
+        if kind != 'value' and following == ('keyword', 'IN'):
+            self.next()
+            return ('in', text, self.parse_value_list())
+        if kind != 'value' and following == ('keyword', 'STARTS'):
+            self.next()
+            self.expect('keyword', 'WITH')
+            return ('prefix', text, self.parse_value())
+        if kind != 'value' and following[0] == 'op' and following[1] in comparison_operators:
+            operator = self.next()[1]
+            value = self.parse_value()
+            if operator == '=':
+                return ('in', text, (value,))
+            if operator == '!=':
+                return ('not', ('in', text, (value,)))
+            return ('compare', text, operator, value)
+        if kind == 'ident':
+            raise SegmentError(f"Column `{text}` at position {self.where(-1)} must be followed by a condition")
+        return ('tag', text)
+
+    def parse_value(self):
+        kind, text = self.next()
+        if kind not in ('word', 'value'):
+            raise SegmentError(f"Expected a value but found {text!r} at position {self.where(-1)}")
+        return text
+
+    def parse_value_list(self):
+        self.expect('op', '(')
+        values = [self.parse_value()]
+        while self.peek() == ('op', ','):
+            self.next()
+            values.append(self.parse_value())
+        self.expect('op', ')')
+        return tuple(dict.fromkeys(values))
+
+
+def canonical(node):
+    """
+    Normalize an expression tree so equivalent subexpressions compare equal: nested AND/OR
+    are flattened, their operands deduplicated and sorted, and double negations removed.
+    """
+    kind = node[0]
+    if kind == 'not':
+        inner = canonical(node[1])
+        return inner[1] if inner[0] == 'not' else ('not', inner)
+    if kind in ('and', 'or'):
+        operands = []
+        for child in map(canonical, node[1]):
+            operands.extend(child[1] if child[0] == kind else [child])
+        operands = sorted(set(operands), key=repr)
+        return operands[0] if len(operands) == 1 else (kind, tuple(operands))
+    if kind == 'in':
+        return ('in', node[1], tuple(sorted(node[2])))
+    return node
+
+
+@functools.lru_cache(maxsize=256)
+def parse_segment(query):
+    """
+    Parse a segment query into a canonical expression tree of nested tuples:
+    ('tag', name), ('in', column, values), ('prefix', column, value),
+    ('compare', column, operator, value), ('not', node), ('and', nodes), ('or', nodes).
+
+    Raises:
+        SegmentError: If the query is invalid.
+    """
+    tokens, positions = _tokenize(query)
+    return canonical(_Parser(tokens, positions, len(query.rstrip())).parse())
+
+
+def resolve_column(name, columns):
+    """
+    Find the column a query refers to: an exact name, a name equal up to case, spaces and
+    underscores ('personal zip' for 'PERSONAL_ZIP'), or a unique suffix ('state' for 'Personal State').
+    """
+    if name in columns:
+        return name
+
+    def normalize(text):
+        return re.sub(r'[\W_]+', '', str(text)).lower()
+
+    key = normalize(name)
+    for candidates in ([c for c in columns if normalize(c) == key],
+                       [c for c in columns if normalize(c).endswith(key)]):
+        if len(candidates) == 1:
+            return candidates[0]
+        if len(candidates) > 1:
+            raise SegmentError(f"Column '{name}' is ambiguous: {', '.join(map(str, candidates))}")
+    raise SegmentError(f"Unknown column '{name}'")
+
+
+##========= Evaluation with per-version subexpression cache ====================
+class SegmentEngine:
+    """
+    Evaluate segment queries on dataset versions as vectorized boolean masks.
+
+    Tags are looked up in the tag index and column predicates in the column indexes of the
+    filter engine. The mask of every subexpression is cached per dataset version, so segments
+    sharing parts (e.g. "sms AND state IN (VA, PA)" and "sms AND NOT email") only evaluate
+    those parts once. Masks are one byte per row, so the cache is bounded by memory as well
+    as by count.
+
+    Args:
+        filter_engine (FilterEngine): Provides the column indexes.
+        tag_indexes (TagIndexCache): Provides the tag indexes.
+        tag_column (str): The name of the tag column.
+        max_masks (int): Number of cached subexpression masks, across all versions.
+        max_bytes (int): Memory used by the cached masks, across all versions.
+    """
+
+    def __init__(self, filter_engine, tag_indexes, tag_column='Tag', max_masks=256, max_bytes=64 * 1024 ** 2):
+        self.filter_engine = filter_engine
+        self.tag_indexes = tag_indexes
+        self.tag_column = tag_column
+        self.max_masks = max_masks
+        self.max_bytes = max_bytes
+        self._masks = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _cached(self, key):
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+            return mask
+
+    def _store(self, key, mask):
+        mask.setflags(write=False)
+        if mask.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._masks.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._masks[key] = mask
+            self._bytes += mask.nbytes
+            while len(self._masks) > self.max_masks or self._bytes > self.max_bytes:
+                _, evicted = self._masks.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _evaluate(self, dataset_id, df, node):
+        key = (dataset_id, node)
+        mask = self._cached(key)
+        if mask is not None:
+            return mask
+
+        kind = node[0]
+        if kind == 'tag':
+            tag_index = self.tag_indexes.get(dataset_id, df, self.tag_column)
+            bitmap = tag_index.bitmaps.get(node[1])
+            mask = bitmap.copy() if bitmap is not None else np.zeros(len(df), dtype=bool)
+        elif kind == 'not':
+            mask = ~self._evaluate(dataset_id, df, node[1])
+        elif kind in ('and', 'or'):
+            masks = [self._evaluate(dataset_id, df, child) for child in node[1]]
+            mask = np.logical_and.reduce(masks) if kind == 'and' else np.logical_or.reduce(masks)
+        else:
+            index = self.filter_engine.index(dataset_id, df, resolve_column(node[1], df.columns))
+            if kind == 'in':
+                mask = index.match_values(node[2])
+            elif kind == 'prefix':
+                mask = index.match_prefix([node[2]])
+            else:
+                operator, value = node[2], node[3]
+                if operator in ('>', '>='):
+                    mask = index.match_range(low=value, low_inclusive=operator == '>=')
+                else:
+                    mask = index.match_range(high=value, high_inclusive=operator == '<=')
+
+        self._store(key, mask)
+        return mask
+
+    def mask(self, dataset_id, df, query):
+        """
+        Evaluate a segment query on a dataset version.
+
+        Returns:
+            np.ndarray: Boolean array with one entry per row.
+
+        Raises:
+            SegmentError: If the query is invalid or refers to unknown columns.
+        """
+        return self._evaluate(dataset_id, df, parse_segment(query))
+
+    def filter(self, dataset_id, df, query):
+        """Return the rows of a dataset version that belong to the segment."""
+        return df[self.mask(dataset_id, df, query)]
@@ -0,0 +1,142 @@
+import queue
+import threading
+
+
+_DONE = object()
+
+
+class _ProducerError:
+    """Wraps an exception raised by the producer thread so it can be re-raised by the consumer."""
+
+    def __init__(self, error):
+        self.error = error
+
+
+##========= Run a producer in the background behind a bounded queue ===========
+def prefetch(iterable, max_queued=4, poll_interval=0.5, on_depth_change=None):
+    """
+    Iterate over an iterable in a background thread, handing items over through a bounded queue.
+
+    The producer (e.g. parsing and cleaning file chunks) runs ahead of the consumer (e.g. sending
+    contacts to the CRM) by at most `max_queued` items. When the queue is full the producer blocks,
+    so a slow consumer applies backpressure and memory stays bounded.
+
+    Args:
+        iterable (iterable): The items to produce, evaluated in the background thread.
+        max_queued (int): Maximum number of produced items waiting to be consumed.
+        poll_interval (float): Seconds between checks for an abandoned consumer.
+        on_depth_change (callable, optional): Called with the change in the number of queued items
+                                              (+1, -1, or minus the items left when iteration stops),
+                                              so several streams can add up in one gauge via its inc().
+
+    Yields:
+        The items of the iterable, in order.
+
+    Raises:
+        Exception: Any exception raised by the producer is re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=max_queued)
+    stop = threading.Event()
+    depth_lock = threading.Lock()
+    queued = 0
+    closed = False
+
+    def change_depth(delta):
+        nonlocal queued
+        if on_depth_change is None:
+            return
+        with depth_lock:
+            # Items put after the consumer went away were already subtracted from the depth
+            if closed:
+                return
+            queued += delta
+            on_depth_change(delta)
+
+    def put(item):
+        # Give up if the consumer went away, instead of blocking forever on a full queue
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=poll_interval)
+                change_depth(1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_ProducerError(e))
+            return
+        put(_DONE)
+
+    producer = threading.Thread(target=produce, name="prefetch-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            change_depth(-1)
+            if item is _DONE:
+                return
+            if isinstance(item, _ProducerError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        with depth_lock:
+            closed = True
+            if on_depth_change is not None and queued:
+                on_depth_change(-queued)
+
+
+##========= Run a long job in the background and stream its progress ===========
+def run_with_progress(func):
+    """
+    Run `func(report, cancelled)` in a background thread and yield the progress events it reports.
+
+    The function calls `report(event)` to publish a progress event, and should check the
+    `cancelled` threading.Event regularly: it is set when the consumer stops iterating,
+    e.g. because the client of a streaming response disconnected.
+
+    Use `result = yield from run_with_progress(func)` to forward the events and get the result.
+
+    Args:
+        func (callable): The job, called with the report function and the cancellation event.
+
+    Yields:
+        The progress events, in the order they were reported.
+
+    Returns:
+        The return value of the function.
+
+    Raises:
+        Exception: Any exception raised by the function is re-raised in the consumer.
+    """
+    events = queue.Queue()
+    cancelled = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["result"] = func(events.put, cancelled)
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            events.put(_DONE)
+
+    worker = threading.Thread(target=run, name="progress-worker", daemon=True)
+    worker.start()
+    try:
+        while True:
+            event = events.get()
+            if event is _DONE:
+                break
+            yield event
+    finally:
+        cancelled.set()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("result")
@@ -0,0 +1,110 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+##========= Dash DataTable filter_query and sort_by support ===================
+# Operators of the DataTable filter syntax, e.g. "{Tag} contains sms && {PERSONAL_ZIP} >= 20000"
+filter_operators = [
+    ('ge', ['ge', '>=']),
+    ('le', ['le', '<=']),
+    ('lt', ['lt', '<']),
+    ('gt', ['gt', '>']),
+    ('ne', ['ne', '!=']),
+    ('eq', ['eq', '=']),
+    ('icontains', ['icontains']),
+    ('contains', ['contains', 'scontains']),
+    ('datestartswith', ['datestartswith']),
+]
+column_pattern = re.compile(r'^\{(?P<column>[^}]*)\}\s*(?P<rest>.*)$')
+
+
+def parse_filter_part(part):
+    """
+    Parse one condition of a DataTable filter query.
+
+    Returns:
+        tuple: (column, operator, value), or (None, None, None) if the condition cannot be parsed.
+    """
+    match = column_pattern.match(part.strip())
+    if not match:
+        return None, None, None
+    column, rest = match.group('column'), match.group('rest')
+    for operator, tokens in filter_operators:
+        for token in tokens:
+            if rest.startswith(token):
+                value = rest[len(token):].strip()
+                if value and value[0] == value[-1] and value[0] in ('"', "'", '`'):
+                    value = value[1:-1].replace('\\' + value[0], value[0])
+                else:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                return column, operator, value
+    return None, None, None
+
+
+def filter_query_mask(df, filter_query):
+    """
+    Evaluate a DataTable filter query ("cond && cond && ...") into a boolean row mask.
+
+    Conditions on unknown columns or with unsupported syntax are ignored.
+
+    Returns:
+        np.ndarray: Boolean array with one entry per row.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for part in (filter_query or '').split(' && '):
+        column, operator, value = parse_filter_part(part)
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            if isinstance(value, float):
+                values = pd.to_numeric(values, errors='coerce')
+            else:
+                values = values.astype('string')
+                value = str(value)
+            condition = getattr(values, operator)(value)
+        elif operator in ('contains', 'icontains'):
+            # Case-sensitive like the DataTable, whose case-insensitive form is 'icontains'
+            condition = values.astype('string').str.contains(str(value), case=operator == 'contains', regex=False)
+        else:  # datestartswith
+            condition = values.astype('string').str.startswith(str(value))
+        mask &= condition.fillna(False).to_numpy(dtype=bool)
+    return mask
+
+
+def sort_key(sort_by):
+    """Turn a DataTable sort_by list into a hashable key: ((column, ascending), ...)."""
+    return tuple((s['column_id'], s.get('direction', 'asc') == 'asc') for s in (sort_by or []))
+
+
+def sort_permutation(df, key):
+    """
+    Compute the row order of a DataFrame for a sort key, missing values last.
+
+    Args:
+        df (pd.DataFrame): The dataset.
+        key (tuple): Sort key from `sort_key`.
+
+    Returns:
+        np.ndarray: Row positions in sorted order.
+    """
+    key = tuple((column, ascending) for column, ascending in key if column in df.columns)
+    if not key:
+        return np.arange(len(df))
+    columns = [column for column, _ in key]
+    sort_frame = df[columns].reset_index(drop=True)
+    sort_frame.columns = range(len(columns))  # Avoid clashes between duplicate column names
+    sort_options = dict(by=list(range(len(columns))), ascending=[ascending for _, ascending in key],
+                        kind='stable', na_position='last')
+    try:
+        ordered = sort_frame.sort_values(**sort_options)
+    except TypeError:
+        # Object columns mixing types (e.g. numbers and text) are compared by their text
+        text_frame = sort_frame.apply(lambda col: col.astype('string') if col.dtype == object else col)
+        ordered = text_frame.sort_values(**sort_options)
+    return ordered.index.to_numpy()
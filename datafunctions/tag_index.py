@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+TAG_SEPARATOR = ', '
+
+
+##========= Inverted index of the Tag column ====================================
+class TagIndex:
+    """
+    Inverted index of a tag column: for every tag, a row bitmap (boolean array) and a row count.
+
+    Checking whether a tag exists, or how many rows have it, takes constant time. Indexes are
+    immutable like the dataset versions they describe: `add` and `remove` return the updated
+    column together with a new index that shares the bitmaps of the tags they did not touch.
+
+    Args:
+        bitmaps (dict): Row bitmap per tag.
+        n_rows (int): Number of rows of the indexed column.
+        counts (dict, optional): Row count per tag; counted from the bitmaps when omitted.
+    """
+
+    def __init__(self, bitmaps, n_rows, counts=None):
+        self.bitmaps = bitmaps
+        self.n_rows = n_rows
+        self.counts = counts if counts is not None else {tag: int(bitmap.sum()) for tag, bitmap in bitmaps.items()}
+
+    @classmethod
+    def from_series(cls, tags):
+        """Build the index of a tag column ('tag1, tag2' strings), splitting every value once."""
+        n_rows = len(tags)
+        exploded = tags.reset_index(drop=True).astype('string').fillna('').str.split(TAG_SEPARATOR).explode()
+        exploded = exploded[exploded.notna() & (exploded != '')]
+        codes, uniques = pd.factorize(exploded)
+        matrix = np.zeros((len(uniques), n_rows), dtype=bool)
+        matrix[codes, exploded.index.to_numpy()] = True
+        return cls({tag: matrix[code] for code, tag in enumerate(uniques)}, n_rows)
+
+    def __contains__(self, tag):
+        return self.counts.get(tag, 0) > 0
+
+    def count(self, tag):
+        return self.counts.get(tag, 0)
+
+    def add(self, tags, column):
+        """
+        Add tags to every row of a tag column, skipping tags a row already has.
+
+        Args:
+            tags (list): The tags to add.
+            column (pd.Series): The indexed tag column.
+
+        Returns:
+            tuple: The updated column and its index.
+        """
+        values = column.astype('string').fillna('').to_numpy(dtype=object)
+        for tag in dict.fromkeys(tags):
+            missing = ~self.bitmaps[tag] if tag in self.bitmaps else np.ones(self.n_rows, dtype=bool)
+            if not missing.any():
+                continue
+            has_tags = missing & (values != '')
+            values[has_tags] = values[has_tags] + TAG_SEPARATOR + tag
+            values[missing & ~has_tags] = tag
+        bitmaps = dict(self.bitmaps)
+        bitmaps.update({tag: np.ones(self.n_rows, dtype=bool) for tag in tags})
+        # Only the added tags change: every row has them now
+        counts = dict(self.counts)
+        counts.update({tag: self.n_rows for tag in tags})
+        return pd.Series(values, index=column.index, name=column.name), TagIndex(bitmaps, self.n_rows, counts)
+
+    def remove(self, tags, column):
+        """
+        Remove tags from a tag column. Only the rows that have one of the tags are rewritten.
+
+        Args:
+            tags (list): The tags to remove.
+            column (pd.Series): The indexed tag column.
+
+        Returns:
+            tuple: The updated column and its index.
+        """
+        present = [tag for tag in dict.fromkeys(tags) if tag in self]
+        if not present:
+            return column, self
+        affected = np.logical_or.reduce([self.bitmaps[tag] for tag in present])
+        removed = set(present)
+        values = column.to_numpy(dtype=object, copy=True)
+        values[affected] = [
+            TAG_SEPARATOR.join(t for t in value.split(TAG_SEPARATOR) if t not in removed)
+            for value in values[affected]
+        ]
+        bitmaps = {tag: bitmap for tag, bitmap in self.bitmaps.items() if tag not in removed}
+        counts = {tag: count for tag, count in self.counts.items() if tag not in removed}
+        return pd.Series(values, index=column.index, name=column.name), TagIndex(bitmaps, self.n_rows, counts)
+
+
+class TagIndexCache:
+    """
+    Thread-safe LRU cache of tag indexes per dataset version, built lazily on first use.
+
+    Args:
+        max_entries (int): Maximum number of indexes kept.
+    """
+
+    def __init__(self, max_entries=20):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, dataset_id, df, column='Tag'):
+        """Return the index of a dataset version's tag column, building it if needed."""
+        with self._lock:
+            index = self._entries.get(dataset_id)
+            if index is not None:
+                self._entries.move_to_end(dataset_id)
+                return index
+        values = df[column] if column in df.columns else pd.Series('', index=df.index)
+        index = TagIndex.from_series(values)
+        self.put(dataset_id, index)
+        return index
+
+    def put(self, dataset_id, index):
+        with self._lock:
+            self._entries[dataset_id] = index
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,80 @@
+import json
+
+try:
+    import pyarrow as pa
+except ImportError:  # The binary transport is optional; JSON is used without pyarrow
+    pa = None
+
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+arrow_compressions = ('lz4', 'zstd')
+
+# Schema metadata key carrying the response fields that are not table data (dataset ID, paging, ...)
+_metadata_key = b'dataprocess'
+
+
+##========= Arrow IPC stream transport for datasets ============================
+def arrow_available():
+    """Whether pyarrow is installed, so datasets can be exchanged as Arrow IPC streams."""
+    return pa is not None
+
+
+def accepts_arrow(accept_header):
+    """Whether an Accept header asks for an Arrow IPC stream."""
+    return arrow_available() and ARROW_STREAM_MIMETYPE in (accept_header or '')
+
+
+def to_arrow_table(df):
+    """Convert a DataFrame to an Arrow table, sending object columns Arrow cannot type as text."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Object columns mixing e.g. numbers and text cannot be typed by Arrow; send them as text
+        mixed = {col: 'string' for col in df.columns if df[col].dtype == object}
+        return pa.Table.from_pandas(df.astype(mixed), preserve_index=False)
+
+
+def to_arrow_ipc(df, metadata=None, compression=None):
+    """
+    Serialize a DataFrame to an Arrow IPC stream.
+
+    Column types are kept, so text columns such as ZIP codes and phone numbers stay text
+    and integer columns with missing values do not turn into floats.
+
+    Args:
+        df (pd.DataFrame): The data to send.
+        metadata (dict, optional): JSON-serializable fields sent along with the data.
+        compression (str, optional): Buffer compression, 'lz4' or 'zstd'.
+
+    Returns:
+        bytes: The IPC stream.
+    """
+    if compression not in (None,) + arrow_compressions:
+        raise ValueError(f"Unsupported compression '{compression}'")
+    table = to_arrow_table(df)
+    if metadata is not None:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[_metadata_key] = json.dumps(metadata, default=str).encode('utf-8')
+        table = table.replace_schema_metadata(schema_metadata)
+
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow_ipc(data):
+    """
+    Read a DataFrame and its metadata from an Arrow IPC stream (compressed or not).
+
+    Args:
+        data (bytes): The IPC stream.
+
+    Returns:
+        tuple: The DataFrame and the metadata dict (empty if none was sent).
+    """
+    with pa.ipc.open_stream(pa.py_buffer(data)) as reader:
+        table = reader.read_all()
+    metadata = (table.schema.metadata or {}).get(_metadata_key)
+    return table.to_pandas(), json.loads(metadata) if metadata else {}
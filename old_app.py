@@ -3,15 +3,41 @@ from dash import dcc, html, Input, Output, State, dash_table
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
 import pandas as pd
-import base64
-from io import StringIO
 from datetime import datetime
-import json
-from datafunctions.data_processing import preserve_phone_format, clean_and_tag_data, simplify_data_format, combine_multiple_files
+import os
+import tempfile
+import uuid
+from flask import Response, request, stream_with_context
+from datafunctions.data_processing import clean_and_tag_data, simplify_data_format, combine_multiple_files, parse_contents
+from datafunctions.dataset_store import DatasetStore
+from datafunctions.tag_index import TagIndexCache
+from datafunctions.filter_engine import FilterEngine
+from datafunctions.profiling import ProfileCache
+from datafunctions.exports import XLSX_MIMETYPE, export_filename, iter_csv_chunks, iter_file_chunks, write_xlsx, xlsx_available
+
+# Derived DataFrames share unchanged columns with their source instead of copying them
+pd.set_option('mode.copy_on_write', True)
 
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP, 'assets/styles.css'], suppress_callback_exceptions=True)
 app.title = "CRM Audience Data Processing App"
 
+# Processed datasets stay on the server; the browser only keeps the ID of the current version.
+# Point DASH_DATASET_STORE_DIR at a shared directory when running several Dash workers.
+dataset_store = DatasetStore(
+    max_versions=int(os.getenv("DASH_DATASET_STORE_MAX_VERSIONS", 20)),
+    directory=os.getenv("DASH_DATASET_STORE_DIR") or None,
+    max_bytes=int(os.getenv("DASH_DATASET_STORE_MAX_BYTES", 2 * 1024 ** 3)),
+)
+
+# Tag indexes of recent dataset versions, for constant-time tag checks and per-tag counts
+tag_indexes = TagIndexCache(max_entries=int(os.getenv("DASH_DATASET_STORE_MAX_VERSIONS", 20)))
+
+# Column indexes of recent dataset versions for the filter panel
+filter_engine = FilterEngine(max_datasets=int(os.getenv("DASH_DATASET_STORE_MAX_VERSIONS", 20)))
+
+# Column statistics of recent dataset versions, updated from the parent version after filters and tag edits
+profiles = ProfileCache(max_entries=int(os.getenv("DASH_DATASET_STORE_MAX_VERSIONS", 20)))
+
 # New component for the toggle button
 sidebar_toggle = html.Div([
     html.Button("≡", id="sidebar-toggle", className="toggle-btn"),
@@ -22,7 +48,7 @@ sidebar_toggle = html.Div([
     )
 ], className="sidebar-toggle-container")
 
-app.layout = html.Div([
+main_layout = html.Div([
     dbc.Container([
         # Title Bar with Company Logo
         dbc.Row([
@@ -92,7 +118,8 @@ app.layout = html.Div([
                         ),
                         html.Small("Note: Deleting tags will remove them from all rows. Please review carefully before deleting.", style={"color": "red", "margin-bottom": "10px", "display": "block"}),
                         dbc.Button("Add Tag(s)", id='add-tag-button', n_clicks=0, className="btn btn-custom mt-2"),
-                        dbc.Button("Delete Tag(s)", id='delete-tag-button', n_clicks=0, className="btn btn-danger mt-2 tag-button")
+                        dbc.Button("Delete Tag(s)", id='delete-tag-button', n_clicks=0, className="btn btn-danger mt-2 tag-button"),
+                        html.Div(id='tag-counts', style={"marginTop": "10px"}),
                     ], style={"marginTop": "20px"}),
                     # Filtering Components
                     html.Div([
@@ -125,11 +152,12 @@ app.layout = html.Div([
                 html.Div(id='data-table-div'),
                 # Display the structure of the data
                 html.Div(id='data-structure', style={"color": "#007bff", "font-weight": "bold", "margin-top": "40px"}),
+                html.Div(id='data-profile', style={"margin-top": "20px"}),
             ], id="main-content", className="main-content", width=9),
             
             dcc.Loading([html.Div(id="loading-demo")]),
         ], className="flex-container"),
-        # Store component to share data between callbacks
+        # Store component holding the ID of the processed dataset in the server-side store
         dcc.Store(id='processed-data'),
         
         # Footer
@@ -141,6 +169,21 @@ app.layout = html.Div([
     ], fluid=True, className="container-fluid")  # Use container-fluid to span full width
 ])
 
+def serve_layout():
+    # Every page load gets its own session ID, which namespaces its datasets in the store
+    return html.Div([main_layout, dcc.Store(id='session-id', data=uuid.uuid4().hex)])
+
+app.layout = serve_layout
+
+expired_message = "Your data is no longer available on the server. Please upload the file again."
+
+def load_dataset(dataset_id):
+    """Fetch a dataset from the server-side store, or None if it has expired."""
+    try:
+        return dataset_store.get(dataset_id)
+    except KeyError:
+        return None
+
 # Add this callback to handle the sidebar toggle
 @app.callback(
     [Output("sidebar", "className"),
@@ -188,9 +231,10 @@ def toggle_instructions(n_clicks, current_style):
      State('processed-data', 'data'),
      State('column-filter-select', 'value'),
      State('filter-value-input', 'value'),
-     State('tag-input', 'value')]
+     State('tag-input', 'value'),
+     State('session-id', 'data')]
 )
-def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, reset_clicks, filename, last_modified, operation, json_data, selected_column, filter_values, tag_input):
+def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, reset_clicks, filename, last_modified, operation, dataset_id, selected_column, filter_values, tag_input, session_id):
     ctx = dash.callback_context
     if not ctx.triggered:
         return [dash.no_update] * 9
@@ -199,14 +243,16 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
     
     try:
         if triggered_id == 'reset-button':
+            dataset_store.clear(session_id)
             return [None, None, None, [], None, None, "All inputs have been reset.", True, "info"]
         
         if triggered_id == 'upload-data' and contents:
             dfs = []
             for content, name in zip(contents, filename):
-                content_type, content_string = content.split(',')
-                decoded = base64.b64decode(content_string)
-                df = pd.read_csv(StringIO(decoded.decode('utf-8')))
+                # CSV, Excel, Parquet and Feather files are read by their extension
+                df, error_message = parse_contents(content, name)
+                if df is None:
+                    return [dash.no_update] * 6 + [f"Could not read '{name}': {error_message}", True, "warning"]
                 dfs.append(df)
             
             if operation == 'combine':
@@ -266,7 +312,7 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
                     color = "warning"
                     return [dash.no_update] * 6 + [feedback, True, color]
             
-            processed_data = df.to_json(date_format='iso', orient='split')
+            processed_data = dataset_store.put(df, operation="upload", namespace=session_id)
             initial_structure = f"Data Structure: {len(df)} rows and {len(df.columns)} columns"
 
             data_table = create_data_table(df)
@@ -276,25 +322,26 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
             return data_table, initial_structure, processed_data, column_options, download_button, None, feedback, True, color
 
         elif triggered_id == 'filter-button':
-            if json_data and selected_column and filter_values:
-                df = pd.read_json(StringIO(json_data), orient='split')
+            if dataset_id and selected_column and filter_values:
+                df = load_dataset(dataset_id)
+                if df is None:
+                    return [dash.no_update] * 6 + [expired_message, True, "warning"]
                 values = [v.strip() for v in filter_values.split(',')]
 
-                # Preserve phone number format during filtering
-                df = preserve_phone_format(df)
-
                 if selected_column not in df.columns:
                     return [dash.no_update] * 6 + [f"Selected column '{selected_column}' does not exist in the data.", True, "warning"]
 
-                present_values = [v for v in values if v in df[selected_column].values]
-                missing_values = [v for v in values if v not in df[selected_column].values]
+                # Value lookups go through the column index, built once per dataset version
+                column_index = filter_engine.index(dataset_id, df, selected_column)
+                present_values = [v for v in values if v in column_index.lookup]
+                missing_values = [v for v in values if v not in column_index.lookup]
 
                 if not present_values:
                     return [dash.no_update] * 6 + [f"None of the provided values exist in the '{selected_column}' column.", True, "warning"]
 
-                filtered_df = df[df[selected_column].isin(present_values)]
-                filtered_df = preserve_phone_format(filtered_df)  # Ensure phone format remains during filtering
-                filtered_data = filtered_df.to_json(date_format='iso', orient='split')
+                filtered_df = df[column_index.match_values(present_values)]
+                filtered_data = dataset_store.put(filtered_df, parent_id=dataset_id, operation="filter", namespace=session_id)
+                profiles.derive(filtered_data, filtered_df, dataset_id, df, changed_columns=[])
                 filtered_structure = f"Filtered Data Structure: {len(filtered_df)} rows and {len(filtered_df.columns)} columns"
 
                 data_table = create_data_table(filtered_df)
@@ -308,24 +355,21 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
                 return [dash.no_update] * 6 + ["Please select a column and enter filter values before applying the filter.", True, "warning"]
 
         elif triggered_id in ['add-tag-button', 'delete-tag-button'] and tag_input:
-            if json_data:
-                df = pd.read_json(StringIO(json_data), orient='split')
+            if dataset_id:
+                df = load_dataset(dataset_id)
+                if df is None:
+                    return [dash.no_update] * 6 + [expired_message, True, "warning"]
                 tags = [tag.strip() for tag in tag_input.split(',') if tag.strip()]
-
-                # Preserve phone number format before tag operations
-                df = preserve_phone_format(df)
+                # Existence checks and updates go through the tag index instead of scanning the column per tag
+                tag_index = tag_indexes.get(dataset_id, df)
+                tag_column = df['Tag'] if 'Tag' in df.columns else pd.Series('', index=df.index)
 
                 if triggered_id == 'add-tag-button':
-                    new_tags = []
-                    existing_tags = []
-                    for tag in tags:
-                        if df['Tag'].apply(lambda x: tag not in (x.split(', ') if pd.notna(x) else [])).all():
-                            new_tags.append(tag)
-                        else:
-                            existing_tags.append(tag)
+                    new_tags = [tag for tag in tags if tag not in tag_index]
+                    existing_tags = [tag for tag in tags if tag in tag_index]
 
                     if new_tags:
-                        df['Tag'] = df['Tag'].apply(lambda x: ', '.join(set((x.split(', ') if pd.notna(x) else []) + new_tags)))
+                        tag_column, tag_index = tag_index.add(new_tags, tag_column)
                         message = f"New tag(s) added successfully: {', '.join(new_tags)}"
                         if existing_tags:
                             message += f"\nExisting tag(s) not added: {', '.join(existing_tags)}"
@@ -334,16 +378,11 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
                     color = "success" if new_tags else "warning"
 
                 else:  # delete-tag-button
-                    deleted_tags = []
-                    non_existent_tags = []
-                    for tag in tags:
-                        if df['Tag'].apply(lambda x: tag in (x.split(', ') if pd.notna(x) else [])).any():
-                            deleted_tags.append(tag)
-                        else:
-                            non_existent_tags.append(tag)
+                    deleted_tags = [tag for tag in tags if tag in tag_index]
+                    non_existent_tags = [tag for tag in tags if tag not in tag_index]
 
                     if deleted_tags:
-                        df['Tag'] = df['Tag'].apply(lambda x: ', '.join([t for t in (x.split(', ') if pd.notna(x) else []) if t not in deleted_tags]))
+                        tag_column, tag_index = tag_index.remove(deleted_tags, tag_column)
                         message = f"Tag(s) deleted successfully: {', '.join(deleted_tags)}"
                         if non_existent_tags:
                             message += f"\nNon-existent tag(s) not deleted: {', '.join(non_existent_tags)}"
@@ -351,9 +390,11 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
                         message = f"No tags deleted. All specified tags do not exist: {', '.join(non_existent_tags)}"
                     color = "success" if deleted_tags else "warning"
 
-                # Preserve phone number format after tag operations
-                df = preserve_phone_format(df)
-                processed_data = df.to_json(date_format='iso', orient='split')
+                parent_df, df = df, df.assign(Tag=tag_column)
+                processed_data = dataset_store.put(df, parent_id=dataset_id, operation=triggered_id.replace('-button', ''),
+                                                   namespace=session_id, changed_columns=['Tag'])
+                tag_indexes.put(processed_data, tag_index)  # The new version starts with an up-to-date index
+                profiles.derive(processed_data, df, dataset_id, parent_df, changed_columns=['Tag'])
                 initial_structure = f"Data Structure: {len(df)} rows and {len(df.columns)} columns"
 
                 data_table = create_data_table(df)
@@ -367,6 +408,39 @@ def update_output(contents, filter_clicks, add_tag_clicks, delete_tag_clicks, re
     except Exception as e:
         error_message = f"An unexpected error occurred: {str(e)}. Please check your data and try again."
         return [dash.no_update] * 6 + [error_message, True, "danger"]
+
+# Show how many rows carry each tag, read from the tag index of the current version
+@app.callback(
+    Output('tag-counts', 'children'),
+    Input('processed-data', 'data')
+)
+def update_tag_counts(dataset_id):
+    df = load_dataset(dataset_id) if dataset_id else None
+    if df is None:
+        return None
+    tag_index = tag_indexes.get(dataset_id, df)
+    counts = sorted(tag_index.counts.items(), key=lambda item: (-item[1], item[0]))
+    return html.Ul([html.Li(f"{tag}: {count:,} rows") for tag, count in counts if count], className="tag-counts-list")
+
+# Null, distinct and most frequent values per column, plus phone and email validity
+@app.callback(
+    Output('data-profile', 'children'),
+    Input('processed-data', 'data')
+)
+def update_data_profile(dataset_id):
+    df = load_dataset(dataset_id) if dataset_id else None
+    if df is None:
+        return None
+    profile = profiles.get(dataset_id, df).summary(top_k=3)
+    rows = [html.Tr([html.Td(col["name"]), html.Td(f"{col['nulls']:,}"), html.Td(f"{col['distinct']:,}"),
+                     html.Td(", ".join(f"{top['value']} ({top['count']:,})" for top in col["top"]))])
+            for col in profile["columns"]]
+    validity = [f"{name}: {v['valid_rate']:.1%} valid" for name, v in profile["validity"].items() if v["valid_rate"] is not None]
+    return html.Div([
+        dbc.Table([html.Thead(html.Tr([html.Th("Column"), html.Th("Missing"), html.Th("Distinct"), html.Th("Most frequent")])),
+                   html.Tbody(rows)], bordered=True, size="sm"),
+        html.P(" | ".join(validity)) if validity else None,
+    ])
 def create_data_table(df):
     return dash_table.DataTable(
         id='data-table',
@@ -399,29 +473,52 @@ def create_data_table(df):
     )
  #   
 def create_download_button():
-    # Create a download button for processed data
+    # Download link for processed data; its address is set for the current dataset version
     return html.Div([
-        dbc.Button(
+        html.A(dbc.Button(
             'Download Processed Data',
             id='download-button',
             
             className=" btn btn-custom mt-2"
-        ),
-        dcc.Download(id="download-dataframe-csv"),
+        ), id='download-link'),
+        html.A(dbc.Button(
+            'Download as Excel',
+            className=" btn btn-custom mt-2"
+        ), id='download-xlsx-link', style={} if xlsx_available() else {'display': 'none'}),
     ])
 
 @app.callback(
-    Output("download-dataframe-csv", "data"),
-    Input("download-button", "n_clicks"),
-    State("processed-data", "data"),
-    prevent_initial_call=True,
+    [Output('download-link', 'href'),
+     Output('download-xlsx-link', 'href')],
+    Input('processed-data', 'data'),
 )
-def download_csv(n_clicks, data):
-    # Callback to handle the download of processed data as a CSV file
-    if n_clicks is None:
-        return dash.no_update
-    df = pd.read_json(StringIO(data), orient='split')
-    return dcc.send_data_frame(df.to_csv, "processed_data.csv", index=False)
+def update_download_link(dataset_id):
+    if not dataset_id:
+        return None, None
+    url = app.get_relative_path(f"/download/{dataset_id}")
+    return url, f"{url}?format=xlsx"
+
+@app.server.route('/download/<dataset_id>')
+def download_dataset(dataset_id):
+    # The CSV is rendered and sent in chunks instead of being built in memory by a callback
+    df = load_dataset(dataset_id)
+    if df is None:
+        return Response(expired_message, status=404, mimetype="text/plain")
+    if request.args.get('format') == 'xlsx' and xlsx_available():
+        # Written row by row to a temporary file in constant-memory mode, then streamed and removed
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            write_xlsx(df, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return Response(stream_with_context(iter_file_chunks(path, remove=True)), mimetype=XLSX_MIMETYPE,
+                        headers={"Content-Disposition": f"attachment; filename={export_filename('processed_data', 'xlsx')}"})
+    compression = 'gzip' if request.args.get('compression') == 'gzip' else None
+    return Response(stream_with_context(iter_csv_chunks(df, compression=compression)),
+                    mimetype='application/gzip' if compression else 'text/csv',
+                    headers={"Content-Disposition": f"attachment; filename={export_filename('processed_data', 'csv', compression)}"})
 
 @app.callback(
     [Output('operation-select', 'value'),
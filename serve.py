@@ -0,0 +1,124 @@
+"""
+Production entry point for the API and the Dash app.
+
+Usage:
+    python serve.py api     # Flask data processing API
+    python serve.py app     # Dash app
+
+Runs preforked gunicorn workers (threads per worker) where available, and falls back to a
+multithreaded waitress server on Windows. Settings are read from the environment (.env):
+
+    WEB_CONCURRENCY       Number of worker processes (default: CPU count, at most 4)
+    WEB_THREADS           Threads per worker (default: 4)
+    SERVER_HOST           Interface to bind (default: 127.0.0.1)
+    API_PORT / DASH_PORT  Ports of the API and the Dash app (default: 3000 / 8050)
+    LOAD_DRAIN_TIMEOUT    Seconds a stopping worker waits for in-flight CRM loads (default: 300)
+    DATASET_STORE_DIR     Directory shared by API workers for processed datasets
+    LOG_FILE_PER_PROCESS  One log file per API worker (default: on with several workers)
+    PROMETHEUS_MULTIPROC_DIR  Directory in which API workers share /metrics samples
+"""
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+from dotenv import load_dotenv
+
+import wsgi
+
+load_dotenv()
+
+workers = int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4)))
+threads = int(os.getenv("WEB_THREADS", 4))
+host = os.getenv("SERVER_HOST", "127.0.0.1")
+drain_timeout = int(os.getenv("LOAD_DRAIN_TIMEOUT", 300))
+
+targets = {
+    "api": (wsgi.create_api_app, int(os.getenv("API_PORT", 3000))),
+    "app": (wsgi.create_dash_app, int(os.getenv("DASH_PORT", 8050))),
+}
+
+
+def drain_loads():
+    """Wait for CRM loads still running in this process (API workers only)."""
+    if "api" in sys.modules:
+        from api import wait_for_loads
+        if not wait_for_loads(drain_timeout):
+            logging.warning("Shutting down with CRM loads still running.")
+
+
+def mark_worker_dead(server, worker):
+    """Drop the live gauges of an exited worker from the aggregated /metrics."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def serve_gunicorn(factory, port):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return factory()
+
+    Application({
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread",
+        # Import the app (pandas, compiled regexes) once in the master before forking
+        "preload_app": True,
+        # Long CRM loads run inside requests, so allow them to finish on shutdown
+        "timeout": drain_timeout,
+        "graceful_timeout": drain_timeout,
+        "worker_exit": lambda server, worker: drain_loads(),
+        "child_exit": mark_worker_dead,
+    }).run()
+
+
+def serve_waitress(factory, port):
+    from waitress import serve
+
+    def shutdown(signum, frame):
+        drain_loads()
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    serve(factory(), host=host, port=port, threads=workers * threads)
+
+
+def main(target):
+    factory, port = targets[target]
+    if target == "api" and workers > 1:
+        # Workers are separate processes, so datasets must be shared through disk
+        os.environ.setdefault("DATASET_STORE_DIR", os.path.join(tempfile.gettempdir(), "data-process-app", "datasets"))
+        # Rotating log files must have a single writer, so every worker logs to its own file
+        os.environ.setdefault("LOG_FILE_PER_PROCESS", "1")
+        if sys.platform != "win32" and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            # Metric samples of the previous run must not leak into this one
+            metrics_dir = os.path.join(tempfile.gettempdir(), "data-process-app", "metrics")
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+            os.makedirs(metrics_dir)
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+
+    if sys.platform == "win32":
+        serve_waitress(factory, port)
+    else:
+        serve_gunicorn(factory, port)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in targets:
+        sys.exit(f"Usage: python serve.py [{'|'.join(targets)}]")
+    main(sys.argv[1])
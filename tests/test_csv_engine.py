@@ -0,0 +1,45 @@
+import io
+import logging
+
+import pandas as pd
+import pytest
+
+from datafunctions.csv_engine import iter_read_csv, read_csv
+
+pytest.importorskip('pyarrow')
+
+
+def multiline_csv(n_rows, multiline_rows, blank_after=()):
+    lines = ['a,b'] + [f'{i},v{i}' for i in range(n_rows)]
+    for i in multiline_rows:
+        lines[i + 1] = f'{i},"p\nq\nr\ns"'
+    for i in blank_after:
+        lines[i + 1] += '\n'
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def test_read_csv_keeps_text_columns():
+    df = read_csv(io.BytesIO(b'zip,n\n02134,1\n,2\n'), dtype={'zip': 'string'})
+    assert df['zip'].tolist()[0] == '02134'
+    assert df['zip'].isna().tolist() == [False, True]
+
+
+def test_fallback_after_multiline_values_resumes_at_the_right_record(caplog):
+    # Small blocks split the second multiline value, so pyarrow fails after yielding some rows
+    # Line numbers and record numbers differ before the failure point
+    data = multiline_csv(80, [1, 20], blank_after=[4])
+    with caplog.at_level(logging.WARNING):
+        chunks = list(iter_read_csv(io.BytesIO(data), chunk_size=7, block_size=20))
+    assert any('falling back to the C parser' in message for message in caplog.messages)
+
+    df = pd.concat(chunks)
+    assert df['a'].tolist() == list(range(80))
+    assert df.index.tolist() == list(range(80))
+    assert df.loc[20, 'b'] == 'p\nq\nr\ns'
+
+
+def test_c_engine_chunks():
+    data = multiline_csv(25, [3])
+    chunks = list(iter_read_csv(io.BytesIO(data), chunk_size=10, engine='c'))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert pd.concat(chunks)['a'].tolist() == list(range(25))
@@ -0,0 +1,135 @@
+import io
+import time
+
+import pandas as pd
+import pytest
+
+from datafunctions import excel_engine
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+def workbook_bytes(sheets):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        sheet = workbook.create_sheet(name)
+        for row in rows:
+            sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def split_workbook(n_sheets=4, rows_per_sheet=5):
+    sheets = {
+        f'Data {n}': [['PERSONAL_ZIP', 'NAME']] + [[22201 + i, f'n{n}-{i}'] for i in range(rows_per_sheet)]
+        for n in range(n_sheets)
+    }
+    sheets['Notes'] = [['note'], ['not contact data']]
+    return workbook_bytes(sheets)
+
+
+def require(engine):
+    if engine == 'calamine':
+        pytest.importorskip('python_calamine')
+
+
+@pytest.mark.parametrize('engine', ['calamine', 'openpyxl'])
+def test_sheets_with_the_same_columns_are_read_as_one_table(engine):
+    require(engine)
+    chunks = list(excel_engine.iter_read_excel(io.BytesIO(split_workbook()), 3, engine=engine, sheets='all',
+                                               dtype={'PERSONAL_ZIP': 'string'}))
+    df = pd.concat([chunk for chunk, _ in chunks])
+    assert len(df) == 20
+    assert list(df.columns) == ['PERSONAL_ZIP', 'NAME']
+    assert df.index.tolist() == list(range(20))
+    assert df['PERSONAL_ZIP'].iloc[0] == '22201'
+    fractions = [fraction for _, fraction in chunks]
+    assert fractions == sorted(fractions) and fractions[-1] <= 1.0
+
+
+def test_read_ahead_is_bounded_and_workbooks_are_closed(monkeypatch):
+    pytest.importorskip('python_calamine')
+    loaded, open_sheets = [], set()
+    peak = 0
+    load_sheet = excel_engine._load_sheet
+
+    def tracking_load_sheet(data, engine, name):
+        nonlocal peak
+        rows, height, close = load_sheet(data, engine, name)
+        loaded.append(name)
+        open_sheets.add(name)
+        peak = max(peak, len(open_sheets))
+
+        def tracking_close():
+            # Give sheets submitted too early the time to load while this one is still open
+            time.sleep(0.05)
+            open_sheets.discard(name)
+            close()
+        return rows, height, tracking_close
+
+    monkeypatch.setattr(excel_engine, '_load_sheet', tracking_load_sheet)
+    reader = excel_engine.iter_read_excel(io.BytesIO(split_workbook(n_sheets=6)), 2, engine='calamine',
+                                          sheets='all', read_ahead=1)
+    next(reader)
+    reader.close()
+    # Stopping after the first chunk released the current sheet and the one loaded ahead
+    assert len(loaded) <= 2
+    assert not open_sheets
+
+    peak = 0
+    list(excel_engine.iter_read_excel(io.BytesIO(split_workbook(n_sheets=6)), 2, engine='calamine',
+                                      sheets='all', read_ahead=1))
+    assert peak <= 2
+    assert not open_sheets
+
+
+def test_openpyxl_workbooks_are_closed_for_skipped_sheets(monkeypatch):
+    closed = []
+    load_workbook = excel_engine.load_workbook
+
+    def tracking_load_workbook(*args, **kwargs):
+        workbook = load_workbook(*args, **kwargs)
+        close = workbook.close
+        workbook.close = lambda: (closed.append(True), close())
+        return workbook
+
+    monkeypatch.setattr(excel_engine, 'load_workbook', tracking_load_workbook)
+    df = excel_engine.read_excel(io.BytesIO(split_workbook(n_sheets=2)), engine='openpyxl', sheets='all')
+    assert len(df) == 10
+    # One workbook for the sheet names and one per sheet, the skipped 'Notes' sheet included
+    assert len(closed) == 4
+
+
+@pytest.mark.parametrize('engine', ['calamine', 'openpyxl'])
+def test_only_the_first_sheet_is_read_by_default(engine):
+    require(engine)
+    df = excel_engine.read_excel(io.BytesIO(split_workbook(n_sheets=3)), engine=engine)
+    assert df['NAME'].tolist() == [f'n0-{i}' for i in range(5)]
+
+
+@pytest.mark.parametrize('engine', ['calamine', 'openpyxl'])
+@pytest.mark.parametrize('read_ahead', [0, 1, 3])
+def test_skipped_sheets_between_data_sheets_do_not_stop_reading(engine, read_ahead):
+    require(engine)
+    data = workbook_bytes({
+        'First': [['x'], [1], [2], [3]],
+        'Empty': [],
+        'Notes': [['note'], ['not contact data']],
+        'Also empty': [],
+        'Second': [['x'], [4], [5], [6]],
+        'More notes': [['note']],
+        'Third': [['x'], [7], [8], [9]],
+    })
+    chunks = excel_engine.iter_read_excel(io.BytesIO(data), 2, engine=engine, sheets='all', read_ahead=read_ahead)
+    df = pd.concat([chunk for chunk, _ in chunks])
+    assert df['x'].tolist() == list(range(1, 10))
+
+
+@pytest.mark.parametrize('engine', ['calamine', 'openpyxl'])
+def test_empty_sheets_are_read_as_no_rows(engine):
+    require(engine)
+    data = workbook_bytes({'Empty': []})
+    assert excel_engine.read_excel(io.BytesIO(data), engine=engine).empty
+    assert excel_engine.read_excel(io.BytesIO(data), engine=engine, sheets='all').empty
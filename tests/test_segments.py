@@ -0,0 +1,69 @@
+import re
+
+import pandas as pd
+import pytest
+
+from datafunctions.segments import SegmentEngine, SegmentError, canonical, parse_segment, tokenize
+from datafunctions.tag_index import TagIndexCache
+
+
+def test_tokenize_kinds_and_keywords():
+    assert tokenize("sms and `Personal City` STARTS with 'San Jose' OR zip >= 20000") == [
+        ('word', 'sms'), ('keyword', 'AND'), ('ident', 'Personal City'), ('keyword', 'STARTS'),
+        ('keyword', 'WITH'), ('value', 'San Jose'), ('keyword', 'OR'), ('word', 'zip'),
+        ('op', '>='), ('word', '20000'),
+    ]
+
+
+def test_tokenize_unescapes_quoted_values():
+    assert tokenize(r"tag = 'O\'Brien'") == [('word', 'tag'), ('op', '='), ('value', "O'Brien")]
+
+
+def test_not_binds_tighter_than_and_and_and_tighter_than_or():
+    assert parse_segment("a OR NOT b AND c") == ('or', (('and', (('not', ('tag', 'b')), ('tag', 'c'))), ('tag', 'a')))
+
+
+def test_parentheses_override_precedence():
+    assert parse_segment("(a OR b) AND c") == ('and', (('or', (('tag', 'a'), ('tag', 'b'))), ('tag', 'c')))
+
+
+def test_predicates():
+    assert parse_segment("state IN (VA, PA, VA)") == ('in', 'state', ('PA', 'VA'))
+    assert parse_segment("state = VA") == ('in', 'state', ('VA',))
+    assert parse_segment("state != VA") == ('not', ('in', 'state', ('VA',)))
+    assert parse_segment("city STARTS WITH 'San'") == ('prefix', 'city', 'San')
+    assert parse_segment("zip >= 20000") == ('compare', 'zip', '>=', '20000')
+    assert parse_segment("'social media'") == ('tag', 'social media')
+
+
+def test_canonical_form_of_equivalent_queries_is_equal():
+    assert parse_segment("a AND (b AND c)") == parse_segment("c AND b AND a AND a")
+    assert parse_segment("NOT NOT a") == ('tag', 'a')
+    assert canonical(('or', (('tag', 'b'), ('or', (('tag', 'a'), ('tag', 'b')))))) == ('or', (('tag', 'a'), ('tag', 'b')))
+
+
+@pytest.mark.parametrize("query, message", [
+    ("", "The query is empty"),
+    ("sms AND", "Unexpected end of query at position 7"),
+    ("(sms OR email", "Unexpected end of query at position 13"),
+    ("sms email", "Unexpected 'email' at position 4"),
+    ("sms AND )", "Unexpected ')' at position 8"),
+    ("state IN VA", "Expected ( but found 'VA' at position 9"),
+    ("state IN (VA PA)", "Expected ) but found 'PA' at position 13"),
+    ("zip >= (", "Expected a value but found '(' at position 7"),
+    ("`Personal City` AND sms", "Column `Personal City` at position 0 must be followed by a condition"),
+    ("sms AND 'email", "Unexpected character at position 8"),
+])
+def test_malformed_queries_report_the_position(query, message):
+    with pytest.raises(SegmentError, match=re.escape(message)):
+        parse_segment(query)
+
+
+def test_mask_cache_is_bounded_by_bytes():
+    df = pd.DataFrame({'Tag': ['sms', 'email', 'sms, email', ''] * 250})
+    engine = SegmentEngine(filter_engine=None, tag_indexes=TagIndexCache(), max_bytes=2500)
+    mask = engine.mask('v1', df, "sms AND NOT email")
+    assert mask.tolist()[:4] == [True, False, False, False]
+    # Four 1000-byte masks were computed, at most two of them fit
+    assert engine._bytes <= 2500
+    assert len(engine._masks) == 2
@@ -0,0 +1,60 @@
+import pandas as pd
+
+from datafunctions.tag_index import TagIndex
+
+
+def make_index(values):
+    column = pd.Series(values, name='Tag')
+    return column, TagIndex.from_series(column)
+
+
+def test_from_series_counts_and_bitmaps():
+    column, index = make_index(['sms, email', 'email', '', None, 'reader, sms'])
+    assert index.counts == {'sms': 2, 'email': 2, 'reader': 1}
+    assert index.bitmaps['sms'].tolist() == [True, False, False, False, True]
+    assert 'email' in index
+    assert 'social' not in index
+    assert index.count('social') == 0
+
+
+def test_add_tags_to_every_row_once():
+    column, index = make_index(['sms', '', 'email, sms'])
+    updated, new_index = index.add(['sms', 'social'], column)
+    assert updated.tolist() == ['sms, social', 'sms, social', 'email, sms, social']
+    assert new_index.counts == {'sms': 3, 'email': 1, 'social': 3}
+    assert new_index.counts == TagIndex.from_series(updated).counts
+    # The untouched tag's bitmap is shared, the original index is unchanged
+    assert new_index.bitmaps['email'] is index.bitmaps['email']
+    assert index.counts == {'sms': 2, 'email': 1}
+
+
+def test_remove_tags_only_rewrites_affected_rows():
+    column, index = make_index(['sms, email', 'email', 'reader'])
+    updated, new_index = index.remove(['email', 'missing'], column)
+    assert updated.tolist() == ['sms', '', 'reader']
+    assert new_index.counts == {'sms': 1, 'reader': 1}
+    assert new_index.counts == TagIndex.from_series(updated).counts
+    assert 'email' not in new_index
+
+
+def test_remove_unknown_tags_returns_the_same_index():
+    column, index = make_index(['sms'])
+    updated, new_index = index.remove(['email'], column)
+    assert updated is column
+    assert new_index is index
+
+
+def test_counts_are_not_recomputed_on_update(monkeypatch):
+    column, index = make_index(['sms', 'email'])
+    # An incremental update passes the counts on instead of counting every bitmap again
+    calls = []
+    original_init = TagIndex.__init__
+
+    def counting_init(self, bitmaps, n_rows, counts=None):
+        calls.append(counts)
+        original_init(self, bitmaps, n_rows, counts)
+
+    monkeypatch.setattr(TagIndex, '__init__', counting_init)
+    index.add(['reader'], column)
+    index.remove(['sms'], column)
+    assert all(counts is not None for counts in calls)
@@ -0,0 +1,21 @@
+"""
+WSGI application factories for production servers.
+
+Example:
+    gunicorn "wsgi:create_api_app()"
+    gunicorn "wsgi:create_dash_app()"
+
+See serve.py for the recommended way to run both with the right worker settings.
+"""
+
+
+def create_api_app():
+    """Return the Flask data processing API."""
+    from api import app
+    return app
+
+
+def create_dash_app():
+    """Return the Flask server behind the Dash app."""
+    from app import app
+    return app.server